@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+import datetime
+import functools
+import threading
+
+import enums
+import config
+
+from peewee import fn
+
+from steamcommerce_api.api import logger
+
+log = logger.Logger('edge.bot_pool', 'edge.bot_pool.log').get_logger()
+
+
+class EdgeBotPool(object):
+    '''
+    Every EdgeBot loaded once per cycle, indexed by (currency_code, bot_type, status)
+    and by network_id. Status and block time changes are applied in memory and
+    written back by flush() with one UPDATE per distinct value. Status writes are a
+    compare-and-set on the status the bot was loaded with, so a change made in the
+    meantime by another stage, a checkout or a cron process is never overwritten.
+
+    The pool also tracks each bot's load (users routed and invitations sent this
+    cycle, carts in flight, friends list fill) so select_edge_bot can spread
+    users over every eligible bot, and which edge server hosts each bot.
+    '''
+
+    def __init__(self, edge_bot_model, edge_task_model, edge_server_model, block_threshold):
+        self.edge_bot_model = edge_bot_model
+        self.edge_task_model = edge_task_model
+        self.edge_server_model = edge_server_model
+        self.block_threshold = block_threshold
+
+        self.load_weights = {
+            'assignments': 1.0,
+            'invitations': 1.0,
+            'carts': 5.0,
+            'friends': 10.0
+        }
+
+        self.load_weights.update(getattr(config, 'EDGE_BOT_LOAD_WEIGHTS', {}))
+        self.friends_limit = getattr(config, 'EDGE_BOT_FRIENDS_LIMIT', 250)
+
+        self.lock = threading.RLock()
+
+        self.edge_bots = {}
+        self.index = {}
+
+        self.loaded_statuses = {}
+        self.pending_statuses = {}
+        self.pending_blocks = {}
+
+        self.assignments = {}
+        self.invitations = {}
+        self.carts_in_flight = {}
+        self.friends_counts = {}
+
+        self.edge_servers = {}
+        self.edge_bot_hosts = {}
+        self.edge_server_assignments = {}
+
+    def get_index_key(self, edge_bot):
+        return (edge_bot.currency_code, int(edge_bot.bot_type), int(edge_bot.status))
+
+    def add_to_index(self, edge_bot):
+        index_key = self.get_index_key(edge_bot)
+
+        if index_key not in self.index.keys():
+            self.index[index_key] = []
+
+        self.index[index_key].append(edge_bot)
+
+    def remove_from_index(self, edge_bot):
+        self.index[self.get_index_key(edge_bot)].remove(edge_bot)
+
+    def load(self):
+        edge_bots = self.edge_bot_model.select().order_by(self.edge_bot_model.id.asc())
+
+        pending_tasks = self.edge_task_model.select(
+            self.edge_task_model.edge_bot,
+            fn.COUNT(self.edge_task_model.id)
+        ).where(
+            self.edge_task_model.task_status == 'PENDING'
+        ).group_by(
+            self.edge_task_model.edge_bot
+        ).tuples()
+
+        pending_tasks = dict(pending_tasks)
+
+        edge_servers = self.edge_server_model.select().where(
+            self.edge_server_model.status == enums.EEdgeServerStatus.Enabled
+        ).order_by(self.edge_server_model.id.asc())
+
+        # A bot lives on the edge server that ran its latest task, unless EDGE_BOT_SERVERS says otherwise
+
+        latest_tasks = self.edge_task_model.select(
+            fn.MAX(self.edge_task_model.id)
+        ).group_by(
+            self.edge_task_model.edge_bot
+        )
+
+        edge_bot_hosts = dict(self.edge_task_model.select(
+            self.edge_task_model.edge_bot,
+            self.edge_task_model.edge_server
+        ).where(
+            self.edge_task_model.id << latest_tasks
+        ).tuples())
+
+        with self.lock:
+            self.edge_servers = {}
+            self.edge_bot_hosts = {}
+
+            for edge_server in edge_servers:
+                self.edge_servers.setdefault(edge_server.currency_code, []).append(edge_server)
+
+            self.edge_bots = {}
+            self.index = {}
+            self.loaded_statuses = {}
+            self.carts_in_flight = {}
+
+            for edge_bot in edge_bots:
+                self.edge_bots[edge_bot.network_id] = edge_bot
+                self.loaded_statuses[edge_bot.network_id] = int(edge_bot.status)
+                self.add_to_index(edge_bot)
+
+                self.carts_in_flight[edge_bot.network_id] = pending_tasks.get(edge_bot.id, 0)
+
+                if edge_bot.id in edge_bot_hosts.keys():
+                    self.edge_bot_hosts[edge_bot.network_id] = edge_bot_hosts[edge_bot.id]
+
+            self.edge_bot_hosts.update(getattr(config, 'EDGE_BOT_SERVERS', {}))
+
+        log.info(u'Loaded {} edge bots'.format(len(self.edge_bots)))
+
+        return self
+
+    def is_blocked(self, edge_bot):
+        return edge_bot.last_blocked_at is not None and edge_bot.last_blocked_at >= self.block_threshold
+
+    def get_edge_bots(self, status, bot_type):
+        with self.lock:
+            return [
+                edge_bot for index_key, edge_bots in sorted(self.index.items())
+                if index_key[1] == int(bot_type) and index_key[2] == int(status)
+                for edge_bot in edge_bots
+            ]
+
+    def get_edge_bots_for_currency(self, currency_code, bot_type, status=enums.EEdgeBotStatus.StandingBy):
+        with self.lock:
+            return [
+                edge_bot for edge_bot in self.index.get((currency_code, int(bot_type), int(status)), [])
+                if not self.is_blocked(edge_bot)
+            ]
+
+    def get_edge_bot_by_network_id(self, network_id, status=enums.EEdgeBotStatus.StandingBy):
+        with self.lock:
+            edge_bot = self.edge_bots.get(network_id)
+
+            if not edge_bot or int(edge_bot.status) != int(status) or self.is_blocked(edge_bot):
+                return None
+
+            return edge_bot
+
+    def get_load(self, edge_bot):
+        network_id = edge_bot.network_id
+
+        friends_fill = float(self.friends_counts.get(network_id, 0)) / self.friends_limit
+
+        return (
+            self.load_weights['assignments'] * self.assignments.get(network_id, 0) +
+            self.load_weights['invitations'] * self.invitations.get(network_id, 0) +
+            self.load_weights['carts'] * self.carts_in_flight.get(network_id, 0) +
+            self.load_weights['friends'] * friends_fill
+        )
+
+    def select_edge_bot(
+        self,
+        currency_code,
+        bot_type,
+        preferred_network_ids=None,
+        invitation_limit=None,
+        excluded_network_ids=None
+    ):
+        '''
+        Picks the least loaded StandingBy bot for currency_code. Bots in
+        preferred_network_ids win over the rest, and bots in excluded_network_ids
+        or that already have invitation_limit invitations planned or sent this cycle
+        are skipped. Its load only grows once record_assignment or record_invitation
+        is called for it.
+        '''
+
+        with self.lock:
+            edge_bots = [
+                edge_bot for edge_bot in self.get_edge_bots_for_currency(currency_code, bot_type)
+                if (
+                    (invitation_limit is None or self.invitations.get(edge_bot.network_id, 0) < invitation_limit) and
+                    edge_bot.network_id not in (excluded_network_ids or [])
+                )
+            ]
+
+            if not len(edge_bots):
+                return None
+
+            preferred_network_ids = set(str(network_id) for network_id in preferred_network_ids or [])
+
+            preferred_edge_bots = [
+                edge_bot for edge_bot in edge_bots if str(edge_bot.network_id) in preferred_network_ids
+            ]
+
+            return min(preferred_edge_bots or edge_bots, key=self.get_load)
+
+    def get_edge_servers_for_currency(self, currency_code):
+        with self.lock:
+            return list(self.edge_servers.get(currency_code, []))
+
+    def get_edge_bot_host(self, network_id):
+        with self.lock:
+            return self.edge_bot_hosts.get(network_id)
+
+    def get_edge_server_assignments(self, edge_server_id):
+        with self.lock:
+            return self.edge_server_assignments.get(edge_server_id, 0)
+
+    def record_assignment(self, network_id, edge_server_id):
+        '''
+        Counts a user routed to network_id on edge_server_id, once the pair is actually used
+        '''
+
+        with self.lock:
+            self.edge_bot_hosts[network_id] = edge_server_id
+
+            self.assignments[network_id] = self.assignments.get(network_id, 0) + 1
+            self.edge_server_assignments[edge_server_id] = self.edge_server_assignments.get(edge_server_id, 0) + 1
+
+    def record_invitation(self, network_id):
+        '''
+        Counts an invitation network_id is about to send, as soon as its bot is picked
+        '''
+
+        with self.lock:
+            self.invitations[network_id] = self.invitations.get(network_id, 0) + 1
+
+            return self.invitations[network_id]
+
+    def release_invitation(self, network_id):
+        '''
+        Takes back a planned invitation that was not sent after all
+        '''
+
+        with self.lock:
+            self.invitations[network_id] = max(self.invitations.get(network_id, 0) - 1, 0)
+
+            return self.invitations[network_id]
+
+    def record_friends_count(self, network_id, friends_count):
+        with self.lock:
+            self.friends_counts[network_id] = friends_count
+
+    def set_status(self, network_id, status):
+        with self.lock:
+            edge_bot = self.edge_bots.get(network_id)
+
+            if edge_bot:
+                self.remove_from_index(edge_bot)
+                edge_bot.status = int(status)
+                self.add_to_index(edge_bot)
+
+            self.pending_statuses[network_id] = int(status)
+
+    def set_block_time(self, network_id, blocked_at=None):
+        blocked_at = blocked_at or datetime.datetime.now()
+
+        with self.lock:
+            edge_bot = self.edge_bots.get(network_id)
+
+            if edge_bot:
+                edge_bot.last_blocked_at = blocked_at
+
+            self.pending_blocks[network_id] = blocked_at
+
+    def flush(self):
+        with self.lock:
+            pending_statuses = self.pending_statuses
+            pending_blocks = self.pending_blocks
+
+            self.pending_statuses = {}
+            self.pending_blocks = {}
+
+            loaded_statuses = dict(self.loaded_statuses)
+
+        network_ids_by_transition = {}
+
+        for network_id, status in pending_statuses.items():
+            loaded_status = loaded_statuses.get(network_id)
+
+            if loaded_status == status:
+                continue
+
+            network_ids_by_transition.setdefault((loaded_status, status), []).append(network_id)
+
+        for (loaded_status, status), network_ids in network_ids_by_transition.items():
+            conditions = [self.edge_bot_model.network_id << network_ids]
+
+            if loaded_status is not None:
+                conditions.append(self.edge_bot_model.status == loaded_status)
+
+            updated = self.edge_bot_model.update(status=status).where(*conditions).execute()
+
+            if loaded_status is not None and updated < len(network_ids):
+                log.info(
+                    u'{0} of {1} edge bots left {2} before their status was written, kept as is'.format(
+                        len(network_ids) - updated,
+                        len(network_ids),
+                        repr(enums.EEdgeBotStatus(loaded_status))
+                    )
+                )
+
+            with self.lock:
+                for network_id in network_ids:
+                    self.loaded_statuses[network_id] = status
+
+        network_ids_by_block = {}
+
+        for network_id, blocked_at in pending_blocks.items():
+            network_ids_by_block.setdefault(blocked_at, []).append(network_id)
+
+        for blocked_at, network_ids in network_ids_by_block.items():
+            self.edge_bot_model.update(last_blocked_at=blocked_at).where(
+                self.edge_bot_model.network_id << network_ids
+            ).execute()
+
+        return len(pending_statuses) + len(pending_blocks)
+
+
+def pooled(func):
+    '''
+    Runs an EdgeController method with controller.edge_bot_pool loaded, flushing the
+    pool's status changes when it returns. Nested calls reuse the outer pool.
+    '''
+
+    @functools.wraps(func)
+    def wrapper(controller, *args, **kwargs):
+        if controller.edge_bot_pool is not None:
+            return func(controller, *args, **kwargs)
+
+        controller.edge_bot_pool = EdgeBotPool(
+            controller.edge_bot_model,
+            controller.edge_task_model,
+            controller.edge_server_model,
+            controller.get_block_threshold()
+        ).load()
+
+        try:
+            return func(controller, *args, **kwargs)
+        finally:
+            edge_bot_pool = controller.edge_bot_pool
+            controller.edge_bot_pool = None
+
+            edge_bot_pool.flush()
+
+    return wrapper
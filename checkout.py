@@ -0,0 +1,618 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+import re
+import time
+import threading
+
+from multiprocessing.pool import ThreadPool
+
+import enums
+import state
+import config
+
+from controllers.relations import RelationController
+
+from steamcommerce_api.api import logger
+
+log = logger.Logger('edge.checkout', 'edge.checkout.log').get_logger()
+
+
+class BitcoinCheckoutPipeline(object):
+    '''
+    Bitcoin checkouts as a state machine per shoppingCartGID:
+
+        RequestingTransactionLink -> WaitingForTransactionLink -> FetchingInvoice ->
+        ReservingFunds -> SendingMoney -> CommittingRelations -> ResettingCart -> Completed
+
+    Checkouts are shared by every process through a locked file in EDGE_STATE_DIR.
+    Each change is merged into the checkout it belongs to under the lock, after
+    checking the stage it expects, so processes never undo each other's transitions.
+    They are advanced on a pool of EDGE_CHECKOUT_WORKERS threads, so many carts move
+    at once and a restart resumes each one at its last stage. Every stage can safely
+    run again: the Coinbase send is keyed by the shoppingCartGID, and a stage that
+    fails is retried every EDGE_CHECKOUT_RETRY_INTERVAL seconds, up to
+    EDGE_CHECKOUT_MAX_ATTEMPTS times. Waiting for funds is retried without a limit.
+
+    A transaction link that fails, or has not arrived EDGE_CHECKOUT_LINK_TIMEOUT seconds
+    after it was requested, is requested again, up to EDGE_CHECKOUT_MAX_ATTEMPTS times.
+    '''
+
+    def __init__(self, edge_controller, workers=None, retry_interval=None, max_attempts=None, state_file=None):
+        self.edge_controller = edge_controller
+
+        self.workers = workers or getattr(config, 'EDGE_CHECKOUT_WORKERS', 4)
+        self.retry_interval = retry_interval or getattr(config, 'EDGE_CHECKOUT_RETRY_INTERVAL', 60)
+        self.max_attempts = max_attempts or getattr(config, 'EDGE_CHECKOUT_MAX_ATTEMPTS', 5)
+        self.link_timeout = getattr(config, 'EDGE_CHECKOUT_LINK_TIMEOUT', 4200)
+        self.retention = getattr(config, 'EDGE_CHECKOUT_RETENTION', 86400)
+
+        self.bitpay_api_url = getattr(config, 'BITPAY_API_URL', 'https://bitpay.com')
+
+        self.state_file = state_file or state.JsonStateFile('checkouts')
+
+        self.lock = threading.RLock()
+
+        self.running = set()
+
+        self.pool = None
+        self.results = []
+
+        self.handlers = {
+            enums.ECheckoutStage.RequestingTransactionLink: self.request_transaction_link,
+            enums.ECheckoutStage.WaitingForTransactionLink: self.wait_for_transaction_link,
+            enums.ECheckoutStage.FetchingInvoice: self.fetch_invoice,
+            enums.ECheckoutStage.ReservingFunds: self.reserve_funds,
+            enums.ECheckoutStage.SendingMoney: self.send_money,
+            enums.ECheckoutStage.CommittingRelations: self.commit_relations,
+            enums.ECheckoutStage.ResettingCart: self.reset_cart
+        }
+
+    '''
+    Persistence
+    '''
+
+    def get_checkouts(self):
+        return self.state_file.load()
+
+    def get_checkout(self, shopping_cart_gid):
+        return self.get_checkouts().get(str(shopping_cart_gid))
+
+    def update_checkout(self, shopping_cart_gid, expected_stage=None, **changes):
+        '''
+        Applies changes to a checkout, unless it has moved on from expected_stage (a
+        stage or a tuple of stages) in the meantime. Returns whether the changes were applied.
+        '''
+
+        shopping_cart_gid = str(shopping_cart_gid)
+
+        if expected_stage is not None and not isinstance(expected_stage, tuple):
+            expected_stage = (expected_stage,)
+
+        applied = []
+
+        def apply_changes(checkouts):
+            checkout = checkouts.get(shopping_cart_gid)
+
+            if checkout is None:
+                return checkouts
+
+            if expected_stage is not None and checkout['stage'] not in [int(stage) for stage in expected_stage]:
+                return checkouts
+
+            checkout.update(changes)
+            checkout['updated_at'] = time.time()
+
+            applied.append(True)
+
+            return checkouts
+
+        self.state_file.update(apply_changes)
+
+        return bool(applied)
+
+    def create_checkout(self, shopping_cart_gid, edge_bot_id, edge_server_id, stage, replace=(), **fields):
+        '''
+        Creates the checkout unless one exists at a stage other than those in replace.
+        Returns the new checkout, or None when one was kept.
+        '''
+
+        checkout = {
+            'shopping_cart_gid': str(shopping_cart_gid),
+            'edge_bot_id': edge_bot_id,
+            'edge_server_id': edge_server_id,
+            'stage': int(stage),
+            'attempts': 0,
+            'retry_at': None,
+            'created_at': time.time(),
+            'updated_at': time.time()
+        }
+
+        checkout.update(fields)
+
+        created = []
+
+        def add_checkout(checkouts):
+            existing = checkouts.get(checkout['shopping_cart_gid'])
+
+            if existing is None or existing['stage'] in [int(stage) for stage in replace]:
+                checkouts[checkout['shopping_cart_gid']] = checkout
+
+                created.append(checkout)
+
+            return checkouts
+
+        self.state_file.update(add_checkout)
+
+        return checkout if created else None
+
+    '''
+    Entry points
+    '''
+
+    def start(self, edge_bot, edge_server, transid, shopping_cart_gid):
+        checkout = self.create_checkout(
+            shopping_cart_gid,
+            edge_bot.id,
+            edge_server.id,
+            enums.ECheckoutStage.RequestingTransactionLink,
+            replace=(enums.ECheckoutStage.Failed,),
+            transid=transid
+        )
+
+        if not checkout:
+            log.info(u'Checkout for shoppingCartGID {} was already started'.format(shopping_cart_gid))
+
+            return None
+
+        return self.submit(shopping_cart_gid)
+
+    def receive_transaction_link(self, edge_task, shopping_cart_gid, link):
+        # Links requested before the pipeline existed still get checked out
+
+        self.create_checkout(
+            shopping_cart_gid,
+            edge_task.edge_bot.id,
+            edge_task.edge_server.id,
+            enums.ECheckoutStage.WaitingForTransactionLink
+        )
+
+        if not self.update_checkout(
+            shopping_cart_gid,
+            expected_stage=(
+                enums.ECheckoutStage.RequestingTransactionLink,
+                enums.ECheckoutStage.WaitingForTransactionLink
+            ),
+            stage=int(enums.ECheckoutStage.FetchingInvoice),
+            link=link,
+            attempts=0,
+            retry_at=None
+        ):
+            log.info(u'Checkout for shoppingCartGID {} already has its link'.format(shopping_cart_gid))
+
+            return None
+
+        return self.submit(shopping_cart_gid)
+
+    def fail_transaction_link(self, edge_task):
+        '''
+        Called when the get_external_link_from_transid task edge_task failed or expired.
+        Returns False when no checkout is waiting on that task.
+        '''
+
+        for checkout in self.get_checkouts().values():
+            if checkout.get('link_edge_task_id') == edge_task.id:
+                break
+        else:
+            return False
+
+        if checkout['stage'] != enums.ECheckoutStage.WaitingForTransactionLink:
+            log.info(
+                u'Checkout for shoppingCartGID {} is no longer waiting for its link'.format(
+                    checkout['shopping_cart_gid']
+                )
+            )
+
+            return True
+
+        if not self.retry_transaction_link(checkout):
+            return True
+
+        self.submit(checkout['shopping_cart_gid'])
+
+        return True
+
+    def retry_transaction_link(self, checkout):
+        '''
+        Sends a checkout waiting for its link back to RequestingTransactionLink, or fails
+        it once the link was requested EDGE_CHECKOUT_MAX_ATTEMPTS times
+        '''
+
+        link_attempts = checkout.get('link_attempts', 0) + 1
+
+        if link_attempts >= self.max_attempts:
+            log.error(
+                u'Transaction link for shoppingCartGID {0} failed {1} times'.format(
+                    checkout['shopping_cart_gid'],
+                    link_attempts
+                )
+            )
+
+            self.fail(checkout, enums.ECheckoutStage.WaitingForTransactionLink)
+
+            return False
+
+        log.info(u'Requesting the transaction link for shoppingCartGID {} again'.format(checkout['shopping_cart_gid']))
+
+        return self.update_checkout(
+            checkout['shopping_cart_gid'],
+            expected_stage=enums.ECheckoutStage.WaitingForTransactionLink,
+            stage=int(enums.ECheckoutStage.RequestingTransactionLink),
+            link_attempts=link_attempts,
+            link_edge_task_id=None,
+            attempts=0,
+            retry_at=time.time() + self.retry_interval
+        )
+
+    def submit(self, shopping_cart_gid):
+        with self.lock:
+            if str(shopping_cart_gid) in self.running:
+                return None
+
+            self.running.add(str(shopping_cart_gid))
+
+            if self.pool is None:
+                self.pool = ThreadPool(self.workers)
+
+            result = self.pool.apply_async(self.run, (str(shopping_cart_gid),))
+            self.results.append(result)
+
+        return result
+
+    def resume(self):
+        '''
+        Submits every unfinished checkout whose retry time has come and drops
+        finished ones older than EDGE_CHECKOUT_RETENTION seconds
+        '''
+
+        now = time.time()
+        due = []
+
+        def drop_finished(checkouts):
+            for shopping_cart_gid, checkout in checkouts.items():
+                stage = enums.ECheckoutStage(checkout['stage'])
+
+                if stage in (enums.ECheckoutStage.Completed, enums.ECheckoutStage.Failed):
+                    if now - checkout['updated_at'] > self.retention:
+                        del checkouts[shopping_cart_gid]
+
+                    continue
+
+                if stage not in self.handlers.keys():
+                    continue
+
+                if checkout.get('retry_at') and checkout['retry_at'] > now:
+                    continue
+
+                due.append(shopping_cart_gid)
+
+            return checkouts
+
+        self.state_file.update(drop_finished)
+
+        return len([shopping_cart_gid for shopping_cart_gid in due if self.submit(shopping_cart_gid)])
+
+    def wait(self):
+        while True:
+            with self.lock:
+                results = self.results
+                self.results = []
+
+            if not len(results):
+                return None
+
+            for result in results:
+                result.wait()
+
+    def close(self):
+        self.wait()
+
+        with self.lock:
+            pool = self.pool
+            self.pool = None
+
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    '''
+    Stage machinery
+    '''
+
+    def run(self, shopping_cart_gid):
+        try:
+            return self.advance(shopping_cart_gid)
+        except Exception:
+            log.exception(u'Checkout for shoppingCartGID {} raised an exception'.format(shopping_cart_gid))
+        finally:
+            with self.lock:
+                self.running.discard(shopping_cart_gid)
+
+    def advance(self, shopping_cart_gid):
+        while True:
+            # Read again before every stage, another process may have moved the checkout on
+
+            checkout = self.get_checkout(shopping_cart_gid)
+
+            if not checkout:
+                return None
+
+            stage = enums.ECheckoutStage(checkout['stage'])
+
+            handler = self.handlers.get(stage)
+
+            if not handler:
+                return stage
+
+            if checkout.get('retry_at') and checkout['retry_at'] > time.time():
+                return stage
+
+            log.info(u'Checkout for shoppingCartGID {0} at stage {1}'.format(shopping_cart_gid, repr(stage)))
+
+            try:
+                next_stage = handler(checkout)
+            except Exception:
+                log.exception(
+                    u'Checkout for shoppingCartGID {0} raised an exception at stage {1}'.format(
+                        shopping_cart_gid,
+                        repr(stage)
+                    )
+                )
+
+                next_stage = None
+
+            if next_stage is None:
+                attempts = checkout['attempts'] + 1
+
+                if attempts >= self.max_attempts:
+                    log.error(
+                        u'Checkout for shoppingCartGID {0} failed {1} times at stage {2}'.format(
+                            shopping_cart_gid,
+                            attempts,
+                            repr(stage)
+                        )
+                    )
+
+                    self.fail(checkout, stage)
+
+                    return enums.ECheckoutStage.Failed
+
+                self.update_checkout(
+                    shopping_cart_gid,
+                    expected_stage=stage,
+                    attempts=attempts,
+                    retry_at=time.time() + self.retry_interval
+                )
+
+                return stage
+
+            if next_stage == stage:
+                # The handler parked the checkout until its retry_at
+
+                return stage
+
+            if not self.update_checkout(
+                shopping_cart_gid,
+                expected_stage=stage,
+                stage=int(next_stage),
+                attempts=0,
+                retry_at=None
+            ):
+                # Moved on by someone else (a transaction link arriving), carry on from there
+
+                continue
+
+    def fail(self, checkout, stage=None):
+        self.set_edge_bot_status(checkout, enums.EEdgeBotStatus.BlockedForUnknownReason)
+
+        self.update_checkout(
+            checkout['shopping_cart_gid'],
+            expected_stage=stage,
+            stage=int(enums.ECheckoutStage.Failed)
+        )
+
+    def set_edge_bot_status(self, checkout, status):
+        # Written straight to the row, checkouts run outside of any controller's bot pool
+
+        self.edge_controller.edge_bot_model.update(status=int(status)).where(
+            self.edge_controller.edge_bot_model.id == checkout['edge_bot_id']
+        ).execute()
+
+    def get_edge_bot_and_server(self, checkout):
+        edge_bot = self.edge_controller.edge_bot_model.get(id=checkout['edge_bot_id'])
+        edge_server = self.edge_controller.edge_server_model.get(id=checkout['edge_server_id'])
+
+        return edge_bot, edge_server
+
+    '''
+    Stages
+    '''
+
+    def request_transaction_link(self, checkout):
+        edge_bot, edge_server = self.get_edge_bot_and_server(checkout)
+
+        edge_task_id = self.edge_controller.get_transaction_link(edge_bot, edge_server, checkout['transid'])
+
+        if not edge_task_id:
+            return None
+
+        self.update_checkout(
+            checkout['shopping_cart_gid'],
+            expected_stage=enums.ECheckoutStage.RequestingTransactionLink,
+            link_edge_task_id=edge_task_id,
+            link_requested_at=time.time()
+        )
+
+        return enums.ECheckoutStage.WaitingForTransactionLink
+
+    def wait_for_transaction_link(self, checkout):
+        link_requested_at = checkout.get('link_requested_at') or checkout['updated_at']
+
+        if time.time() - link_requested_at <= self.link_timeout:
+            # Parked until the link arrives or its timeout, whichever comes first
+
+            self.update_checkout(
+                checkout['shopping_cart_gid'],
+                expected_stage=enums.ECheckoutStage.WaitingForTransactionLink,
+                retry_at=link_requested_at + self.link_timeout
+            )
+
+            return enums.ECheckoutStage.WaitingForTransactionLink
+
+        log.error(
+            u'Transaction link for shoppingCartGID {0} did not arrive within {1} seconds'.format(
+                checkout['shopping_cart_gid'],
+                self.link_timeout
+            )
+        )
+
+        self.retry_transaction_link(checkout)
+
+        return enums.ECheckoutStage.WaitingForTransactionLink
+
+    def fetch_invoice(self, checkout):
+        if checkout.get('btc_due'):
+            return enums.ECheckoutStage.ReservingFunds
+
+        invoice_matches = re.findall('/i/([a-zA-Z0-9]+)', checkout['link'], re.DOTALL)
+
+        if not len(invoice_matches):
+            log.error(u'Failed to extract invoice_id from {}'.format(checkout['link']))
+
+            self.fail(checkout, enums.ECheckoutStage.FetchingInvoice)
+
+            return enums.ECheckoutStage.FetchingInvoice
+
+        invoice_id = invoice_matches[0]
+        log.info(u'Found bitpay invoice_id {}'.format(invoice_id))
+
+        bitpay_response = self.edge_controller.http_client.get(
+            '{0}/invoices/{1}'.format(self.bitpay_api_url, invoice_id),
+            name=u'Bitpay API',
+            server='bitpay',
+            endpoint='/invoices/'
+        )
+
+        if not bitpay_response.ok:
+            return None
+
+        data = (bitpay_response.data or {}).get('data')
+
+        if not data:
+            log.error(u'Bitpay returned no data for invoice id {}'.format(invoice_id))
+
+            return None
+
+        if data.get('status') != 'new':
+            log.error(u'Bitpay Invoice id {0} status is {1}'.format(invoice_id, data.get('status')))
+
+            self.fail(checkout, enums.ECheckoutStage.FetchingInvoice)
+
+            return enums.ECheckoutStage.FetchingInvoice
+
+        log.info(
+            u'Invoice BTC price is {0} (${1} {2}) to address {3}'.format(
+                data.get('btcDue'),
+                data.get('price'),
+                data.get('currency'),
+                data.get('bitcoinAddress')
+            )
+        )
+
+        self.update_checkout(
+            checkout['shopping_cart_gid'],
+            invoice_id=invoice_id,
+            btc_due=data.get('btcDue'),
+            to_address=data.get('bitcoinAddress')
+        )
+
+        return enums.ECheckoutStage.ReservingFunds
+
+    def reserve_funds(self, checkout):
+        coinbase_wallet = self.edge_controller.coinbase_wallet
+
+        if coinbase_wallet.reserve(checkout['shopping_cart_gid'], checkout['btc_due']):
+            return enums.ECheckoutStage.SendingMoney
+
+        log.info(u'Insufficient Coinbase funds for shoppingCartGID {}'.format(checkout['shopping_cart_gid']))
+
+        self.set_edge_bot_status(checkout, enums.EEdgeBotStatus.WaitingForSufficientFunds)
+
+        self.update_checkout(
+            checkout['shopping_cart_gid'],
+            retry_at=time.time() + self.retry_interval
+        )
+
+        return enums.ECheckoutStage.ReservingFunds
+
+    def send_money(self, checkout):
+        if checkout.get('transaction_id'):
+            return enums.ECheckoutStage.CommittingRelations
+
+        coinbase_wallet = self.edge_controller.coinbase_wallet
+
+        log.info(
+            u'Sending {0} BTC to address {1} for shoppingCartGID {2}'.format(
+                checkout['btc_due'],
+                checkout['to_address'],
+                checkout['shopping_cart_gid']
+            )
+        )
+
+        try:
+            tx = coinbase_wallet.send_money(
+                checkout['shopping_cart_gid'],
+                checkout['to_address'],
+                checkout['btc_due']
+            )
+        except Exception, e:
+            log.error(u'Unable to perform Coinbase transaction, raised {}'.format(e))
+
+            coinbase_wallet.release(checkout['shopping_cart_gid'])
+
+            self.fail(checkout, enums.ECheckoutStage.SendingMoney)
+
+            return enums.ECheckoutStage.SendingMoney
+
+        coinbase_wallet.commit(checkout['shopping_cart_gid'])
+
+        log.info(
+            u'Coinbase transaction id {0} created for {1} BTC ({2} {3})'.format(
+                tx.get('id'),
+                tx.get('amount').get('amount'),
+                tx.get('native_amount').get('amount'),
+                tx.get('native_amount').get('currency')
+            )
+        )
+
+        self.update_checkout(checkout['shopping_cart_gid'], transaction_id=tx.get('id'))
+
+        return enums.ECheckoutStage.CommittingRelations
+
+    def commit_relations(self, checkout):
+        RelationController().commit_purchased_relations(
+            checkout['shopping_cart_gid'],
+            self.edge_controller.owner_id
+        )
+
+        return enums.ECheckoutStage.ResettingCart
+
+    def reset_cart(self, checkout):
+        edge_bot, edge_server = self.get_edge_bot_and_server(checkout)
+
+        if not self.edge_controller.reset_shopping_cart(edge_bot, edge_server):
+            return None
+
+        self.set_edge_bot_status(checkout, enums.EEdgeBotStatus.StandingBy)
+
+        return enums.ECheckoutStage.Completed
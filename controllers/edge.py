@@ -1,14 +1,24 @@
 #!/usr/bin/env python
 # -*- coding:Utf-8 -*-
 
-import re
 import time
 import json
-import requests
 import datetime
 
 import enums
 import config
+import workers
+import health
+import wallet
+import checkout
+import metrics
+import bot_pool
+import friends_cache
+import edge_http
+import invalidation
+import task_schedule
+
+from peewee import fn
 
 from controllers.relations import RelationController
 
@@ -17,14 +27,32 @@ from steamcommerce_api.core import models
 
 from steam import SteamID
 from steam.enums import EResult
-from coinbase.wallet.client import Client
 
 log = logger.Logger('edge.controller', 'edge.controller.log').get_logger()
 
 
 class EdgeController(object):
-    def __init__(self, owner_id):
+    def __init__(
+        self,
+        owner_id,
+        http_client=None,
+        health_registry=None,
+        friends_list_cache=None,
+        edge_task_schedule=None,
+        coinbase_wallet=None,
+        checkout_pipeline=None
+    ):
         self.owner_id = owner_id
+        self.http_client = http_client or edge_http.EdgeHttpClient()
+        self.friends_list_cache = friends_list_cache or friends_cache.FriendsListCache()
+        self.edge_task_schedule = edge_task_schedule or task_schedule.EdgeTaskSchedule()
+        self.coinbase_wallet = coinbase_wallet or wallet.CoinbaseWallet()
+        self.checkout_pipeline = checkout_pipeline or checkout.BitcoinCheckoutPipeline(self)
+
+        # The background refresh is started once per process by its owner (edge_daemon),
+        # never here, so controllers sharing a registry never pile up health threads
+
+        self.health_registry = health_registry or health.EdgeServerHealthRegistry(self.probe_edge_server)
 
         self.user_model = models.User
         self.userrequest_model = models.UserRequest
@@ -33,6 +61,9 @@ class EdgeController(object):
         self.edge_task_model = models.EdgeTask
         self.edge_server_model = models.EdgeServer
 
+        self.edge_bot_pool = None
+        self.batch_unsupported_servers = set()
+
     '''
     Task methods
     '''
@@ -45,6 +76,8 @@ class EdgeController(object):
 
         edge_task.save()
 
+        self.edge_task_schedule.add(edge_task)
+
         log.info(
             u'Created task_id {0} for network_id {1} on edge server #{2}'.format(
                 edge_task.task_id,
@@ -62,54 +95,193 @@ class EdgeController(object):
             self.edge_task_model.task_id == task_id
         ).execute()
 
+    def claim_edge_task(self, edge_task):
+        '''
+        Moves a PENDING task to PROCESSING, returns False when a poll or a callback
+        already claimed it, so its result is never applied twice.
+        '''
+
+        claimed = self.edge_task_model.update(
+            task_status='PROCESSING'
+        ).where(
+            self.edge_task_model.task_id == edge_task.task_id,
+            self.edge_task_model.task_status == 'PENDING'
+        ).execute()
+
+        return claimed == 1
+
+    def reclaim_processing_tasks(self):
+        '''
+        Hands tasks that stayed PROCESSING for longer than EDGE_TASK_PROCESSING_TIMEOUT
+        seconds back to polling, the process that claimed them died before finishing them.
+        Returns how many tasks were reclaimed.
+        '''
+
+        processing_timeout = getattr(config, 'EDGE_TASK_PROCESSING_TIMEOUT', 600)
+
+        edge_tasks = self.edge_task_model.select().where(
+            self.edge_task_model.task_status == 'PROCESSING'
+        )
+
+        processing_task_ids = set()
+        reclaimed = 0
+
+        for edge_task in edge_tasks:
+            processing_task_ids.add(str(edge_task.task_id))
+
+            processing_since = self.edge_task_schedule.mark_processing(edge_task)
+
+            if time.time() - processing_since <= processing_timeout:
+                continue
+
+            self.edge_task_schedule.clear_processing(edge_task.task_id)
+
+            reset = self.edge_task_model.update(
+                task_status='PENDING'
+            ).where(
+                self.edge_task_model.task_id == edge_task.task_id,
+                self.edge_task_model.task_status == 'PROCESSING'
+            ).execute()
+
+            if reset == 1:
+                log.error(
+                    u'Edge task {0} id {1} was left PROCESSING, handing it back to polling'.format(
+                        edge_task.task_name,
+                        edge_task.task_id
+                    )
+                )
+
+                reclaimed += 1
+
+        # Tasks that were finished in the meantime no longer need watching
+
+        for task_id in self.edge_task_schedule.get_processing_task_ids():
+            if task_id not in processing_task_ids:
+                self.edge_task_schedule.forget(task_id)
+
+        return reclaimed
+
+    def forget_edge_task(self, edge_task, task_status):
+        entry = self.edge_task_schedule.forget(edge_task.task_id)
+
+        if entry:
+            metrics.edge_task_duration_seconds.observe(
+                time.time() - entry['first_seen'],
+                task_name=edge_task.task_name,
+                task_status=task_status
+            )
+
+    def fail_edge_task(self, edge_task, task_status='FAILURE', reported=True):
+        '''
+        Ends a PENDING task that failed remotely or outlived its deadline. Relations
+        pushed by a failed add_subids_to_cart go back to Uncommited and its bot
+        back to StandingBy. A failed checkout_cart empties the bot's cart the same way,
+        while one that expired may still have gone through, so its bot is blocked for review.
+
+        reported is False when the edge server could not tell how the task ended (its
+        status lookup failed), the relations are then left alone and the bot of a cart
+        task is blocked for review.
+        '''
+
+        self.forget_edge_task(edge_task, task_status)
+
+        failed = self.edge_task_model.update(
+            task_status=task_status
+        ).where(
+            self.edge_task_model.task_id == edge_task.task_id,
+            self.edge_task_model.task_status == 'PENDING'
+        ).execute()
+
+        if failed != 1:
+            return False
+
+        if not reported and edge_task.task_name in ('add_subids_to_cart', 'checkout_cart'):
+            log.error(
+                u'Outcome of {0} on network id {1} is unknown, blocking it until reviewed'.format(
+                    edge_task.task_name,
+                    edge_task.edge_bot.network_id
+                )
+            )
+
+            self.set_edge_bot_status(
+                edge_task.edge_bot.network_id,
+                enums.EEdgeBotStatus.BlockedForUnknownReason.value
+            )
+        elif edge_task.task_name == 'add_subids_to_cart':
+            RelationController().rollback_pushed_relations(edge_task.task_id)
+
+            self.set_edge_bot_status(
+                edge_task.edge_bot.network_id,
+                enums.EEdgeBotStatus.StandingBy.value
+            )
+        elif edge_task.task_name == 'checkout_cart':
+            self.fail_cart_checkout(edge_task, task_status)
+        elif edge_task.task_name == 'get_external_link_from_transid':
+            self.fail_transaction_link(edge_task)
+
+        return True
+
+    def fail_cart_checkout(self, edge_task, task_status):
+        network_id = edge_task.edge_bot.network_id
+
+        if task_status == 'EXPIRED':
+            log.error(
+                u'Checkout on network id {} expired without a result, blocking it until reviewed'.format(network_id)
+            )
+
+            self.set_edge_bot_status(network_id, enums.EEdgeBotStatus.BlockedForUnknownReason.value)
+
+            return None
+
+        RelationController().rollback_cart_relations(network_id)
+
+        self.reset_shopping_cart(edge_task.edge_bot, edge_task.edge_server)
+
+        self.set_edge_bot_status(network_id, enums.EEdgeBotStatus.StandingBy.value)
+
     def get_pending_tasks(self):
-        return self.edge_task_model.select().where(
+        '''
+        PENDING tasks whose next poll is due, expired ones included
+        '''
+
+        selected_at = time.time()
+
+        edge_tasks = list(self.edge_task_model.select().where(
             self.edge_task_model.task_status == 'PENDING'
+        ).order_by(
+            self.edge_task_model.id.asc()
+        ))
+
+        # Entries of tasks another process finished are dropped, so the schedule never grows past the open tasks
+
+        self.edge_task_schedule.retain(
+            [edge_task.task_id for edge_task in edge_tasks] + self.edge_task_schedule.get_processing_task_ids(),
+            selected_at
         )
 
+        return [edge_task for edge_task in edge_tasks if self.edge_task_schedule.is_due(edge_task)]
+
     def process_cart_result(self, edge_task, task_result):
         succesful_items = task_result.get('items')
         failed_items = task_result.get('failed_items')
         failed_shopping_cart_gids = task_result.get('failed_shopping_cart_gids')
 
-        RelationController().rollback_pushed_relations(edge_task.task_id)
-
         if len(failed_shopping_cart_gids):
             log.info(u'Received a list of previously commited shoppingCartGID that failed')
 
-            for shopping_cart_gid in failed_shopping_cart_gids:
-                if shopping_cart_gid is not None:
-                    RelationController().rollback_failed_relations(shopping_cart_gid)
-
         if len(failed_items):
             log.info(u'Received a list of relations that fail to add to cart')
 
-            for item in failed_items:
-                relation_type = item.get('relation_type')
-                relation_id = item.get('relation_id')
-
-                RelationController().set_relation_commitment(
-                    relation_type,
-                    relation_id,
-                    enums.ERelationCommitment.FailedToAddToCart.value,
-                    edge_task.task_id,
-                    commited_on_bot=edge_task.edge_bot.network_id
-                )
-
         log.info(u'Received {} succesful items'.format(len(succesful_items)))
 
-        for item in succesful_items:
-            shopping_cart_gid = task_result.get('shoppingCartGID')
-
-            relation_type = item.get('relation_type')
-            relation_id = item.get('relation_id')
-
-            RelationController().set_relation_commitment(
-                relation_type,
-                relation_id,
-                enums.ERelationCommitment.AddedToCart.value,
-                shopping_cart_gid=shopping_cart_gid
-            )
+        RelationController().apply_cart_result(
+            edge_task.task_id,
+            edge_task.edge_bot.network_id,
+            succesful_items,
+            failed_items,
+            failed_shopping_cart_gids,
+            task_result.get('shoppingCartGID')
+        )
 
         if len(succesful_items):
             # Assume there is one cart-push per user, so just grab the first on the list
@@ -185,7 +357,12 @@ class EdgeController(object):
 
             if result == EResult.OK:
                 if payment_method == 'bitcoin':
-                    self.get_transaction_link(edge_task.edge_bot, edge_task.edge_server, transid)
+                    self.checkout_pipeline.start(
+                        edge_task.edge_bot,
+                        edge_task.edge_server,
+                        transid,
+                        shopping_cart_gid
+                    )
                 elif payment_method == 'steamaccount':
                     RelationController().commit_purchased_relations(shopping_cart_gid, self.owner_id)
 
@@ -194,14 +371,25 @@ class EdgeController(object):
                         enums.EEdgeBotStatus.StandingBy.value
                     )
 
+    def fail_transaction_link(self, edge_task):
+        '''
+        The checkout waiting on edge_task requests its link again or fails, a bot whose
+        link no checkout is waiting for is blocked
+        '''
+
+        if self.checkout_pipeline.fail_transaction_link(edge_task):
+            return None
+
+        self.set_edge_bot_status(
+            edge_task.edge_bot.network_id,
+            enums.EEdgeBotStatus.BlockedForUnknownReason.value
+        )
+
     def process_external_transaction(self, edge_task, task_result):
         if type(task_result) is int:
             log.error(u'Unable to complete external transaction, received {}'.format(task_result))
 
-            self.set_edge_bot_status(
-                edge_task.edge_bot.network_id,
-                enums.EEdgeBotStatus.BlockedForUnknownReason.value
-            )
+            self.fail_transaction_link(edge_task)
 
             return None
 
@@ -211,217 +399,223 @@ class EdgeController(object):
         if not bitpay_url:
             log.error(u'Failed to retrieve a bitpay invoice url')
 
-            self.set_edge_bot_status(
-                edge_task.edge_bot.network_id,
-                enums.EEdgeBotStatus.BlockedForUnknownReason.value
-            )
+            self.fail_transaction_link(edge_task)
 
             return None
 
         log.info(u'Received bitpay url {}'.format(bitpay_url))
 
-        invoice_matches = re.findall('/i/([a-zA-Z0-9]+)', bitpay_url, re.DOTALL)
+        # Invoice, funds, payment and cart reset are advanced by the checkout pipeline
 
-        if not len(invoice_matches):
-            log.error(u'Failed to extract invoice_id from {}'.format(bitpay_url))
+        self.checkout_pipeline.receive_transaction_link(edge_task, shopping_cart_gid, bitpay_url)
 
-            self.set_edge_bot_status(
-                edge_task.edge_bot.network_id,
-                enums.EEdgeBotStatus.BlockedForUnknownReason.value
-            )
-
-            return None
+    def get_task_callback(self, task_name):
+        callbacks = {
+            'add_subids_to_cart': self.process_cart_result,
+            'checkout_cart': self.process_cart_checkout,
+            'get_external_link_from_transid': self.process_external_transaction
+        }
 
-        invoice_id = invoice_matches[0]
-        log.info(u'Found bitpay invoice_id {}'.format(invoice_id))
+        return callbacks.get(task_name)
 
-        try:
-            req = requests.get('https://bitpay.com/invoices/{}'.format(invoice_id), timeout=(10.0, 20.0))
-        except requests.exceptions.Timeout:
-            log.error(u'Bitpay API timed out')
+    def process_task_response(self, edge_task, response):
+        if not response:
+            # The edge server could not be reached, the task is polled again until its deadline
 
-            self.set_edge_bot_status(
-                edge_task.edge_bot.network_id,
-                enums.EEdgeBotStatus.BlockedForUnknownReason.value
-            )
+            self.edge_task_schedule.record_poll(edge_task)
 
             return None
-        except Exception, e:
-            log.error(u'Unable to contact Bitpay API, raised {}'.format(e))
 
-            self.set_edge_bot_status(
-                edge_task.edge_bot.network_id,
-                enums.EEdgeBotStatus.BlockedForUnknownReason.value
-            )
+        if not response.get('success'):
+            log.info(u'Failed to retrieve task status for {}'.format(edge_task.task_id))
+
+            self.fail_edge_task(edge_task, reported=False)
 
             return None
 
-        try:
-            response = req.json()
-        except ValueError:
-            log.error(u'Unable to serialize data, received {}'.format(req.text))
+        task_result = response.get('task_result')
+        task_status = response.get('task_status')
 
-            self.set_edge_bot_status(
-                edge_task.edge_bot.network_id,
-                enums.EEdgeBotStatus.BlockedForUnknownReason.value
-            )
+        if task_status == 'PENDING' or task_status == 'RUNNING':
+            log.info(u'Edge task {} has not been completed yet'.format(edge_task.task_id))
+
+            self.edge_task_schedule.record_poll(edge_task)
 
             return None
 
-        data = response.get('data')
+        if task_status == 'FAILURE':
+            log.error(u'Edge task id {} returned FAILURE'.format(edge_task.task_id))
 
-        if data.get('status') != 'new':
-            log.error(u'Bitpay Invoice id {0} status is {1}'.format(invoice_id, data.get('status')))
-
-            self.set_edge_bot_status(
-                edge_task.edge_bot.network_id,
-                enums.EEdgeBotStatus.BlockedForUnknownReason.value
-            )
+            self.fail_edge_task(edge_task)
 
             return None
 
         log.info(
-            u'Invoice BTC price is {0} (${1} {2}) to address {3}'.format(
-                data.get('btcDue'),
-                data.get('price'),
-                data.get('currency'),
-                data.get('bitcoinAddress')
+            u'Received SUCCESS on task {0} id {1}'.format(
+                edge_task.task_name,
+                edge_task.task_id
             )
         )
 
-        client = Client(config.COINBASE_API_KEY, config.COINBASE_API_SECRET)
-        primary_account = client.get_primary_account()
+        if not self.claim_edge_task(edge_task):
+            log.info(u'Edge task {} is already being processed'.format(edge_task.task_id))
 
-        if float(primary_account.get('balance').get('amount')) < float(data.get('btcDue')):
-            log.info(u'Insufficient Coinbase funds for transaction')
+            return None
 
-            self.set_edge_bot_status(
-                edge_task.edge_bot.network_id,
-                enums.EEdgeBotStatus.WaitingForSufficientFunds.value
-            )
+        self.forget_edge_task(edge_task, task_status)
+
+        task_callback = self.get_task_callback(edge_task.task_name)
+
+        if not task_callback:
+            log.error(u'Could not find a callback for task {}'.format(edge_task.task_name))
+
+            self.update_edge_task_status(edge_task.task_id, task_status)
 
             return None
 
-        btc_amount = data.get('btcDue')
-        to_address = data.get('bitcoinAddress')
+        if not task_result:
+            log.error(u'Received SUCCESS from task id {} but no result was found'.format(edge_task.task_id))
 
-        log.info(
-            u'Sending {0} BTC to address {1} for shoppingCartGID {2}'.format(
-                btc_amount,
-                to_address,
-                shopping_cart_gid
-            )
-        )
+            self.update_edge_task_status(edge_task.task_id, task_status)
+
+            return None
 
         try:
-            tx = primary_account.send_money(
-                to=to_address,
-                amount=btc_amount,
-                currency='BTC',
-                idem=str(shopping_cart_gid)
-            )
-        except Exception, e:
-            log.error(u'Unable to perform Coinbase transaction, raised {}'.format(e))
+            task_callback.__call__(edge_task, task_result)
+        except:
+            # Hand the task back to polling so the result is retried
 
-            self.set_edge_bot_status(
-                edge_task.edge_bot.network_id,
-                enums.EEdgeBotStatus.BlockedForUnknownReason.value
-            )
+            self.update_edge_task_status(edge_task.task_id, 'PENDING')
+
+            raise
+
+        self.update_edge_task_status(edge_task.task_id, task_status)
+
+    @invalidation.buffered
+    def process_task_callback(self, task_id, response):
+        '''
+        Applies a task state pushed by an edge server. Returns None for an unknown
+        task_id, False when the task is no longer PENDING and True otherwise.
+        '''
+
+        try:
+            edge_task = self.edge_task_model.get(self.edge_task_model.task_id == task_id)
+        except self.edge_task_model.DoesNotExist:
+            log.error(u'Received a callback for unknown task id {}'.format(task_id))
 
             return None
 
+        if edge_task.task_status != 'PENDING':
+            return False
+
         log.info(
-            u'Coinbase transaction id {0} created for {1} BTC ({2} {3})'.format(
-                tx.get('id'),
-                tx.get('amount').get('amount'),
-                tx.get('native_amount').get('amount'),
-                tx.get('native_amount').get('currency')
-            )
+            u'Processing callback for task {0} id {1}'.format(edge_task.task_name, edge_task.task_id)
         )
 
-        RelationController().commit_purchased_relations(shopping_cart_gid, self.owner_id)
-        self.reset_shopping_cart(edge_task.edge_bot, edge_task.edge_server)
+        self.process_task_response(edge_task, response)
 
-        self.set_edge_bot_status(
-            edge_task.edge_bot.network_id,
-            enums.EEdgeBotStatus.StandingBy.value
-        )
-
-    def get_task_callback(self, task_name):
-        callbacks = {
-            'add_subids_to_cart': self.process_cart_result,
-            'checkout_cart': self.process_cart_checkout,
-            'get_external_link_from_transid': self.process_external_transaction
-        }
+        return True
 
-        return callbacks.get(task_name)
+    def get_edge_bot_task_statuses(self, edge_tasks):
+        # Resolve every edge_server before fanning out so worker threads never hit the database
 
-    def process_pending_tasks(self):
-        edge_tasks = self.get_pending_tasks()
-        tasks_count = edge_tasks.count()
+        edge_servers = {}
+        edge_server_tasks = {}
 
-        if not tasks_count:
-            return None
+        for edge_task in edge_tasks:
+            edge_server = edge_task.edge_server
 
-        log.info(u'Processing {} pending tasks'.format(tasks_count))
+            if edge_server.id not in edge_server_tasks.keys():
+                edge_servers[edge_server.id] = edge_server
+                edge_server_tasks[edge_server.id] = []
 
-        for edge_task in edge_tasks:
-            log.info(
-                u'Processing task {0} id {1}'.format(edge_task.task_name, edge_task.task_id)
-            )
+            edge_server_tasks[edge_server.id].append(edge_task)
 
-            response = self.get_edge_bot_task_status(edge_task)
+        poll_workers = getattr(config, 'EDGE_TASK_POLL_WORKERS', 8)
+        poll_per_server = getattr(config, 'EDGE_TASK_POLL_PER_SERVER', 2)
+        batch_size = getattr(config, 'EDGE_TASK_BATCH_SIZE', 50)
 
-            if not response:
-                self.update_edge_task_status(edge_task.task_id, 'FAILURE')
+        batches = []
 
+        for edge_server_id in sorted(edge_server_tasks.keys()):
+            if edge_server_id in self.batch_unsupported_servers:
                 continue
 
-            if not response.get('success'):
-                log.info(u'Failed to retrieve task status for {}'.format(edge_task.task_id))
-                self.update_edge_task_status(edge_task.task_id, 'FAILURE')
+            server_tasks = edge_server_tasks[edge_server_id]
 
-                continue
+            for offset in range(0, len(server_tasks), batch_size):
+                batches.append((edge_servers[edge_server_id], server_tasks[offset:offset + batch_size]))
+
+        batch_responses = workers.map_bounded(
+            lambda batch: self.get_edge_bot_task_status_batch(*batch),
+            batches,
+            lambda batch: batch[0].id,
+            workers=poll_workers,
+            per_key=poll_per_server
+        )
 
-            task_result = response.get('task_result')
-            task_status = response.get('task_status')
+        responses = {}
 
-            if task_status == 'PENDING' or task_status == 'RUNNING':
-                log.info(u'Edge task {} has not been completed yet'.format(edge_task.task_id))
+        for batch_response in batch_responses:
+            if batch_response is not None:
+                responses.update(batch_response)
 
-                continue
+        # Servers without the batch endpoint, and tasks a batch did not answer for, are polled one by one
 
-            if task_status == 'FAILURE':
-                log.error(u'Edge task id {} returned FAILURE'.format(edge_task.task_id))
+        remaining_tasks = [edge_task for edge_task in edge_tasks if edge_task.task_id not in responses]
 
-                continue
+        remaining_responses = workers.map_bounded(
+            self.get_edge_bot_task_status,
+            remaining_tasks,
+            lambda edge_task: edge_task.edge_server.id,
+            workers=poll_workers,
+            per_key=poll_per_server
+        )
 
-            log.info(
-                u'Received SUCCESS on task {0} id {1}'.format(
-                    edge_task.task_name,
-                    edge_task.task_id
-                )
-            )
+        for edge_task, response in zip(remaining_tasks, remaining_responses):
+            responses[edge_task.task_id] = response
 
-            task_callback = self.get_task_callback(edge_task.task_name)
+        return [responses.get(edge_task.task_id) for edge_task in edge_tasks]
 
-            if not task_callback:
-                log.error(u'Could not find a callback for task {}'.format(edge_task.task_name))
+    @invalidation.buffered
+    @bot_pool.pooled
+    def process_pending_tasks(self):
+        self.checkout_pipeline.resume()
+        self.reclaim_processing_tasks()
 
-                self.update_edge_task_status(edge_task.task_id, task_status)
+        edge_tasks = []
+
+        for edge_task in self.get_pending_tasks():
+            if not self.edge_task_schedule.is_expired(edge_task):
+                edge_tasks.append(edge_task)
 
                 continue
 
-            if not task_result:
-                log.error(u'Received SUCCESS from task id {} but no result was found'.format(edge_task.task_id))
+            log.error(u'Edge task {0} id {1} expired'.format(edge_task.task_name, edge_task.task_id))
 
-                self.update_edge_task_status(edge_task.task_id, task_status)
+            self.fail_edge_task(edge_task, 'EXPIRED')
 
-                continue
+        tasks_count = len(edge_tasks)
 
-            task_callback.__call__(edge_task, task_result)
+        if not tasks_count:
+            self.edge_task_schedule.save()
 
-            self.update_edge_task_status(edge_task.task_id, task_status)
+            return None
+
+        log.info(u'Processing {} pending tasks'.format(tasks_count))
+
+        responses = self.get_edge_bot_task_statuses(edge_tasks)
+
+        # Callbacks run sequentially in task id order, whatever order the polls completed in
+
+        for edge_task, response in zip(edge_tasks, responses):
+            log.info(
+                u'Processing task {0} id {1}'.format(edge_task.task_name, edge_task.task_id)
+            )
+
+            self.process_task_response(edge_task, response)
+
+        self.edge_task_schedule.save()
 
     def get_edge_bot_task_status(self, edge_task):
         url = self.get_edge_api_url(edge_task.edge_server.ip_address, 'task/state/')
@@ -431,71 +625,236 @@ class EdgeController(object):
             'task_id': edge_task.task_id
         }
 
-        try:
-            req = requests.post(url, data=data, timeout=(10.0, 20.0))
-        except requests.exceptions.Timeout:
-            log.error(u'Edge server #{} timed out'.format(edge_task.edge_server.id))
+        edge_response = self.http_client.edge_post(edge_task.edge_server, url, data=data)
 
+        if not edge_response.ok:
             return None
-        except Exception, e:
-            log.error(u'Unable to contact edge server, raised {}'.format(e))
 
-            return None
+        return edge_response.data
 
-        if req.status_code != 200:
-            log.error(u'Unable to contact edge server, received status code {}'.format(req.status_code))
+    def get_edge_bot_task_status_batch(self, edge_server, edge_tasks):
+        '''
+        Returns a dict of task_id -> task state response, or None when the
+        edge server does not implement the batch endpoint.
+        '''
 
-            return None
+        url = self.get_edge_api_url(edge_server.ip_address, 'task/state/batch/')
 
-        try:
-            response = req.json()
-        except ValueError:
-            log.error(u'Unable to serialize response from edge server, received {}'.format(req.text))
+        data = {
+            'tasks': json.dumps([
+                {'task_name': edge_task.task_name, 'task_id': edge_task.task_id} for edge_task in edge_tasks
+            ])
+        }
+
+        failed_responses = dict((edge_task.task_id, None) for edge_task in edge_tasks)
+
+        edge_response = self.http_client.edge_post(edge_server, url, data=data)
+
+        if edge_response.status_code in (404, 405, 501):
+            log.info(u'Edge server #{} does not support batched task states'.format(edge_server.id))
+
+            self.batch_unsupported_servers.add(edge_server.id)
 
             return None
 
-        return response
+        if not edge_response.ok:
+            return failed_responses
+
+        response = edge_response.data
+
+        if not response.get('success'):
+            log.error(
+                u'Edge server #{0} rejected batched task states with {1}'.format(
+                    edge_server.id,
+                    response.get('result')
+                )
+            )
+
+            return failed_responses
+
+        task_states = response.get('tasks') or {}
+
+        return dict(
+            (edge_task.task_id, task_states.get(edge_task.task_id))
+            for edge_task in edge_tasks if edge_task.task_id in task_states
+        )
 
     '''
     Edge methods
     '''
 
+    def get_block_threshold(self):
+        block_cooldown = getattr(config, 'EDGE_BOT_BLOCK_COOLDOWN', 1.5)
+
+        return datetime.datetime.now() - datetime.timedelta(hours=block_cooldown)
+
+    def get_unblocked_condition(self):
+        # Bots blocked longer ago than the cooldown count as unblocked without rewriting the row
+
+        return (
+            (self.edge_bot_model.last_blocked_at >> None) |
+            (self.edge_bot_model.last_blocked_at < self.get_block_threshold())
+        )
+
     def unblock_blocked_bots(self):
-        time_delta = datetime.datetime.now() - datetime.timedelta(hours=1.5)
+        # Lookups already treat expired blocks as lifted, this only clears the rows
 
         return self.edge_bot_model.update(
             last_blocked_at=None
         ).where(
-            self.edge_bot_model.last_blocked_at < time_delta
+            self.edge_bot_model.last_blocked_at < self.get_block_threshold()
         ).execute()
 
+    def collect_metrics(self):
+        edge_bots = self.edge_bot_model.select(
+            self.edge_bot_model.currency_code,
+            self.edge_bot_model.status,
+            fn.COUNT(self.edge_bot_model.id)
+        ).group_by(
+            self.edge_bot_model.currency_code,
+            self.edge_bot_model.status
+        ).tuples()
+
+        metrics.edge_bots.clear()
+
+        for currency_code, status, edge_bots_count in edge_bots:
+            metrics.edge_bots.set(
+                edge_bots_count,
+                currency_code=currency_code,
+                status=enums.EEdgeBotStatus(status).name
+            )
+
+        RelationController().collect_metrics()
+
     def get_edge_servers(self):
         return self.edge_server_model.select()
 
     def get_edge_bots(self, status=enums.EEdgeBotStatus.StandingBy, bot_type=enums.EEdgeBotType.Purchases):
-        self.unblock_blocked_bots()
+        if self.edge_bot_pool is not None:
+            return self.edge_bot_pool.get_edge_bots(status, bot_type)
 
         return self.edge_bot_model.select().where(
             self.edge_bot_model.status == status,
             self.edge_bot_model.bot_type == bot_type
         )
 
+    def get_edge_servers_for_currency(self, currency_code):
+        if self.edge_bot_pool is not None:
+            return self.edge_bot_pool.get_edge_servers_for_currency(currency_code)
+
+        return list(self.edge_server_model.select().where(
+            self.edge_server_model.currency_code == currency_code,
+            self.edge_server_model.status == enums.EEdgeServerStatus.Enabled
+        ).order_by(
+            self.edge_server_model.id.asc()
+        ))
+
+    def get_edge_server_latency(self, edge_server):
+        edge_server_health = self.health_registry.get(edge_server.id)
+
+        if not edge_server_health:
+            return None
+
+        return edge_server_health.latency or edge_server_health.delay
+
+    def get_edge_server_load(self, edge_server):
+        if self.edge_bot_pool is not None:
+            assignments = self.edge_bot_pool.get_edge_server_assignments(edge_server.id)
+        else:
+            assignments = 0
+
+        latency = self.get_edge_server_latency(edge_server) or 1.0
+
+        return (assignments + 1) * max(latency, 0.001)
+
+    def get_healthy_edge_servers(self, currency_code):
+        # Slower servers get proportionally fewer bots, unhealthy ones get none
+
+        edge_servers = [
+            edge_server for edge_server in self.get_edge_servers_for_currency(currency_code)
+            if self.edge_server_is_healthy(edge_server)
+        ]
+
+        return sorted(edge_servers, key=self.get_edge_server_load)
+
     def get_edge_server_for_currency(self, currency_code):
-        try:
-            return self.edge_server_model.get(
-                currency_code=currency_code,
-                status=enums.EEdgeServerStatus.Enabled
-            )
-        except self.edge_server_model.DoesNotExist:
+        edge_servers = self.get_healthy_edge_servers(currency_code)
+
+        if not len(edge_servers):
             return None
 
+        return edge_servers[0]
+
+    def get_edge_bot_host(self, edge_bot):
+        if self.edge_bot_pool is not None:
+            return self.edge_bot_pool.get_edge_bot_host(edge_bot.network_id)
+
+        edge_bot_servers = getattr(config, 'EDGE_BOT_SERVERS', {})
+
+        if edge_bot.network_id in edge_bot_servers.keys():
+            return edge_bot_servers[edge_bot.network_id]
+
+        latest_tasks = self.edge_task_model.select(
+            self.edge_task_model.edge_server
+        ).where(
+            self.edge_task_model.edge_bot == edge_bot.id
+        ).order_by(
+            self.edge_task_model.id.desc()
+        ).limit(1).tuples()
+
+        for (edge_server_id,) in latest_tasks:
+            return edge_server_id
+
+        return None
+
+    def get_edge_server_for_bot(self, edge_bot):
+        '''
+        The healthy edge server hosting edge_bot, or the least loaded healthy one of its
+        currency for a bot that has no host yet. Health comes from the registry's cached
+        state, and only the hosting server's is looked up for a hosted bot.
+        '''
+
+        edge_server_id = self.get_edge_bot_host(edge_bot)
+
+        if edge_server_id is None:
+            edge_servers = self.get_healthy_edge_servers(edge_bot.currency_code)
+        else:
+            edge_servers = [
+                edge_server for edge_server in self.get_edge_servers_for_currency(edge_bot.currency_code)
+                if edge_server.id == edge_server_id and self.edge_server_is_healthy(edge_server)
+            ]
+
+            if not len(edge_servers):
+                log.info(
+                    u'Edge server #{0} hosting edge bot with network id {1} is not currently healthy'.format(
+                        edge_server_id,
+                        edge_bot.network_id
+                    )
+                )
+
+                return None
+
+        if not len(edge_servers):
+            log.info(u'Not available edge server found for currency {}'.format(edge_bot.currency_code))
+
+            return None
+
+        return edge_servers[0]
+
+    def record_edge_bot_assignment(self, edge_bot, edge_server):
+        # Only bots actually handed a user count towards the bot and server load weights
+
+        if self.edge_bot_pool is not None:
+            self.edge_bot_pool.record_assignment(edge_bot.network_id, edge_server.id)
+
     def get_edge_bot_by_network_id(self, network_id):
-        self.unblock_blocked_bots()
+        if self.edge_bot_pool is not None:
+            return self.edge_bot_pool.get_edge_bot_by_network_id(network_id)
 
         edge_bots = self.edge_bot_model.select().where(
             self.edge_bot_model.network_id == network_id,
             self.edge_bot_model.status == enums.EEdgeBotStatus.StandingBy,
-            self.edge_bot_model.last_blocked_at == None
+            self.get_unblocked_condition()
         )
 
         if not edge_bots.count():
@@ -503,21 +862,76 @@ class EdgeController(object):
 
         return edge_bots[0]
 
-    def get_edge_bot_for_currency(self, currency_code, bot_type=enums.EEdgeBotType.Purchases):
-        self.unblock_blocked_bots()
+    def get_edge_bot_for_currency(
+        self,
+        currency_code,
+        bot_type=enums.EEdgeBotType.Purchases,
+        preferred_network_ids=None,
+        invitation_limit=None,
+        excluded_network_ids=None
+    ):
+        if self.edge_bot_pool is not None:
+            return self.edge_bot_pool.select_edge_bot(
+                currency_code,
+                bot_type,
+                preferred_network_ids=preferred_network_ids,
+                invitation_limit=invitation_limit,
+                excluded_network_ids=excluded_network_ids
+            )
 
-        edge_bots = self.edge_bot_model.select().where(
+        conditions = [
             self.edge_bot_model.currency_code == currency_code,
             self.edge_bot_model.status == enums.EEdgeBotStatus.StandingBy,
             self.edge_bot_model.bot_type == bot_type,
-            self.edge_bot_model.last_blocked_at == None
-        )
+            self.get_unblocked_condition()
+        ]
+
+        if excluded_network_ids:
+            conditions.append(self.edge_bot_model.network_id.not_in(excluded_network_ids))
+
+        edge_bots = self.edge_bot_model.select().where(*conditions)
 
         if not edge_bots.count():
             return None
 
         return edge_bots[0]
 
+    def get_routable_edge_bot(
+        self,
+        currency_code,
+        bot_type=enums.EEdgeBotType.Purchases,
+        preferred_network_ids=None,
+        invitation_limit=None,
+        excluded_network_ids=None
+    ):
+        '''
+        Returns an (edge_bot, edge_server) pair for currency_code, skipping bots
+        whose edge server is down so the next bot (and server) takes over.
+        '''
+
+        excluded_network_ids = list(excluded_network_ids or [])
+
+        while True:
+            edge_bot = self.get_edge_bot_for_currency(
+                currency_code,
+                bot_type=bot_type,
+                preferred_network_ids=preferred_network_ids,
+                invitation_limit=invitation_limit,
+                excluded_network_ids=excluded_network_ids
+            )
+
+            if not edge_bot:
+                return None, None
+
+            edge_server = self.get_edge_server_for_bot(edge_bot)
+
+            if edge_server:
+                self.record_edge_bot_assignment(edge_bot, edge_server)
+
+                return edge_bot, edge_server
+
+            excluded_network_ids.append(edge_bot.network_id)
+
     def get_edge_api_url(self, ip_address, endpoint_name):
         return 'http://{0}/edge/{1}'.format(ip_address, endpoint_name)
 
@@ -531,41 +945,46 @@ class EdgeController(object):
             self.edge_server_model.id == edge_server_id
         ).execute()
 
-    def edge_server_is_healthy(self, edge_server):
+    def probe_edge_server(self, edge_server):
         url = self.get_edge_api_url(edge_server.ip_address, 'healthcheck')
 
         requested_at = time.time()
         HEADERS = {'X-Requested-At': str(requested_at)}
 
-        try:
-            req = requests.get(url, headers=HEADERS, timeout=(10.0, 20.0))
-        except requests.exceptions.Timeout:
-            log.error(u'Edge server #{} timed out'.format(edge_server.id))
-
-            return False
-        except Exception, e:
-            log.error(u'Unable to contact edge server, raised {}'.format(e))
+        edge_response = self.http_client.edge_get(edge_server, url, headers=HEADERS, decode=False)
 
-            return False
+        if not edge_response.ok:
+            return health.EdgeServerHealth(edge_server.id, False, latency=edge_response.elapsed)
 
-        if req.status_code != 200:
-            log.error(u'Unable to contact edge server, received status code {}'.format(req.status_code))
+        try:
+            delay = float(edge_response.text)
+        except ValueError:
+            delay = None
 
-            return False
+        log.info(u'Delay to edge server #{0} is {1} seconds'.format(edge_server.id, edge_response.text))
 
-        delay = req.text
-        log.info(u'Delay to edge server #{0} is {1} seconds'.format(edge_server.id, delay))
+        if delay is not None:
+            metrics.edge_server_delay_seconds.set(delay, server=str(edge_server.id))
 
         self.update_edge_server_healthy_check(edge_server.id)
 
-        return True
+        return health.EdgeServerHealth(edge_server.id, True, delay=delay, latency=edge_response.elapsed)
+
+    def edge_server_is_healthy(self, edge_server):
+        return self.health_registry.is_healthy(edge_server)
 
     def set_edge_bot_status(self, network_id, status):
+        if self.edge_bot_pool is not None:
+            return self.edge_bot_pool.set_status(network_id, status)
+
         return self.edge_bot_model.update(status=status).where(
             self.edge_bot_model.network_id == network_id
         ).execute()
 
     def set_edge_bot_block_time(self, network_id):
+        if self.edge_bot_pool is not None:
+            return self.edge_bot_pool.set_block_time(network_id)
+
         return self.edge_bot_model.update(
             last_blocked_at=datetime.datetime.now()
         ).where(
@@ -583,34 +1002,15 @@ class EdgeController(object):
         url = self.get_isteamuser_api_url(edge_server.ip_address, 'GetFriendsList')
         params = {'network_id': edge_bot.network_id, 'ids': 1}
 
-        try:
-            req = requests.get(
-                url,
-                params=params,
-                timeout=(10.0, 20.0)
-            )
-        except requests.exceptions.Timeout:
-            log.error(u'Edge server #{} timed out'.format(edge_server.id))
-
-            return False
-        except Exception, e:
-            log.error(u'Unable to contact edge server, raised {}'.format(e))
-
-            return False
+        edge_response = self.http_client.edge_get(edge_server, url, params=params)
 
-        if req.status_code != 200:
-            log.error(u'Unable to contact edge server, received status code {}'.format(req.status_code))
+        if edge_response.result == enums.EEdgeCallResult.InvalidResponse:
+            return None
 
+        if not edge_response.ok:
             return False
 
-        try:
-            response = req.json()
-        except ValueError:
-            log.error(u'Unable to serialize response from edge server, received {}'.format(req.text))
-
-            return None
-
-        return response
+        return edge_response.data
 
     def get_edge_bot_sent_invitations(self, edge_bot, edge_server):
         log.info(
@@ -623,36 +1023,64 @@ class EdgeController(object):
         url = self.get_isteamuser_api_url(edge_server.ip_address, 'GetSentInvitations')
         params = {'network_id': edge_bot.network_id, 'ids': 1}
 
-        try:
-            req = requests.get(
-                url,
-                params=params,
-                timeout=(10.0, 20.0)
-            )
-        except requests.exceptions.Timeout:
-            log.error(u'Edge server #{} timed out'.format(edge_server.id))
+        edge_response = self.http_client.edge_get(edge_server, url, params=params)
 
-            return False
-        except Exception, e:
-            log.error(u'Unable to contact edge server, raised {}'.format(e))
+        if edge_response.result == enums.EEdgeCallResult.InvalidResponse:
+            return None
 
+        if not edge_response.ok:
             return False
 
-        if req.status_code != 200:
-            log.error(u'Unable to contact edge server, received status code {}'.format(req.status_code))
+        return edge_response.data
 
-            return False
+    def get_cached_friends_list(self, edge_bot, edge_server, refresh=False):
+        friendslist = None
 
-        try:
-            response = req.json()
-        except ValueError:
-            log.error(u'Unable to serialize response from edge server, received {}'.format(req.text))
+        if not refresh:
+            friendslist = self.friends_list_cache.get_friends(edge_bot.network_id)
+
+        if friendslist is not None:
+            return friendslist
 
+        if not refresh:
+            log.info(u'Could not find cached FriendList')
+
+        friendslist = self.get_edge_bot_friends_list(edge_bot, edge_server)
+
+        if not friendslist:
             return None
 
-        return response
+        friendslist = self.friends_list_cache.set_friends(edge_bot.network_id, friendslist)
+
+        if self.edge_bot_pool is not None:
+            self.edge_bot_pool.record_friends_count(edge_bot.network_id, len(friendslist))
+
+        return friendslist
+
+    def get_cached_sent_invitations(self, edge_bot, edge_server):
+        sent_invitations = self.friends_list_cache.get_sent_invitations(edge_bot.network_id)
+
+        if sent_invitations is not None:
+            return sent_invitations
+
+        log.info(u'Could not find cached SentInvitations')
+
+        sent_invitations = self.get_edge_bot_sent_invitations(edge_bot, edge_server)
+
+        if sent_invitations is None or sent_invitations is False:
+            return None
+
+        return self.friends_list_cache.set_sent_invitations(edge_bot.network_id, sent_invitations)
 
     def push_relations_to_edge_bot(self, edge_bot, edge_server, items):
+        response = self.push_items_to_cart(edge_bot, edge_server, items)
+
+        if not response:
+            return None
+
+        self.commit_pushed_items(edge_bot, edge_server, items, response)
+
+    def push_items_to_cart(self, edge_bot, edge_server, items):
         log.info(
             u'Pushing {0} relations to edge bot with network id {1} through edge server #{2}'.format(
                 len(items),
@@ -673,30 +1101,12 @@ class EdgeController(object):
             enums.EEdgeBotStatus.PushingItemsToCart.value
         )
 
-        try:
-            req = requests.post(url, data=data, timeout=(10.0, 20.0))
-        except requests.exceptions.Timeout:
-            log.error(u'Edge server {} timed out'.format(edge_server.id))
-
-            self.set_edge_bot_status(
-                edge_bot.network_id,
-                enums.EEdgeBotStatus.BlockedForUnknownReason.value
-            )
-
-            return None
-        except Exception, e:
-            log.error(u'Unable to contact edge server, raised {}'.format(e))
-
-            self.set_edge_bot_status(
-                edge_bot.network_id,
-                enums.EEdgeBotStatus.BlockedForUnknownReason.value
-            )
+        edge_response = self.http_client.edge_post(edge_server, url, data=data)
 
+        if edge_response.result == enums.EEdgeCallResult.InvalidResponse:
             return None
 
-        if req.status_code != 200:
-            log.error(u'Unable to contact edge server, received status code {}'.format(req.status_code))
-
+        if not edge_response.ok:
             self.set_edge_bot_status(
                 edge_bot.network_id,
                 enums.EEdgeBotStatus.BlockedForUnknownReason.value
@@ -704,12 +1114,7 @@ class EdgeController(object):
 
             return None
 
-        try:
-            response = req.json()
-        except ValueError:
-            log.error(u'Unable to serialize response from edge server, received {}'.format(req.text))
-
-            return None
+        response = edge_response.data
 
         if not response.get('success'):
             log.info(
@@ -726,6 +1131,9 @@ class EdgeController(object):
 
             return None
 
+        return response
+
+    def commit_pushed_items(self, edge_bot, edge_server, items, response):
         self.create_edge_task(edge_bot.id, edge_server.id, response)
 
         RelationController().commit_relations(
@@ -751,28 +1159,12 @@ class EdgeController(object):
             'network_id': edge_bot.network_id
         }
 
-        try:
-            req = requests.get(url, params=params, timeout=(10.0, 20.0))
-        except requests.exceptions.Timeout:
-            log.error(u'Edge server {} timed out'.format(edge_server.id))
-
-            return None
-        except Exception, e:
-            log.error(u'Unable to contact edge server, raised {}'.format(e))
-
-            return None
-
-        if req.status_code != 200:
-            log.error(u'Unable to contact edge server, received status code {}'.format(req.status_code))
+        edge_response = self.http_client.edge_get(edge_server, url, params=params)
 
+        if not edge_response.ok:
             return None
 
-        try:
-            response = req.json()
-        except ValueError:
-            log.error(u'Unable to serialize response from edge server, received {}'.format(req.text))
-
-            return None
+        response = edge_response.data
 
         return response
 
@@ -792,28 +1184,12 @@ class EdgeController(object):
             'network_id': edge_bot.network_id
         }
 
-        try:
-            req = requests.get(url, params=params, timeout=(10.0, 20.0))
-        except requests.exceptions.Timeout:
-            log.error(u'Edge server {} timed out'.format(edge_server.id))
-
-            return None
-        except Exception, e:
-            log.error(u'Unable to contact edge server, raised {}'.format(e))
-
-            return None
-
-        if req.status_code != 200:
-            log.error(u'Unable to contact edge server, received status code {}'.format(req.status_code))
+        edge_response = self.http_client.edge_get(edge_server, url, params=params)
 
+        if not edge_response.ok:
             return None
 
-        try:
-            response = req.json()
-        except ValueError:
-            log.error(u'Unable to serialize response from edge server, received {}'.format(req.text))
-
-            return None
+        response = edge_response.data
 
         if '0' in response.keys():
             log.error(u'Edge bot with network id {} friendlist is full!'.format(edge_bot.network_id))
@@ -822,72 +1198,55 @@ class EdgeController(object):
 
         return response
 
+    def run_partitions(self, partitions, func):
+        '''
+        Calls func(edge_bot, edge_server, entries) for every (edge_server.id, network_id)
+        partition from a thread pool, with at most EDGE_PARTITION_PER_SERVER partitions
+        of the same edge server running at once. A partition's entries stay on one thread
+        in order. Yields the results of each partition on the calling thread as soon as
+        the partition returns, so they are recorded while the others still run.
+        '''
+
+        partition_results = workers.imap_bounded(
+            lambda partition_key: func(*partitions[partition_key]),
+            sorted(partitions.keys()),
+            lambda partition_key: partition_key[0],
+            workers=getattr(config, 'EDGE_PARTITION_WORKERS', 8),
+            per_key=getattr(config, 'EDGE_PARTITION_PER_SERVER', 2)
+        )
+
+        for partition_key, results in partition_results:
+            for result in results:
+                yield result
+
+    def add_to_partition(self, partitions, edge_bot, edge_server, entry):
+        partition_key = (edge_server.id, edge_bot.network_id)
+
+        if partition_key not in partitions.keys():
+            partitions[partition_key] = (edge_bot, edge_server, [])
+
+        partitions[partition_key][2].append(entry)
+
+    @invalidation.buffered
+    @bot_pool.pooled
     def sync_friends_list(self):
         edge_bots = self.get_edge_bots()
-        edge_bots_friendslists = {}
 
         for edge_bot in edge_bots:
-            edge_server = self.get_edge_server_for_currency(edge_bot.currency_code)
+            edge_server = self.get_edge_server_for_bot(edge_bot)
 
             if not edge_server:
                 continue
 
-            friendslist = self.get_edge_bot_friends_list(edge_bot, edge_server)
+            friendslist = self.get_cached_friends_list(edge_bot, edge_server)
 
             if not friendslist:
                 continue
 
-            edge_bots_friendslists[edge_bot.network_id] = friendslist
-
-        for network_id in edge_bots_friendslists.keys():
-            items = []
-            currency_code = self.get_edge_bot_by_network_id(network_id).currency_code
-
-            for steamid in edge_bots_friendslists[network_id]:
-                try:
-                    user = self.user_model.get(steam=steamid)
-                except self.user_model.DoesNotExist:
-                    continue
-                except:
-                    continue
-
-                paidrequests = self.paidrequest_model.select().where(
-                    self.paidrequest_model.user == user.id,
-                    self.paidrequest_model.accepted == False,
-                    self.paidrequest_model.visible == True,
-                    self.paidrequest_model.authed == True
-                ).order_by(
-                    self.paidrequest_model.date.asc()
-                )
-
-                userrequests = self.userrequest_model.select().where(
-                    self.userrequest_model.user == user.id,
-                    self.userrequest_model.paid == True,
-                    self.userrequest_model.visible == True,
-                    self.userrequest_model.accepted == False
-                ).order_by(
-                    self.userrequest_model.date.asc()
-                )
-
-                for paidrequest in paidrequests:
-                    for relation in paidrequest.products:
-                        if relation.sent:
-                            continue
-
-                        if relation.product.price_currency != currency_code:
-                            continue
-
-                        items.append({'relation_type': 'C', 'relation_id': relation.id})
-
-                for userrequest in userrequests:
-                    for relation in userrequest.products:
-                        if relation.sent:
-                            continue
-
-                        if relation.product.price_currency != currency_code:
-                            continue
-
-                        items.append({'relation_type': 'C', 'relation_id': relation.id})
+            items = RelationController().get_unsent_relations(
+                friendslist,
+                edge_bot.currency_code
+            )
 
             if not len(items):
                 continue
@@ -895,7 +1254,7 @@ class EdgeController(object):
             log.info(
                 u'Syncing {0} relations on network_id {1}'.format(
                     len(items),
-                    network_id
+                    edge_bot.network_id
                 )
             )
 
@@ -906,10 +1265,14 @@ class EdgeController(object):
 
             RelationController().commit_relations(
                 items,
-                commited_on_bot=network_id,
+                commited_on_bot=edge_bot.network_id,
                 commitment_level=enums.ERelationCommitment.WaitingForInviteAccept.value
             )
 
+        self.friends_list_cache.save()
+
+    @invalidation.buffered
+    @bot_pool.pooled
     def send_invitations(self, anticheat_policy=False):
         items = RelationController().get_relations(
             self.owner_id,
@@ -920,107 +1283,183 @@ class EdgeController(object):
         if not len(items.keys()):
             log.info(u'No Uncommited relations found to send invitations')
 
-        edge_bots_friendslists = {}
-        edge_bots_sent_invitations = {}
-        edge_bots_invitation_count = {}
+        invitation_limit = getattr(config, 'EDGE_BOT_INVITATION_LIMIT', 25)
+
+        if anticheat_policy:
+            bot_type = enums.EEdgeBotType.AntiCheatPurchases
+        else:
+            bot_type = enums.EEdgeBotType.Purchases
+
+        # Bots are picked up front, then each (edge server, bot) partition talks to its
+        # edge server on its own thread. Database writes are applied here, on this
+        # thread, as soon as each partition returns. Users a bot could not invite are
+        # routed to another bot of the currency in the next round.
+
+        pending = []
 
         for user_id in items.keys():
+            user = self.user_model.get(id=user_id)
+
             for currency_code in items[user_id].keys():
+                pending.append((user, currency_code, items[user_id][currency_code], []))
+
+        while len(pending):
+            partitions = {}
+
+            for user, currency_code, relation_items, excluded_network_ids in pending:
                 log.info(u'Processing relations for currency {}'.format(currency_code))
 
-                if anticheat_policy:
-                    edge_bot = self.get_edge_bot_for_currency(
-                        currency_code,
-                        bot_type=enums.EEdgeBotType.AntiCheatPurchases
-                    )
-                else:
-                    edge_bot = self.get_edge_bot_for_currency(currency_code)
+                edge_bot, edge_server, invitation_planned = self.route_invitation(
+                    user,
+                    currency_code,
+                    bot_type,
+                    invitation_limit,
+                    excluded_network_ids=excluded_network_ids
+                )
 
                 if not edge_bot:
                     log.info(u'No available edge bot found for currency {}'.format(currency_code))
 
-                    break
-
-                try:
-                    if edge_bots_invitation_count[edge_bot.network_id] > 25:
-                        log.info(
-                            u'Edge bot with network_id {} invited too many users. Breaking...'.format(
-                                edge_bot.network_id
-                            )
-                        )
-
-                        break
-                except KeyError:
-                    pass
+                    continue
 
                 log.info(
-                    u'Edge Bot with network id {0} selected for currency {1}'.format(
+                    u'Edge Bot with network id {0} selected for currency {1} on edge server #{2}'.format(
                         edge_bot.network_id,
-                        currency_code
+                        currency_code,
+                        edge_server.id
                     )
                 )
 
-                edge_server = self.get_edge_server_for_currency(currency_code)
+                self.add_to_partition(
+                    partitions,
+                    edge_bot,
+                    edge_server,
+                    (user, currency_code, relation_items, invitation_planned, excluded_network_ids)
+                )
 
-                if not edge_server:
-                    log.info(u'Not available edge server found for currency {}'.format(currency_code))
+            pending = []
 
-                    break
+            for edge_bot, entry, invited in self.run_partitions(partitions, self.invite_users):
+                user, currency_code, relation_items, invitation_planned, excluded_network_ids = entry
 
-                if not self.edge_server_is_healthy(edge_server):
-                    log.info(u'Edge server #{} is not currently healthy'.format(edge_server.id))
+                if not invited:
+                    pending.append((user, currency_code, relation_items, excluded_network_ids + [edge_bot.network_id]))
 
-                    break
+                    continue
 
-                if not edge_bots_friendslists.get(edge_bot.network_id):
-                    log.info(u'Could not find cached FriendList')
+                try:
+                    RelationController().assign_requests_to_user(
+                        self.owner_id,
+                        relation_items
+                    )
 
-                    friendslist = self.get_edge_bot_friends_list(edge_bot, edge_server)
+                    RelationController().commit_relations(
+                        relation_items,
+                        commited_on_bot=edge_bot.network_id,
+                        commitment_level=enums.ERelationCommitment.WaitingForInviteAccept.value
+                    )
+                except Exception:
+                    log.exception(
+                        u'Committing invited relations on network id {} raised an exception'.format(
+                            edge_bot.network_id
+                        )
+                    )
 
-                    if not friendslist:
-                        continue
+        self.friends_list_cache.save()
+
+    def route_invitation(self, user, currency_code, bot_type, invitation_limit, excluded_network_ids=None):
+        '''
+        Returns the (edge_bot, edge_server) pair that invites user for currency_code, and
+        whether an invitation was planned for it. A bot that already befriended or invited
+        the user keeps them, everyone else goes to the least loaded bot under its invitation
+        limit. The planned invitation counts towards that bot right away, so the next users
+        of the cycle spread over the other bots. Bots in excluded_network_ids are skipped.
+        '''
+
+        preferred_network_ids = self.friends_list_cache.get_known_network_ids(user.steam)
+
+        edge_bot, edge_server = self.get_routable_edge_bot(
+            currency_code,
+            bot_type=bot_type,
+            preferred_network_ids=preferred_network_ids,
+            invitation_limit=invitation_limit,
+            excluded_network_ids=excluded_network_ids
+        )
 
-                    edge_bots_friendslists[edge_bot.network_id] = friendslist
+        if not edge_bot:
+            return None, None, False
 
-                if not edge_bots_sent_invitations.get(edge_bot.network_id):
-                    log.info(u'Could not find cached SentInvitations')
+        invitation_planned = edge_bot.network_id not in preferred_network_ids
 
-                    sent_invitations = self.get_edge_bot_sent_invitations(edge_bot, edge_server)
+        if invitation_planned:
+            self.edge_bot_pool.record_invitation(edge_bot.network_id)
 
-                    if sent_invitations is None or sent_invitations is False:
-                        continue
+        return edge_bot, edge_server, invitation_planned
 
-                    edge_bots_sent_invitations[edge_bot.network_id] = sent_invitations
+    def invite_users(self, edge_bot, edge_server, entries):
+        '''
+        Makes sure the user of every (user, currency_code, items, invitation_planned, ...)
+        entry is a friend of, or was invited by, edge_bot. Returns an (edge_bot, entry, invited)
+        triple per entry, entries that were not invited are left for another bot.
+        '''
 
-                user = self.user_model.get(id=user_id)
+        results = []
+
+        for entry in entries:
+            user, currency_code, relation_items, invitation_planned, excluded_network_ids = entry
+
+            try:
+                friendslist = self.get_cached_friends_list(edge_bot, edge_server)
+
+                if friendslist is None:
+                    break
+
+                sent_invitations = self.get_cached_sent_invitations(edge_bot, edge_server)
+
+                if sent_invitations is None:
+                    break
 
                 if (
-                    int(user.steam) not in edge_bots_friendslists[edge_bot.network_id] and
-                    int(user.steam) not in edge_bots_sent_invitations[edge_bot.network_id]
+                    int(user.steam) not in friendslist and
+                    int(user.steam) not in sent_invitations
                 ):
                     invitation_result = self.send_invitation(edge_bot, edge_server, user.steam)
 
                     if not invitation_result:
                         # TODO: EdgeBot's friendlist is full, clean it!
 
+                        if invitation_planned:
+                            self.edge_bot_pool.release_invitation(edge_bot.network_id)
+
+                        results.append((edge_bot, entry, False))
+
                         continue
 
-                    if not edge_bot.network_id in edge_bots_invitation_count.keys():
-                        edge_bots_invitation_count[edge_bot.network_id] = 1
-                    else:
-                        edge_bots_invitation_count[edge_bot.network_id] += 1
+                    self.friends_list_cache.add_sent_invitation(edge_bot.network_id, user.steam)
 
-                RelationController().assign_requests_to_user(
-                    self.owner_id,
-                    items[user_id][currency_code]
-                )
+                    if not invitation_planned:
+                        self.edge_bot_pool.record_invitation(edge_bot.network_id)
+                elif invitation_planned:
+                    self.edge_bot_pool.release_invitation(edge_bot.network_id)
 
-                RelationController().commit_relations(
-                    items[user_id][currency_code],
-                    commited_on_bot=edge_bot.network_id,
-                    commitment_level=enums.ERelationCommitment.WaitingForInviteAccept.value
-                )
+                results.append((edge_bot, entry, True))
+            except Exception:
+                log.exception(u'Sending invitations on network id {} raised an exception'.format(edge_bot.network_id))
+
+                break
+
+        # Entries left once the bot's lists or invitations failed go to another bot
+
+        for entry in entries[len(results):]:
+            if entry[3]:
+                self.edge_bot_pool.release_invitation(edge_bot.network_id)
 
+            results.append((edge_bot, entry, False))
+
+        return results
+
+    @invalidation.buffered
+    @bot_pool.pooled
     def push_relations(self, anticheat_policy=False):
         items = RelationController().get_relations(
             self.owner_id,
@@ -1031,7 +1470,7 @@ class EdgeController(object):
         if not len(items.keys()):
             log.info(u'No WaitingForInviteAccept pending relations found')
 
-        edge_bots_friendslists = {}
+        partitions = {}
 
         for user_id in items.keys():
             for currency_code in items[user_id].keys():
@@ -1064,44 +1503,85 @@ class EdgeController(object):
                     )
                 )
 
-                # For now assume there is only one EdgeServer per currency
-
-                edge_server = self.get_edge_server_for_currency(currency_code)
+                edge_server = self.get_edge_server_for_bot(edge_bot)
 
                 if not edge_server:
-                    log.info(u'Not available edge server found for currency {}'.format(currency_code))
+                    continue
 
-                    break
+                self.record_edge_bot_assignment(edge_bot, edge_server)
+
+                user = self.user_model.get(id=user_id)
+
+                self.add_to_partition(partitions, edge_bot, edge_server, (user, items[user_id][currency_code]))
+
+        # Each push is recorded as soon as its partition returns, so a failure later in
+        # the run never leaves a remote task without its EdgeTask row and relations
+
+        pushed = self.run_partitions(partitions, self.push_accepted_users)
+
+        for edge_bot, edge_server, relation_items, response in pushed:
+            try:
+                self.commit_pushed_items(edge_bot, edge_server, relation_items, response)
+            except Exception:
+                log.exception(
+                    u'Recording task_id {0} pushed to network id {1} raised an exception'.format(
+                        response.get('task_id'),
+                        edge_bot.network_id
+                    )
+                )
+
+        self.friends_list_cache.save()
+        self.edge_task_schedule.save()
+
+    def push_accepted_users(self, edge_bot, edge_server, entries):
+        '''
+        Pushes the items of every (user, items) entry whose user accepted edge_bot's
+        invitation. Returns (edge_bot, edge_server, items, response) for each push made.
+        '''
+
+        pushed = []
+        refreshed = False
 
-                if not self.edge_server_is_healthy(edge_server):
-                    log.info(u'Edge server #{} is not currently healthy'.format(edge_server.id))
+        for user, relation_items in entries:
+            try:
+                # Once a push puts the bot to work it takes nothing else this cycle
 
+                if not self.get_edge_bot_by_network_id(edge_bot.network_id):
                     break
 
-                if not edge_bots_friendslists.get(edge_bot.network_id):
-                    log.info(u'Could not find cached FriendList')
+                friendslist = self.get_cached_friends_list(edge_bot, edge_server)
 
-                    friendslist = self.get_edge_bot_friends_list(edge_bot, edge_server)
+                if not friendslist:
+                    # TODO: EdgeBot's friendlist is full. Clean it
 
-                    if not friendslist:
-                        # TODO: EdgeBot's friendlist is full. Clean it
+                    break
 
-                        continue
+                if int(user.steam) not in friendslist and not refreshed:
+                    # A cached snapshot may predate the user accepting the invite,
+                    # refetch it once per run before giving up on this user
 
-                    edge_bots_friendslists[edge_bot.network_id] = friendslist
+                    refreshed = True
 
-                user = self.user_model.get(id=user_id)
+                    friendslist = self.get_cached_friends_list(edge_bot, edge_server, refresh=True)
 
-                if int(user.steam) not in edge_bots_friendslists[edge_bot.network_id]:
+                    if not friendslist:
+                        break
+
+                if int(user.steam) not in friendslist:
                     continue
 
                 # User is EdgeBot's friendslist
 
-                self.push_relations_to_edge_bot(
-                    edge_bot,
-                    edge_server,
-                    items[user_id][currency_code]
-                )
+                response = self.push_items_to_cart(edge_bot, edge_server, relation_items)
+
+                if response:
+                    pushed.append((edge_bot, edge_server, relation_items, response))
+            except Exception:
+                log.exception(u'Pushing relations to network id {} raised an exception'.format(edge_bot.network_id))
+
+                break
+
+        return pushed
 
     def call_checkout(self, edge_bot, edge_server, account_id):
         log.info(
@@ -1123,42 +1603,9 @@ class EdgeController(object):
             'giftee_account_id': account_id
         }
 
-        try:
-            req = requests.post(url, data=data, timeout=(10.0, 20.0))
-        except requests.exceptions.Timeout:
-            log.error(u'Edge server {} timed out'.format(edge_server.id))
-
-            self.set_edge_bot_status(
-                edge_bot.network_id,
-                enums.EEdgeBotStatus.BlockedForUnknownReason.value
-            )
-
-            return None
-        except Exception, e:
-            log.error(u'Unable to contact edge server, raised {}'.format(e))
-
-            self.set_edge_bot_status(
-                edge_bot.network_id,
-                enums.EEdgeBotStatus.BlockedForUnknownReason.value
-            )
-
-            return None
-
-        if req.status_code != 200:
-            log.error(u'Unable to contact edge server, received status code {}'.format(req.status_code))
-
-            self.set_edge_bot_status(
-                edge_bot.network_id,
-                enums.EEdgeBotStatus.BlockedForUnknownReason.value
-            )
-
-            return None
-
-        try:
-            response = req.json()
-        except ValueError:
-            log.error(u'Unable to serialize response from edge server, received {}'.format(req.text))
+        edge_response = self.http_client.edge_post(edge_server, url, data=data)
 
+        if not edge_response.ok:
             self.set_edge_bot_status(
                 edge_bot.network_id,
                 enums.EEdgeBotStatus.BlockedForUnknownReason.value
@@ -1166,7 +1613,7 @@ class EdgeController(object):
 
             return None
 
-        self.create_edge_task(edge_bot.id, edge_server.id, response)
+        self.create_edge_task(edge_bot.id, edge_server.id, edge_response.data)
 
     def get_transaction_link(self, edge_bot, edge_server, transid):
         log.info(
@@ -1184,30 +1631,12 @@ class EdgeController(object):
             'network_id': edge_bot.network_id,
         }
 
-        try:
-            req = requests.post(url, data=data, timeout=(10.0, 20.0))
-        except requests.exceptions.Timeout:
-            log.error(u'Edge server {} timed out'.format(edge_server.id))
-
-            return None
-        except Exception, e:
-            log.error(u'Unable to contact edge server, raised {}'.format(e))
-
-            return None
-
-        if req.status_code != 200:
-            log.error(u'Unable to contact edge server, received status code {}'.format(req.status_code))
-
-            return None
-
-        try:
-            response = req.json()
-        except ValueError:
-            log.error(u'Unable to serialize response from edge server, received {}'.format(req.text))
+        edge_response = self.http_client.edge_post(edge_server, url, data=data)
 
+        if not edge_response.ok:
             return None
 
-        self.create_edge_task(edge_bot.id, edge_server.id, response)
+        return self.create_edge_task(edge_bot.id, edge_server.id, edge_response.data)
 
     def reset_shopping_cart(self, edge_bot, edge_server):
         url = self.get_edge_api_url(edge_server.ip_address, 'cart/reset/')
@@ -1216,27 +1645,9 @@ class EdgeController(object):
             'network_id': edge_bot.network_id,
         }
 
-        try:
-            req = requests.post(url, data=data, timeout=(10.0, 20.0))
-        except requests.exceptions.Timeout:
-            log.error(u'Edge server {} timed out'.format(edge_server.id))
-
-            return None
-        except Exception, e:
-            log.error(u'Unable to contact edge server, raised {}'.format(e))
-
-            return None
-
-        if req.status_code != 200:
-            log.error(u'Unable to contact edge server, received status code {}'.format(req.status_code))
-
-            return None
-
-        try:
-            response = req.json()
-        except ValueError:
-            log.error(u'Unable to serialize response from edge server, received {}'.format(req.text))
+        edge_response = self.http_client.edge_post(edge_server, url, data=data)
 
+        if not edge_response.ok:
             return None
 
-        self.create_edge_task(edge_bot.id, edge_server.id, response)
+        return self.create_edge_task(edge_bot.id, edge_server.id, edge_response.data)
@@ -3,29 +3,85 @@
 
 import enums
 import datetime
+import metrics
+import invalidation
+
+from peewee import fn
+from peewee import IntegerField
+from playhouse.shortcuts import case
 
 from steamcommerce_api.api import userrequest
 from steamcommerce_api.api import paidrequest
 
 from steamcommerce_api.core import models
-from steamcommerce_api.caching import cache_layer
 
 
 class RelationController(object):
     def __init__(self):
+        self.user_model = models.User
+        self.product_model = models.Product
         self.userrequest_model = models.UserRequest
         self.paidrequest_model = models.PaidRequest
 
         self.userrequest_relation_model = models.ProductUserRequestRelation
         self.paidrequest_relation_model = models.ProductPaidRequestRelation
 
+        self.database = self.userrequest_relation_model._meta.database
+
+    def collect_metrics(self):
+        metrics.edge_relations.clear()
+
+        for relation_type, relation_model in (
+            ('A', self.userrequest_relation_model),
+            ('C', self.paidrequest_relation_model)
+        ):
+            relations = relation_model.select(
+                relation_model.commitment_level,
+                fn.COUNT(relation_model.id)
+            ).where(
+                relation_model.sent == False
+            ).group_by(
+                relation_model.commitment_level
+            ).tuples()
+
+            for commitment_level, relations_count in relations:
+                metrics.edge_relations.set(
+                    relations_count,
+                    relation_type=relation_type,
+                    commitment_level=enums.ERelationCommitment(commitment_level or 0).name
+                )
+
     def get_relation(self, relation_type, relation_id):
         if relation_type == 'A':
             return self.userrequest_relation_model.get(id=relation_id)
         elif relation_type == 'C':
             return self.paidrequest_relation_model.get(id=relation_id)
 
-    def get_userrequest_relations(self, user_id, commitment_level, eq=True):
+    def get_set_condition(self, field):
+        # Same rows the truthiness check on product.sub_id or product.store_sub_id used to keep
+
+        empty_value = 0 if isinstance(field, IntegerField) else ''
+
+        return (field != None) & (field != empty_value)
+
+    def get_product_conditions(self, anticheat_policy):
+        if anticheat_policy:
+            anticheat_condition = self.product_model.has_anticheat == True
+        else:
+            anticheat_condition = (
+                (self.product_model.has_anticheat == False) |
+                (self.product_model.has_anticheat >> None)
+            )
+
+        # TODO: Send product.id to re-crawl store_sub_id
+
+        return [
+            self.get_set_condition(self.product_model.sub_id) | self.get_set_condition(self.product_model.store_sub_id),
+            self.get_set_condition(self.product_model.price_currency),
+            anticheat_condition
+        ]
+
+    def get_userrequest_relations(self, user_id, commitment_level, eq=True, anticheat_policy=None):
         if eq:
             commitment_condition = self.userrequest_relation_model.commitment_level == commitment_level
         else:
@@ -38,14 +94,38 @@ class RelationController(object):
             (self.userrequest_model.assigned == None) | (self.userrequest_model.assigned == user_id)
         ]
 
-        relations = self.userrequest_relation_model.select().where(
+        if anticheat_policy is not None:
+            # Promotional requests that expired before being paid and were never informed are not pushed
+
+            conditions.append(
+                (self.userrequest_model.promotion == False) |
+                (self.userrequest_model.promotion >> None) |
+                (self.userrequest_model.paid_before_promotion_end_date == True) |
+                (self.userrequest_model.informed == True) |
+                (self.userrequest_model.expiration_date >> None) |
+                (self.userrequest_model.expiration_date >= datetime.datetime.now())
+            )
+
+            conditions.extend(self.get_product_conditions(anticheat_policy))
+
+        # Products, requests and their users come in the same query so grouping never lazy-loads them
+
+        relations = self.userrequest_relation_model.select(
+            self.userrequest_relation_model,
+            self.product_model,
+            self.userrequest_model,
+            self.user_model
+        ).where(
             commitment_condition,
             self.userrequest_relation_model.sent == False
-        ).join(self.userrequest_model).where(*conditions)
+        ).join(self.userrequest_model).where(*conditions).join(
+            self.user_model,
+            on=self.userrequest_model.user
+        ).switch(self.userrequest_relation_model).join(self.product_model)
 
         return relations
 
-    def get_paidrequest_relations(self, user_id, commitment_level, eq=True):
+    def get_paidrequest_relations(self, user_id, commitment_level, eq=True, anticheat_policy=None):
         if eq:
             commitment_condition = self.paidrequest_relation_model.commitment_level == commitment_level
         else:
@@ -58,22 +138,86 @@ class RelationController(object):
             (self.paidrequest_model.assigned == None) | (self.paidrequest_model.assigned == user_id)
         ]
 
-        relations = self.paidrequest_relation_model.select().where(
+        if anticheat_policy is not None:
+            conditions.extend(self.get_product_conditions(anticheat_policy))
+
+        relations = self.paidrequest_relation_model.select(
+            self.paidrequest_relation_model,
+            self.product_model,
+            self.paidrequest_model,
+            self.user_model
+        ).where(
             commitment_condition,
             self.paidrequest_relation_model.sent == False
-        ).join(self.paidrequest_model).where(*conditions)
+        ).join(self.paidrequest_model).where(*conditions).join(
+            self.user_model,
+            on=self.paidrequest_model.user
+        ).switch(self.paidrequest_relation_model).join(self.product_model)
 
         return relations
 
+    def get_unsent_relations(self, steam_ids, currency_code):
+        '''
+        Unsent relations priced in currency_code of every open request made by the
+        users in steam_ids, as items ready for commit_relations
+        '''
+
+        steam_ids = [str(steam_id) for steam_id in steam_ids]
+
+        if not len(steam_ids):
+            return []
+
+        paidrequest_relations = self.paidrequest_relation_model.select(
+            self.paidrequest_relation_model.id
+        ).join(self.paidrequest_model).join(
+            self.user_model,
+            on=self.paidrequest_model.user
+        ).switch(self.paidrequest_relation_model).join(self.product_model).where(
+            self.user_model.steam << steam_ids,
+            self.paidrequest_model.accepted == False,
+            self.paidrequest_model.visible == True,
+            self.paidrequest_model.authed == True,
+            self.paidrequest_relation_model.sent == False,
+            self.product_model.price_currency == currency_code
+        ).order_by(
+            self.paidrequest_model.date.asc(),
+            self.paidrequest_relation_model.id.asc()
+        ).tuples()
+
+        userrequest_relations = self.userrequest_relation_model.select(
+            self.userrequest_relation_model.id
+        ).join(self.userrequest_model).join(
+            self.user_model,
+            on=self.userrequest_model.user
+        ).switch(self.userrequest_relation_model).join(self.product_model).where(
+            self.user_model.steam << steam_ids,
+            self.userrequest_model.paid == True,
+            self.userrequest_model.visible == True,
+            self.userrequest_model.accepted == False,
+            self.userrequest_relation_model.sent == False,
+            self.product_model.price_currency == currency_code
+        ).order_by(
+            self.userrequest_model.date.asc(),
+            self.userrequest_relation_model.id.asc()
+        ).tuples()
+
+        return [
+            {'relation_type': 'C', 'relation_id': relation_id} for (relation_id,) in paidrequest_relations
+        ] + [
+            {'relation_type': 'A', 'relation_id': relation_id} for (relation_id,) in userrequest_relations
+        ]
+
     def get_relations(self, user_id, commitment_level, anticheat_policy=False):
         paidrequest_relations = self.get_paidrequest_relations(
             user_id,
             commitment_level,
+            anticheat_policy=anticheat_policy
         )
 
         userrequest_relations = self.get_userrequest_relations(
             user_id,
-            commitment_level
+            commitment_level,
+            anticheat_policy=anticheat_policy
         )
 
         items = {}
@@ -85,20 +229,6 @@ class RelationController(object):
             sub_id = product.sub_id or product.store_sub_id
             currency_code = product.price_currency
 
-            # TODO: Send product.id to re-crawl store_sub_id
-
-            if not sub_id:
-                continue
-
-            if not currency_code:
-                continue
-
-            if (
-                not anticheat_policy and product.has_anticheat or
-                anticheat_policy and not product.has_anticheat
-            ):
-                continue
-
             user_id = relation.request.user.id
 
             if user_id not in items.keys():
@@ -123,36 +253,11 @@ class RelationController(object):
             commited_sub_ids[user_id].append(sub_id)
 
         for relation in userrequest_relations:
-            userrequest = relation.request
-
-            if (
-                userrequest.promotion and
-                not userrequest.paid_before_promotion_end_date and
-                not userrequest.informed and
-                userrequest.expiration_date and
-                userrequest.expiration_date < datetime.datetime.now()
-            ):
-                continue
-
             product = relation.product
 
             sub_id = product.sub_id or product.store_sub_id
             currency_code = product.price_currency
 
-            # TODO: Send product.id to re-crawl store_sub_id
-
-            if not sub_id:
-                continue
-
-            if not currency_code:
-                continue
-
-            if (
-                not anticheat_policy and product.has_anticheat or
-                anticheat_policy and not product.has_anticheat
-            ):
-                continue
-
             user_id = relation.request.user.id
 
             if user_id not in items.keys():
@@ -178,14 +283,24 @@ class RelationController(object):
 
         return items
 
-    def rollback_failed_relations(self, shopping_cart_gid):
+    def rollback_failed_relations(self, shopping_cart_gids):
+        if not isinstance(shopping_cart_gids, (list, tuple, set)):
+            shopping_cart_gids = [shopping_cart_gids]
+
+        shopping_cart_gids = [
+            shopping_cart_gid for shopping_cart_gid in shopping_cart_gids if shopping_cart_gid is not None
+        ]
+
+        if not len(shopping_cart_gids):
+            return None
+
         self.userrequest_relation_model.update(
             task_id=None,
             commited_on_bot=None,
             shopping_cart_gid=None,
             commitment_level=enums.ERelationCommitment.Uncommited.value,
         ).where(
-            self.userrequest_relation_model.shopping_cart_gid == shopping_cart_gid
+            self.userrequest_relation_model.shopping_cart_gid << shopping_cart_gids
         ).execute()
 
         self.paidrequest_relation_model.update(
@@ -194,11 +309,11 @@ class RelationController(object):
             shopping_cart_gid=None,
             commitment_level=enums.ERelationCommitment.Uncommited.value,
         ).where(
-            self.paidrequest_relation_model.shopping_cart_gid == shopping_cart_gid
+            self.paidrequest_relation_model.shopping_cart_gid << shopping_cart_gids
         ).execute()
 
         cache_keys = ['paidrequest/relation/*', 'userrequest/relation/*']
-        cache_layer.purge_cache_keys(cache_keys)
+        invalidation.purge_cache_keys(cache_keys)
 
     def rollback_pushed_relations(self, task_id):
         self.userrequest_relation_model.update(
@@ -214,12 +329,36 @@ class RelationController(object):
         ).execute()
 
         cache_keys = ['paidrequest/relation/*', 'userrequest/relation/*']
-        cache_layer.purge_cache_keys(cache_keys)
+        invalidation.purge_cache_keys(cache_keys)
 
-    def set_relation_commitment(
+    def rollback_cart_relations(self, commited_on_bot):
+        self.userrequest_relation_model.update(
+            task_id=None,
+            commited_on_bot=None,
+            shopping_cart_gid=None,
+            commitment_level=enums.ERelationCommitment.Uncommited.value,
+        ).where(
+            self.userrequest_relation_model.commited_on_bot == commited_on_bot,
+            self.userrequest_relation_model.commitment_level == enums.ERelationCommitment.AddedToCart.value,
+            self.userrequest_relation_model.sent == False
+        ).execute()
+
+        self.paidrequest_relation_model.update(
+            task_id=None,
+            commited_on_bot=None,
+            shopping_cart_gid=None,
+            commitment_level=enums.ERelationCommitment.Uncommited.value,
+        ).where(
+            self.paidrequest_relation_model.commited_on_bot == commited_on_bot,
+            self.paidrequest_relation_model.commitment_level == enums.ERelationCommitment.AddedToCart.value,
+            self.paidrequest_relation_model.sent == False
+        ).execute()
+
+        cache_keys = ['paidrequest/relation/*', 'userrequest/relation/*']
+        invalidation.purge_cache_keys(cache_keys)
+
+    def get_commitment_params(
         self,
-        relation_type,
-        relation_id,
         commitment_level,
         task_id=None,
         commited_on_bot=None,
@@ -238,6 +377,39 @@ class RelationController(object):
         if shopping_cart_gid:
             params.update({'shopping_cart_gid': shopping_cart_gid})
 
+        return params
+
+    def get_relation_ids(self, items):
+        relation_ids = {'A': [], 'C': []}
+
+        for item in items:
+            relation_type = item.get('relation_type')
+            relation_id = item.get('relation_id')
+
+            if relation_type not in relation_ids.keys():
+                continue
+
+            if relation_id not in relation_ids[relation_type]:
+                relation_ids[relation_type].append(relation_id)
+
+        return relation_ids
+
+    def set_relation_commitment(
+        self,
+        relation_type,
+        relation_id,
+        commitment_level,
+        task_id=None,
+        commited_on_bot=None,
+        shopping_cart_gid=None
+    ):
+        params = self.get_commitment_params(
+            commitment_level,
+            task_id=task_id,
+            commited_on_bot=commited_on_bot,
+            shopping_cart_gid=shopping_cart_gid
+        )
+
         if relation_type == 'A':
             self.userrequest_relation_model.update(**params).where(
                 self.userrequest_relation_model.id == relation_id
@@ -251,79 +423,239 @@ class RelationController(object):
 
             cache_keys = ['paidrequest/relation/%d' % relation_id]
 
-        cache_layer.purge_cache_keys(cache_keys)
+        invalidation.purge_cache_keys(cache_keys)
 
-    def commit_relations(self, items, commitment_level=None, task_id=None, commited_on_bot=None):
-        for item in items:
-            relation_type = item.get('relation_type')
-            relation_id = item.get('relation_id')
+    def commit_relations(
+        self,
+        items,
+        commitment_level=None,
+        task_id=None,
+        commited_on_bot=None,
+        shopping_cart_gid=None
+    ):
+        relation_ids = self.get_relation_ids(items)
 
-            self.set_relation_commitment(
-                relation_type,
-                relation_id,
-                commitment_level,
-                task_id=task_id,
-                commited_on_bot=commited_on_bot
-            )
+        params = self.get_commitment_params(
+            commitment_level,
+            task_id=task_id,
+            commited_on_bot=commited_on_bot,
+            shopping_cart_gid=shopping_cart_gid
+        )
 
-    def assign_requests_to_user(self, owner_id, items):
-        for item in items:
-            relation_type = item.get('relation_type')
-            relation_id = item.get('relation_id')
+        cache_keys = []
 
-            relation = self.get_relation(relation_type, relation_id)
+        with self.database.atomic():
+            if len(relation_ids['A']):
+                self.userrequest_relation_model.update(**params).where(
+                    self.userrequest_relation_model.id << relation_ids['A']
+                ).execute()
 
-            if relation_type == 'A':
-                userrequest.UserRequest().assign(relation.request.id, owner_id)
-            elif relation_type == 'C':
-                paidrequest.PaidRequest().assign(relation.request.id, owner_id)
+                cache_keys.extend(['userrequest/relation/%d' % relation_id for relation_id in relation_ids['A']])
 
-    def commit_purchased_relations(self, shopping_cart_gid, owner_id):
-        userrequest_relations = self.userrequest_relation_model.select().where(
+            if len(relation_ids['C']):
+                self.paidrequest_relation_model.update(**params).where(
+                    self.paidrequest_relation_model.id << relation_ids['C']
+                ).execute()
+
+                cache_keys.extend(['paidrequest/relation/%d' % relation_id for relation_id in relation_ids['C']])
+
+        if len(cache_keys):
+            invalidation.purge_cache_keys(cache_keys)
+
+    @invalidation.buffered
+    def apply_cart_result(
+        self,
+        task_id,
+        commited_on_bot,
+        succesful_items,
+        failed_items,
+        failed_shopping_cart_gids,
+        shopping_cart_gid
+    ):
+        '''
+        Applies an add_subids_to_cart result in one transaction, with a fixed number
+        of UPDATEs whatever the number of items. Cache keys are purged once it commits.
+        '''
+
+        with self.database.atomic():
+            self.rollback_pushed_relations(task_id)
+
+            if len(failed_shopping_cart_gids or []):
+                self.rollback_failed_relations(failed_shopping_cart_gids)
+
+            if len(failed_items or []):
+                self.commit_relations(
+                    failed_items,
+                    commitment_level=enums.ERelationCommitment.FailedToAddToCart.value,
+                    task_id=task_id,
+                    commited_on_bot=commited_on_bot
+                )
+
+            if len(succesful_items or []):
+                self.commit_relations(
+                    succesful_items,
+                    commitment_level=enums.ERelationCommitment.AddedToCart.value,
+                    shopping_cart_gid=shopping_cart_gid
+                )
+
+    def get_request_ids(self, items):
+        relation_ids = self.get_relation_ids(items)
+        request_ids = {'A': [], 'C': []}
+
+        if len(relation_ids['A']):
+            request_ids['A'] = [request_id for (request_id,) in self.userrequest_relation_model.select(
+                self.userrequest_relation_model.request
+            ).where(
+                self.userrequest_relation_model.id << relation_ids['A']
+            ).distinct().tuples()]
+
+        if len(relation_ids['C']):
+            request_ids['C'] = [request_id for (request_id,) in self.paidrequest_relation_model.select(
+                self.paidrequest_relation_model.request
+            ).where(
+                self.paidrequest_relation_model.id << relation_ids['C']
+            ).distinct().tuples()]
+
+        return request_ids
+
+    def get_reassigned_request_ids(self, request_model, request_ids, owner_id):
+        if not len(request_ids):
+            return []
+
+        return [request_id for (request_id,) in request_model.select(
+            request_model.id
+        ).where(
+            request_model.id << request_ids,
+            (request_model.assigned >> None) | (request_model.assigned != owner_id)
+        ).tuples()]
+
+    def assign_requests(self, owner_id, request_ids):
+        # assign() keeps steamcommerce_api's own cache keys and side effects, so it is
+        # called once per request that is not assigned to owner_id yet
+
+        for request_id in self.get_reassigned_request_ids(self.userrequest_model, request_ids['A'], owner_id):
+            userrequest.UserRequest().assign(request_id, owner_id)
+
+        for request_id in self.get_reassigned_request_ids(self.paidrequest_model, request_ids['C'], owner_id):
+            paidrequest.PaidRequest().assign(request_id, owner_id)
+
+    def assign_requests_to_user(self, owner_id, items):
+        self.assign_requests(owner_id, self.get_request_ids(items))
+
+    def get_cart_relations(self, shopping_cart_gid):
+        relation_ids = {'A': [], 'C': []}
+        request_ids = {'A': [], 'C': []}
+
+        userrequest_relations = self.userrequest_relation_model.select(
+            self.userrequest_relation_model.id,
+            self.userrequest_relation_model.request
+        ).where(
             self.userrequest_relation_model.shopping_cart_gid == shopping_cart_gid
-        )
+        ).tuples()
 
-        paidrequest_relations = self.paidrequest_relation_model.select().where(
+        paidrequest_relations = self.paidrequest_relation_model.select(
+            self.paidrequest_relation_model.id,
+            self.paidrequest_relation_model.request
+        ).where(
             self.paidrequest_relation_model.shopping_cart_gid == shopping_cart_gid
+        ).tuples()
+
+        for relation_type, relations in (('A', userrequest_relations), ('C', paidrequest_relations)):
+            for relation_id, request_id in relations:
+                relation_ids[relation_type].append(relation_id)
+
+                if request_id not in request_ids[relation_type]:
+                    request_ids[relation_type].append(request_id)
+
+        return relation_ids, request_ids
+
+    def get_completed_request_ids(self, relation_model, request_model, request_ids, owner_id, conditions):
+        if not len(request_ids):
+            return []
+
+        unsent_relations = fn.SUM(case(None, [(relation_model.sent == False, 1)], 0))
+
+        return [request_id for (request_id,) in relation_model.select(
+            relation_model.request
+        ).join(request_model).where(
+            relation_model.request << request_ids,
+            request_model.assigned == owner_id,
+            request_model.accepted == False,
+            *conditions
+        ).group_by(
+            relation_model.request
+        ).having(
+            unsent_relations == 0
+        ).tuples()]
+
+    def get_unassigned_request_ids(self, request_model, request_ids):
+        if not len(request_ids):
+            return []
+
+        return [request_id for (request_id,) in request_model.select(
+            request_model.id
+        ).where(
+            request_model.id << request_ids,
+            request_model.assigned >> None
+        ).tuples()]
+
+    def commit_purchased_relations(self, shopping_cart_gid, owner_id):
+        relation_ids, request_ids = self.get_cart_relations(shopping_cart_gid)
+
+        with self.database.atomic():
+            if len(relation_ids['A']):
+                self.userrequest_relation_model.update(
+                    commitment_level=enums.ERelationCommitment.Purchased.value
+                ).where(
+                    self.userrequest_relation_model.id << relation_ids['A']
+                ).execute()
+
+            if len(relation_ids['C']):
+                self.paidrequest_relation_model.update(
+                    commitment_level=enums.ERelationCommitment.Purchased.value
+                ).where(
+                    self.paidrequest_relation_model.id << relation_ids['C']
+                ).execute()
+
+        invalidation.purge_cache_keys(
+            ['userrequest/relation/%d' % relation_id for relation_id in relation_ids['A']] +
+            ['paidrequest/relation/%d' % relation_id for relation_id in relation_ids['C']]
         )
 
-        for relation in userrequest_relations:
-            self.set_relation_commitment(
-                'A',
-                relation.id,
-                enums.ERelationCommitment.Purchased.value
-            )
+        # set_sent() and assign() keep steamcommerce_api's own cache keys and side effects
 
-            userrequest.UserRequest().set_sent(relation.id)
+        for relation_id in relation_ids['A']:
+            userrequest.UserRequest().set_sent(relation_id)
 
-            if not relation.request.assigned:
-                userrequest.UserRequest().assign(relation.request.id, owner_id)
+        for relation_id in relation_ids['C']:
+            paidrequest.PaidRequest().set_sent(relation_id)
 
-        for relation in paidrequest_relations:
-            self.set_relation_commitment(
-                'C',
-                relation.id,
-                enums.ERelationCommitment.Purchased.value
-            )
+        for request_id in self.get_unassigned_request_ids(self.userrequest_model, request_ids['A']):
+            userrequest.UserRequest().assign(request_id, owner_id)
+
+        for request_id in self.get_unassigned_request_ids(self.paidrequest_model, request_ids['C']):
+            paidrequest.PaidRequest().assign(request_id, owner_id)
 
-            paidrequest.PaidRequest().set_sent(relation.id)
+        # Only the requests in this cart can have become complete
 
-            if not relation.request.assigned:
-                paidrequest.PaidRequest().assign(relation.request.id, owner_id)
+        completed_paidrequest_ids = self.get_completed_request_ids(
+            self.paidrequest_relation_model,
+            self.paidrequest_model,
+            request_ids['C'],
+            owner_id,
+            [self.paidrequest_model.authed == True, self.paidrequest_model.visible == True]
+        )
 
-        paidrequests = paidrequest.PaidRequest().get_paid_query()
-        userrequests = userrequest.UserRequest().get_paid_query()
+        completed_userrequest_ids = self.get_completed_request_ids(
+            self.userrequest_relation_model,
+            self.userrequest_model,
+            request_ids['A'],
+            owner_id,
+            [self.userrequest_model.paid == True, self.userrequest_model.visible == True]
+        )
 
-        for paidrequest_data in paidrequests:
-            if (
-                paidrequest_data.products.filter(sent=False).count() == 0 and
-                paidrequest_data.assigned.id == owner_id
-            ):
-                paidrequest.PaidRequest().accept_paidrequest(paidrequest_data.id, owner_id)
+        for paidrequest_id in completed_paidrequest_ids:
+            paidrequest.PaidRequest().accept_paidrequest(paidrequest_id, owner_id)
 
-        for userrequest_data in userrequests:
-            if (
-                userrequest_data.products.filter(sent=False).count() == 0 and
-                userrequest_data.assigned.id == owner_id
-            ):
-                userrequest.UserRequest().accept_userrequest(userrequest_data.id, owner_id)
+        for userrequest_id in completed_userrequest_ids:
+            userrequest.UserRequest().accept_userrequest(userrequest_id, owner_id)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+'''
+Receives task completions pushed by edge servers, so results no longer wait for
+the next process_pending_tasks poll.
+
+Edge servers POST the same JSON document task/state/ answers with, plus the task_id:
+
+    POST /edge/callback/task/
+    X-Edge-Signature: hex HMAC-SHA256 of the body keyed with EDGE_CALLBACK_SECRET
+
+    {"success": true, "task_id": "...", "task_status": "SUCCESS", "task_result": {...}}
+'''
+
+import hmac
+import json
+import hashlib
+import argparse
+import threading
+
+from BaseHTTPServer import HTTPServer
+from BaseHTTPServer import BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+import config
+import rollbar
+
+from controllers import edge
+
+from steamcommerce_api.api import logger
+
+log = logger.Logger('edge.callbacks', 'edge.callbacks.log').get_logger()
+
+CALLBACK_PATH = '/edge/callback/task/'
+
+
+def sign_payload(secret, body):
+    return hmac.new(str(secret), body, hashlib.sha256).hexdigest()
+
+
+def verify_signature(secret, body, signature):
+    if not signature:
+        return False
+
+    return hmac.compare_digest(sign_payload(secret, body), str(signature))
+
+
+class EdgeCallbackHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        log.info(u'{0} {1}'.format(self.client_address[0], format % args))
+
+    def send_json(self, data, status_code=200):
+        body = json.dumps(data)
+
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.getheader('Content-Length') or 0)
+        body = self.rfile.read(length)
+
+        if self.path != CALLBACK_PATH:
+            return self.send_json({'success': False}, status_code=404)
+
+        if not verify_signature(self.server.secret, body, self.headers.getheader('X-Edge-Signature')):
+            log.error(u'Rejected task callback with a bad signature from {}'.format(self.client_address[0]))
+
+            return self.send_json({'success': False}, status_code=403)
+
+        try:
+            response = json.loads(body)
+        except ValueError:
+            return self.send_json({'success': False}, status_code=400)
+
+        if not isinstance(response, dict) or not response.get('task_id'):
+            return self.send_json({'success': False}, status_code=400)
+
+        try:
+            processed = self.server.edge_controller.process_task_callback(response['task_id'], response)
+        except:
+            rollbar.report_exc_info()
+
+            log.exception(u'Task callback for {} raised an exception'.format(response['task_id']))
+
+            return self.send_json({'success': False}, status_code=500)
+
+        if processed is None:
+            return self.send_json({'success': False}, status_code=404)
+
+        if processed is False:
+            return self.send_json({'success': False}, status_code=409)
+
+        self.send_json({'success': True})
+
+
+class EdgeCallbackServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, edge_controller, secret=None, host=None, port=None):
+        self.secret = secret or getattr(config, 'EDGE_CALLBACK_SECRET', None)
+
+        if not self.secret:
+            raise ValueError('EDGE_CALLBACK_SECRET is required to receive task callbacks')
+
+        host = host or getattr(config, 'EDGE_CALLBACK_HOST', '0.0.0.0')
+        port = getattr(config, 'EDGE_CALLBACK_PORT', 8090) if port is None else port
+
+        HTTPServer.__init__(self, (host, port), EdgeCallbackHandler)
+
+        self.edge_controller = edge_controller
+        self.thread = None
+
+    @property
+    def address(self):
+        return '{0}:{1}'.format(*self.server_address)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name='edge-callbacks')
+        self.thread.daemon = True
+        self.thread.start()
+
+        log.info(u'Receiving task callbacks on {}'.format(self.address))
+
+        return self.thread
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Receive task completions pushed by edge servers')
+
+    parser.add_argument('--host', default=None)
+    parser.add_argument('--port', type=int, default=None)
+
+    args = parser.parse_args()
+
+    rollbar.init(config.ROLLBAR_TOKEN, config.ROLLBAR_ENV)
+
+    server = EdgeCallbackServer(edge.EdgeController(config.OWNER_ID), host=args.host, port=args.port)
+    server.serve_forever()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+import time
+import signal
+import argparse
+import threading
+
+import config
+import rollbar
+import edge_http
+import friends_cache
+import wallet
+import metrics
+import task_schedule
+import edge_callbacks
+
+from controllers import edge
+
+from steamcommerce_api.api import logger
+from steamcommerce_api.core import models
+
+log = logger.Logger('edge.daemon', 'edge.daemon.log').get_logger()
+
+
+def process_tasks(edge_controller):
+    edge_controller.process_pending_tasks()
+
+
+def send_invitations(edge_controller):
+    edge_controller.unblock_blocked_bots()
+
+    edge_controller.send_invitations()
+    edge_controller.send_invitations(anticheat_policy=True)
+
+
+def push_relations(edge_controller):
+    edge_controller.push_relations()
+    edge_controller.push_relations(anticheat_policy=True)
+
+
+STAGES = [
+    ('tasks', process_tasks, 'EDGE_DAEMON_TASKS_INTERVAL', 30),
+    ('invitations', send_invitations, 'EDGE_DAEMON_INVITATIONS_INTERVAL', 60),
+    ('relations', push_relations, 'EDGE_DAEMON_RELATIONS_INTERVAL', 60),
+]
+
+# With callbacks enabled pushed task results are applied as they arrive, so the tasks
+# stage only reconciles the ones that were missed, on a much slower interval
+
+RECONCILE_INTERVALS = {
+    'tasks': ('EDGE_DAEMON_RECONCILE_INTERVAL', 600),
+}
+
+
+def get_stage_interval(name, interval_setting, default_interval, callbacks=False):
+    if callbacks and name in RECONCILE_INTERVALS.keys():
+        interval_setting, default_interval = RECONCILE_INTERVALS[name]
+
+    return getattr(config, interval_setting, default_interval)
+
+
+class EdgeStage(object):
+    '''
+    One pipeline stage run every interval seconds on its own thread and controller.
+    Cycles of a stage never overlap since its thread runs them one after the other,
+    and the objects shared between stages guard themselves.
+    '''
+
+    def __init__(self, name, func, edge_controller, interval, stop_event):
+        self.name = name
+        self.func = func
+        self.edge_controller = edge_controller
+        self.interval = interval
+        self.stop_event = stop_event
+
+        self.thread = None
+
+    def run_once(self):
+        started_at = time.time()
+
+        try:
+            self.func(self.edge_controller)
+        except IOError:
+            rollbar.report_message('Got an IOError in the {} stage'.format(self.name), 'warning')
+        except:
+            rollbar.report_exc_info()
+
+            log.exception(u'Stage {} raised an exception'.format(self.name))
+
+            # Drop this thread's connection, the next cycle reconnects if it went away
+
+            try:
+                models.database.close()
+            except:
+                pass
+
+        try:
+            metrics.write_textfile('daemon')
+        except Exception, e:
+            log.error(u'Could not write metrics after stage {0}: {1}'.format(self.name, e))
+
+        log.info(
+            u'Stage {0} finished in {1:.2f} seconds'.format(
+                self.name,
+                time.time() - started_at
+            )
+        )
+
+    def run(self):
+        while not self.stop_event.is_set():
+            self.run_once()
+            self.stop_event.wait(self.interval)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='edge-{}'.format(self.name))
+        self.thread.start()
+
+        return self.thread
+
+    def join(self):
+        if self.thread is not None:
+            self.thread.join()
+
+
+class EdgeDaemon(object):
+    '''
+    Runs the task, invitation and relation stages in one long-lived process.
+    Every stage shares the HTTP session pool, the edge server health registry,
+    the friends list cache, the task poll schedule, the Coinbase wallet and the
+    bitcoin checkout pipeline, and keeps its database connection between cycles.
+    '''
+
+    def __init__(self, owner_id, stage_names=None, callbacks=False, metrics_server=False):
+        self.owner_id = owner_id
+        self.stop_event = threading.Event()
+
+        self.http_client = edge_http.EdgeHttpClient()
+        self.friends_list_cache = friends_cache.FriendsListCache()
+        self.edge_task_schedule = task_schedule.EdgeTaskSchedule()
+        self.coinbase_wallet = wallet.CoinbaseWallet()
+        self.health_registry = None
+        self.checkout_pipeline = None
+
+        self.stages = []
+
+        for name, func, interval_setting, default_interval in STAGES:
+            if stage_names and name not in stage_names:
+                continue
+
+            edge_controller = edge.EdgeController(
+                self.owner_id,
+                http_client=self.http_client,
+                health_registry=self.health_registry,
+                friends_list_cache=self.friends_list_cache,
+                edge_task_schedule=self.edge_task_schedule,
+                coinbase_wallet=self.coinbase_wallet,
+                checkout_pipeline=self.checkout_pipeline
+            )
+
+            self.health_registry = edge_controller.health_registry
+            self.checkout_pipeline = edge_controller.checkout_pipeline
+
+            # Bot and relation gauges are read from the database, once per export
+
+            if not len(self.stages):
+                metrics.registry.add_collector(edge_controller.collect_metrics)
+
+            self.stages.append(
+                EdgeStage(
+                    name,
+                    func,
+                    edge_controller,
+                    get_stage_interval(name, interval_setting, default_interval, callbacks),
+                    self.stop_event
+                )
+            )
+
+        self.callback_server = None
+
+        if callbacks:
+            self.callback_server = edge_callbacks.EdgeCallbackServer(
+                edge.EdgeController(
+                    self.owner_id,
+                    http_client=self.http_client,
+                    health_registry=self.health_registry,
+                    friends_list_cache=self.friends_list_cache,
+                    edge_task_schedule=self.edge_task_schedule,
+                    coinbase_wallet=self.coinbase_wallet,
+                    checkout_pipeline=self.checkout_pipeline
+                )
+            )
+
+        self.metrics_server = None
+
+        if metrics_server:
+            self.metrics_server = metrics.MetricsServer()
+
+    def stop(self, signum=None, frame=None):
+        log.info(u'Stopping edge daemon')
+
+        self.stop_event.set()
+
+    def run_once(self):
+        for stage in self.stages:
+            stage.run_once()
+
+        if self.checkout_pipeline is not None:
+            self.checkout_pipeline.close()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        if self.health_registry is not None and getattr(config, 'EDGE_HEALTH_BACKGROUND', True):
+            self.health_registry.start()
+
+        if self.callback_server is not None:
+            self.callback_server.start()
+
+        if self.metrics_server is not None:
+            self.metrics_server.start()
+
+        for stage in self.stages:
+            log.info(u'Starting stage {0} every {1} seconds'.format(stage.name, stage.interval))
+
+            stage.start()
+
+        # Event.wait without a timeout would keep signals from being handled
+
+        while not self.stop_event.is_set():
+            self.stop_event.wait(1)
+
+        if self.callback_server is not None:
+            self.callback_server.stop()
+
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+
+        for stage in self.stages:
+            stage.join()
+
+        if self.checkout_pipeline is not None:
+            self.checkout_pipeline.close()
+
+        if self.health_registry is not None:
+            self.health_registry.stop()
+
+        self.friends_list_cache.save()
+        self.edge_task_schedule.save()
+        self.http_client.close()
+
+        log.info(u'Edge daemon stopped')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the edge pipeline stages in one process')
+
+    parser.add_argument(
+        '--stage',
+        action='append',
+        choices=[name for name, func, interval_setting, default_interval in STAGES],
+        help='Run only this stage, may be given more than once'
+    )
+
+    parser.add_argument('--once', action='store_true', help='Run every stage once and exit')
+    parser.add_argument('--callbacks', action='store_true', help='Receive task callbacks from edge servers')
+    parser.add_argument('--metrics', action='store_true', help='Serve metrics on EDGE_METRICS_PORT')
+
+    args = parser.parse_args()
+
+    rollbar.init(config.ROLLBAR_TOKEN, config.ROLLBAR_ENV)
+
+    edge_daemon = EdgeDaemon(
+        config.OWNER_ID,
+        stage_names=args.stage,
+        callbacks=args.callbacks or getattr(config, 'EDGE_CALLBACK_ENABLED', False),
+        metrics_server=args.metrics or getattr(config, 'EDGE_METRICS_ENABLED', False)
+    )
+
+    if args.once:
+        edge_daemon.run_once()
+    else:
+        edge_daemon.run()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+import time
+import urlparse
+import requests
+import threading
+
+import enums
+import config
+import metrics
+
+from requests.adapters import HTTPAdapter
+
+from steamcommerce_api.api import logger
+
+log = logger.Logger('edge.http', 'edge.http.log').get_logger()
+
+
+class EdgeResponse(object):
+    def __init__(self, result, data=None, status_code=None, text=None, elapsed=None):
+        self.result = result
+        self.data = data
+        self.status_code = status_code
+        self.text = text
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.result == enums.EEdgeCallResult.Success
+
+    def __repr__(self):
+        return '<EdgeResponse {0} status_code={1}>'.format(repr(self.result), self.status_code)
+
+
+class EdgeHttpClient(object):
+    '''
+    Keeps one pooled keep-alive session per host (one per edge server) and
+    does the timeout, status code and JSON decoding handling for every call.
+    '''
+
+    def __init__(self, timeout=None, pool_size=None):
+        self.timeout = timeout or getattr(config, 'EDGE_HTTP_TIMEOUT', (10.0, 20.0))
+        self.pool_size = pool_size or getattr(config, 'EDGE_HTTP_POOL_SIZE', 4)
+
+        self.lock = threading.Lock()
+        self.sessions = {}
+
+    def get_session(self, url):
+        parsed_url = urlparse.urlparse(url)
+        host = '{0}://{1}'.format(parsed_url.scheme, parsed_url.netloc)
+
+        with self.lock:
+            if host not in self.sessions:
+                session = requests.Session()
+                session.mount(host, HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size))
+
+                self.sessions[host] = session
+
+            return self.sessions[host]
+
+    def request(self, method, url, name=None, decode=True, endpoint=None, server=None, **kwargs):
+        '''
+        name is how the remote end is called in logs, server and endpoint label its metrics
+        '''
+
+        name = name or urlparse.urlparse(url).netloc
+
+        edge_response = self.perform(method, url, name, decode, **kwargs)
+
+        metrics.record_http_call(
+            server or urlparse.urlparse(url).netloc,
+            endpoint or urlparse.urlparse(url).path,
+            edge_response
+        )
+
+        return edge_response
+
+    def perform(self, method, url, name, decode, **kwargs):
+        session = self.get_session(url)
+
+        kwargs.setdefault('timeout', self.timeout)
+        requested_at = time.time()
+
+        try:
+            req = session.request(method, url, **kwargs)
+        except requests.exceptions.Timeout:
+            log.error(u'{} timed out'.format(name))
+
+            return EdgeResponse(enums.EEdgeCallResult.Timeout, elapsed=time.time() - requested_at)
+        except Exception, e:
+            log.error(u'Unable to contact {0}, raised {1}'.format(name, e))
+
+            return EdgeResponse(enums.EEdgeCallResult.ConnectionFailed, elapsed=time.time() - requested_at)
+
+        elapsed = time.time() - requested_at
+
+        if req.status_code != 200:
+            log.error(u'Unable to contact {0}, received status code {1}'.format(name, req.status_code))
+
+            return EdgeResponse(
+                enums.EEdgeCallResult.BadStatusCode,
+                status_code=req.status_code,
+                text=req.text,
+                elapsed=elapsed
+            )
+
+        if not decode:
+            return EdgeResponse(
+                enums.EEdgeCallResult.Success,
+                status_code=req.status_code,
+                text=req.text,
+                elapsed=elapsed
+            )
+
+        try:
+            data = req.json()
+        except ValueError:
+            log.error(u'Unable to serialize response from {0}, received {1}'.format(name, req.text))
+
+            return EdgeResponse(
+                enums.EEdgeCallResult.InvalidResponse,
+                status_code=req.status_code,
+                text=req.text,
+                elapsed=elapsed
+            )
+
+        return EdgeResponse(
+            enums.EEdgeCallResult.Success,
+            data=data,
+            status_code=req.status_code,
+            text=req.text,
+            elapsed=elapsed
+        )
+
+    def get(self, url, name=None, **kwargs):
+        return self.request('GET', url, name=name, **kwargs)
+
+    def post(self, url, name=None, **kwargs):
+        return self.request('POST', url, name=name, **kwargs)
+
+    def edge_get(self, edge_server, url, **kwargs):
+        return self.get(url, name=u'Edge server #{}'.format(edge_server.id), server=str(edge_server.id), **kwargs)
+
+    def edge_post(self, edge_server, url, **kwargs):
+        return self.post(url, name=u'Edge server #{}'.format(edge_server.id), server=str(edge_server.id), **kwargs)
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+
+            self.sessions = {}
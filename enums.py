@@ -47,3 +47,23 @@ class ETransactionResult(IntEnum):
     TransIdNotFound = 4
     InsufficientFunds = 5
     TooManyPurchases = 6
+
+
+class EEdgeCallResult(IntEnum):
+    Success = 1
+    Timeout = 2
+    ConnectionFailed = 3
+    BadStatusCode = 4
+    InvalidResponse = 5
+
+
+class ECheckoutStage(IntEnum):
+    RequestingTransactionLink = 1
+    WaitingForTransactionLink = 2
+    FetchingInvoice = 3
+    ReservingFunds = 4
+    SendingMoney = 5
+    CommittingRelations = 6
+    ResettingCart = 7
+    Completed = 8
+    Failed = 9
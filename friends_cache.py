@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+import time
+import threading
+
+import state
+import config
+
+
+class FriendsListCache(object):
+    '''
+    GetFriendsList and GetSentInvitations snapshots per bot network_id, kept as
+    sets for O(1) membership checks and persisted between runs in EDGE_STATE_DIR.
+
+    Snapshots older than ttl seconds are refetched. Local mutations (an invitation
+    sent, an invitation accepted) are applied to the snapshots directly.
+    '''
+
+    def __init__(self, ttl=None, state_file=None):
+        self.ttl = ttl or getattr(config, 'EDGE_FRIENDS_CACHE_TTL', 300)
+        self.state_file = state_file or state.JsonStateFile('friends_cache')
+
+        self.lock = threading.RLock()
+
+        self.friends = {}
+        self.sent_invitations = {}
+
+        self.loaded = False
+
+    def load(self):
+        data = self.state_file.load()
+
+        with self.lock:
+            self.merge(data)
+
+            self.loaded = True
+
+    def merge(self, data):
+        '''
+        Takes every snapshot in data that is newer than the one held here
+        '''
+
+        for key, snapshots in (('friends', self.friends), ('sent_invitations', self.sent_invitations)):
+            for network_id, (fetched_at, steam_ids) in data.get(key, {}).items():
+                if network_id not in snapshots.keys() or snapshots[network_id][0] < fetched_at:
+                    snapshots[network_id] = (fetched_at, set(steam_ids))
+
+    def save(self):
+        # Other processes share the file, so the newest snapshot of each bot wins
+
+        def merge_snapshots(data):
+            with self.lock:
+                self.merge(data)
+
+                return {
+                    'friends': dict(
+                        (network_id, (fetched_at, list(steam_ids)))
+                        for network_id, (fetched_at, steam_ids) in self.friends.items()
+                    ),
+                    'sent_invitations': dict(
+                        (network_id, (fetched_at, list(steam_ids)))
+                        for network_id, (fetched_at, steam_ids) in self.sent_invitations.items()
+                    )
+                }
+
+        self.state_file.update(merge_snapshots)
+
+    def get_snapshot(self, snapshots, network_id):
+        with self.lock:
+            if not self.loaded:
+                self.load()
+
+            snapshot = snapshots.get(str(network_id))
+
+            if not snapshot:
+                return None
+
+            fetched_at, steam_ids = snapshot
+
+            if time.time() - fetched_at > self.ttl:
+                return None
+
+            return steam_ids
+
+    def get_friends(self, network_id):
+        return self.get_snapshot(self.friends, network_id)
+
+    def get_sent_invitations(self, network_id):
+        return self.get_snapshot(self.sent_invitations, network_id)
+
+    def set_friends(self, network_id, steam_ids):
+        steam_ids = set(int(steam_id) for steam_id in steam_ids)
+
+        with self.lock:
+            self.friends[str(network_id)] = (time.time(), steam_ids)
+
+            # Invitations that show up as friends have been accepted
+
+            if str(network_id) in self.sent_invitations.keys():
+                self.sent_invitations[str(network_id)][1].difference_update(steam_ids)
+
+        return steam_ids
+
+    def set_sent_invitations(self, network_id, steam_ids):
+        steam_ids = set(int(steam_id) for steam_id in steam_ids)
+
+        with self.lock:
+            self.sent_invitations[str(network_id)] = (time.time(), steam_ids)
+
+        return steam_ids
+
+    def add_sent_invitation(self, network_id, steam_id):
+        with self.lock:
+            if str(network_id) in self.sent_invitations.keys():
+                self.sent_invitations[str(network_id)][1].add(int(steam_id))
+
+    def get_known_network_ids(self, steam_id):
+        '''
+        network_ids of the bots whose friends list or sent invitations hold steam_id
+        '''
+
+        steam_id = int(steam_id)
+
+        with self.lock:
+            if not self.loaded:
+                self.load()
+
+            return [
+                network_id for network_id, (fetched_at, steam_ids) in self.friends.items() + self.sent_invitations.items()
+                if steam_id in steam_ids
+            ]
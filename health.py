@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+import time
+import threading
+
+import config
+
+from steamcommerce_api.api import logger
+
+log = logger.Logger('edge.health', 'edge.health.log').get_logger()
+
+
+class EdgeServerHealth(object):
+    def __init__(self, edge_server_id, healthy, delay=None, latency=None, checked_at=None):
+        self.edge_server_id = edge_server_id
+        self.healthy = healthy
+        self.delay = delay
+        self.latency = latency
+        self.checked_at = checked_at or time.time()
+
+    @property
+    def age(self):
+        return time.time() - self.checked_at
+
+    def __repr__(self):
+        return '<EdgeServerHealth #{0} healthy={1} delay={2}>'.format(
+            self.edge_server_id,
+            self.healthy,
+            self.delay
+        )
+
+
+class EdgeServerHealthRegistry(object):
+    '''
+    Caches healthcheck results per EdgeServer.id for ttl seconds.
+
+    probe is called as probe(edge_server) and returns an EdgeServerHealth.
+    When the background thread is running, lookups return the last known
+    result instead of probing, and only block for a server never probed before.
+    '''
+
+    def __init__(self, probe, ttl=None, interval=None):
+        self.probe = probe
+        self.ttl = ttl or getattr(config, 'EDGE_HEALTH_TTL', 30)
+        self.interval = interval or getattr(config, 'EDGE_HEALTH_INTERVAL', self.ttl / 2.0)
+
+        self.lock = threading.Lock()
+        self.health = {}
+        self.edge_servers = {}
+
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    @property
+    def background(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def get(self, edge_server_id):
+        with self.lock:
+            return self.health.get(edge_server_id)
+
+    def record(self, edge_server, edge_server_health):
+        with self.lock:
+            self.edge_servers[edge_server.id] = edge_server
+            self.health[edge_server.id] = edge_server_health
+
+        return edge_server_health
+
+    def refresh(self, edge_server):
+        return self.record(edge_server, self.probe(edge_server))
+
+    def check(self, edge_server):
+        edge_server_health = self.get(edge_server.id)
+
+        if edge_server_health is None:
+            return self.refresh(edge_server)
+
+        if self.background or edge_server_health.age < self.ttl:
+            return edge_server_health
+
+        return self.refresh(edge_server)
+
+    def is_healthy(self, edge_server):
+        return self.check(edge_server).healthy
+
+    def refresh_all(self):
+        with self.lock:
+            edge_servers = self.edge_servers.values()
+
+        for edge_server in edge_servers:
+            try:
+                self.refresh(edge_server)
+            except Exception, e:
+                log.error(u'Healthcheck on edge server #{0} raised {1}'.format(edge_server.id, e))
+
+    def run(self):
+        while not self.stop_event.is_set():
+            self.refresh_all()
+            self.stop_event.wait(self.interval)
+
+    def start(self):
+        if self.background:
+            return self.thread
+
+        self.stop_event.clear()
+
+        self.thread = threading.Thread(target=self.run, name='edge-health')
+        self.thread.daemon = True
+        self.thread.start()
+
+        return self.thread
+
+    def stop(self):
+        self.stop_event.set()
+
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
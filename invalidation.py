@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+import fnmatch
+import functools
+import threading
+
+import metrics
+
+from steamcommerce_api.api import logger
+from steamcommerce_api.caching import cache_layer
+
+log = logger.Logger('edge.invalidation', 'edge.invalidation.log').get_logger()
+
+
+def is_pattern(cache_key):
+    return '*' in cache_key or '?' in cache_key or '[' in cache_key
+
+
+class InvalidationBuffer(object):
+    '''
+    Collects cache keys and wildcard patterns instead of purging them right away.
+    Duplicates are dropped and exact keys already covered by a pattern are absorbed,
+    so a flush sends each key at most once in a single purge_cache_keys call.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+        self.keys = set()
+        self.patterns = set()
+
+        self.requested_purges = 0
+        self.requested_keys = 0
+
+        self.purges_saved = 0
+        self.keys_saved = 0
+
+    def add(self, cache_keys):
+        with self.lock:
+            self.requested_purges += 1
+
+            for cache_key in cache_keys:
+                self.requested_keys += 1
+
+                if is_pattern(cache_key):
+                    self.patterns.add(cache_key)
+                else:
+                    self.keys.add(cache_key)
+
+    def get_pending_keys(self):
+        patterns = [
+            pattern for pattern in self.patterns
+            if not any(
+                other != pattern and fnmatch.fnmatchcase(pattern, other) for other in self.patterns
+            )
+        ]
+
+        keys = [
+            cache_key for cache_key in self.keys
+            if not any(fnmatch.fnmatchcase(cache_key, pattern) for pattern in patterns)
+        ]
+
+        return sorted(patterns) + sorted(keys)
+
+    def flush(self):
+        with self.lock:
+            cache_keys = self.get_pending_keys()
+
+            requested_purges = self.requested_purges
+            requested_keys = self.requested_keys
+
+            self.keys = set()
+            self.patterns = set()
+
+            self.requested_purges = 0
+            self.requested_keys = 0
+
+        if len(cache_keys):
+            send_purge(cache_keys)
+
+            requested_purges -= 1
+
+        self.purges_saved += requested_purges
+        self.keys_saved += requested_keys - len(cache_keys)
+
+        return cache_keys
+
+
+class InvalidationState(threading.local):
+    '''
+    The buffer of the cycle running on the current thread. Threads never share a
+    buffer, so one thread's cycle neither holds back nor flushes another's purges.
+    '''
+
+    def __init__(self):
+        self.buffer = None
+        self.depth = 0
+
+
+state = InvalidationState()
+
+
+def send_purge(cache_keys):
+    '''
+    Every purge leaves through here, buffered or not
+    '''
+
+    cache_layer.purge_cache_keys(cache_keys)
+
+
+def purge_cache_keys(cache_keys):
+    if state.buffer:
+        state.buffer.add(cache_keys)
+    else:
+        send_purge(cache_keys)
+
+
+def flush_buffer(invalidation_buffer):
+    purges_saved = invalidation_buffer.purges_saved
+    keys_saved = invalidation_buffer.keys_saved
+
+    cache_keys = invalidation_buffer.flush()
+
+    metrics.edge_cache_purges_saved_total.inc(invalidation_buffer.purges_saved - purges_saved)
+    metrics.edge_cache_keys_saved_total.inc(invalidation_buffer.keys_saved - keys_saved)
+
+    return cache_keys
+
+
+def begin_cycle():
+    if not state.depth:
+        state.buffer = InvalidationBuffer()
+
+    state.depth += 1
+
+
+def end_cycle():
+    state.depth -= 1
+
+    if state.depth:
+        return None
+
+    invalidation_buffer = state.buffer
+    state.buffer = None
+
+    cache_keys = flush_buffer(invalidation_buffer)
+
+    log.info(
+        u'Purged {0} cache keys, saved {1} purges and {2} keys'.format(
+            len(cache_keys),
+            invalidation_buffer.purges_saved,
+            invalidation_buffer.keys_saved
+        )
+    )
+
+
+def buffered(func):
+    '''
+    Buffers every cache purge made while func runs and flushes them once it returns.
+    Nested buffered calls share the buffer of the outermost one on the same thread,
+    purges made on other threads are not held back by it.
+    '''
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        begin_cycle()
+
+        try:
+            return func(*args, **kwargs)
+        finally:
+            end_cycle()
+
+    return wrapper
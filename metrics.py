@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+'''
+Counters, gauges and histograms kept in-process and exposed in the Prometheus
+text format, either written to edge_<job>.prom in EDGE_METRICS_DIR (for node_exporter's
+textfile collector) or served on EDGE_METRICS_PORT at /metrics.
+
+Each job (process_tasks, push_relations, the daemon) writes its own file, and its
+samples carry an edge_job label so the collector never sees the same series twice.
+'''
+
+import os
+import bisect
+import tempfile
+import threading
+
+from BaseHTTPServer import HTTPServer
+from BaseHTTPServer import BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+import config
+
+from steamcommerce_api.api import logger
+
+log = logger.Logger('edge.metrics', 'edge.metrics.log').get_logger()
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TASK_BUCKETS = (5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+
+
+def escape_label_value(value):
+    return unicode(value).replace(u'\\', u'\\\\').replace(u'"', u'\\"').replace(u'\n', u'\\n')
+
+
+def format_labels(labelnames, labelvalues, extra=None):
+    labels = zip(labelnames, labelvalues) + list(extra or [])
+
+    if not len(labels):
+        return u''
+
+    return u'{' + u','.join(
+        u'{0}="{1}"'.format(labelname, escape_label_value(labelvalue)) for labelname, labelvalue in labels
+    ) + u'}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return u'+Inf'
+
+    return repr(float(value))
+
+
+class Metric(object):
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def get_key(self, labels):
+        return tuple(labels.get(labelname, u'') for labelname in self.labelnames)
+
+    def clear(self):
+        with self.lock:
+            self.values = {}
+
+    def get_samples(self, extra=None):
+        with self.lock:
+            return [
+                (self.name, format_labels(self.labelnames, key, extra), value)
+                for key, value in sorted(self.values.items())
+            ]
+
+    def render(self, extra=None):
+        lines = [
+            u'# HELP {0} {1}'.format(self.name, self.documentation),
+            u'# TYPE {0} {1}'.format(self.name, self.metric_type)
+        ]
+
+        for name, labels, value in self.get_samples(extra):
+            lines.append(u'{0}{1} {2}'.format(name, labels, format_value(value)))
+
+        return lines
+
+
+class Counter(Metric):
+    metric_type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.get_key(labels)
+
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    metric_type = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.get_key(labels)] = value
+
+
+class Histogram(Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        Metric.__init__(self, name, documentation, labelnames)
+
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self.get_key(labels)
+
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = ([0] * len(self.buckets), 0.0, 0)
+
+            bucket_counts, total, count = self.values[key]
+            bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+
+            self.values[key] = (bucket_counts, total + value, count + 1)
+
+    def get_samples(self, extra=None):
+        extra = list(extra or [])
+
+        samples = []
+
+        with self.lock:
+            for key, (bucket_counts, total, count) in sorted(self.values.items()):
+                cumulative = 0
+
+                for bucket, bucket_count in zip(self.buckets, bucket_counts):
+                    cumulative += bucket_count
+
+                    samples.append((
+                        self.name + '_bucket',
+                        format_labels(self.labelnames, key, extra + [('le', format_value(bucket))]),
+                        cumulative
+                    ))
+
+                samples.append((self.name + '_sum', format_labels(self.labelnames, key, extra), total))
+                samples.append((self.name + '_count', format_labels(self.labelnames, key, extra), count))
+
+        return samples
+
+
+class MetricsRegistry(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+
+        return metric
+
+    def add_collector(self, collector):
+        '''
+        collector() is called before every export, to refresh gauges read from the database
+        '''
+
+        with self.lock:
+            if collector not in self.collectors:
+                self.collectors.append(collector)
+
+    def collect(self):
+        with self.lock:
+            collectors = list(self.collectors)
+
+        for collector in collectors:
+            try:
+                collector()
+            except Exception, e:
+                log.error(u'Metrics collector {0} raised {1}'.format(collector, e))
+
+    def render(self, extra=None):
+        '''
+        extra label pairs are added to every sample
+        '''
+
+        self.collect()
+
+        with self.lock:
+            metrics = list(self.metrics)
+
+        lines = []
+
+        for metric in metrics:
+            lines.extend(metric.render(extra))
+
+        return u'\n'.join(lines) + u'\n'
+
+
+registry = MetricsRegistry()
+
+# server is the EdgeServer id, or a short fixed name (bitpay) for the external APIs
+
+edge_http_request_seconds = registry.register(Histogram(
+    'edge_http_request_seconds',
+    'Latency of HTTP calls to edge servers and external APIs',
+    ('server', 'endpoint')
+))
+
+edge_http_errors_total = registry.register(Counter(
+    'edge_http_errors_total',
+    'HTTP calls that did not return a usable response',
+    ('server', 'endpoint', 'result')
+))
+
+edge_server_delay_seconds = registry.register(Gauge(
+    'edge_server_delay_seconds',
+    'Delay reported by the edge server healthcheck',
+    ('server',)
+))
+
+edge_task_duration_seconds = registry.register(Histogram(
+    'edge_task_duration_seconds',
+    'Time from an EdgeTask being first seen PENDING until it finished',
+    ('task_name', 'task_status'),
+    buckets=TASK_BUCKETS
+))
+
+edge_relations = registry.register(Gauge(
+    'edge_relations',
+    'Unsent request relations per commitment level',
+    ('relation_type', 'commitment_level')
+))
+
+edge_cache_purges_saved_total = registry.register(Counter(
+    'edge_cache_purges_saved_total',
+    'Cache purge calls merged into another by invalidation buffering'
+))
+
+edge_cache_keys_saved_total = registry.register(Counter(
+    'edge_cache_keys_saved_total',
+    'Cache keys not purged since they were duplicates or covered by a pattern'
+))
+
+edge_bots = registry.register(Gauge(
+    'edge_bots',
+    'Edge bots per status',
+    ('currency_code', 'status')
+))
+
+
+def record_http_call(server, endpoint, edge_response):
+    edge_http_request_seconds.observe(edge_response.elapsed or 0.0, server=server, endpoint=endpoint)
+
+    if not edge_response.ok:
+        edge_http_errors_total.inc(server=server, endpoint=endpoint, result=edge_response.result.name)
+
+
+def write_textfile(job, metrics_dir=None):
+    '''
+    Writes the registry to edge_<job>.prom in metrics_dir through a unique temporary
+    file, so concurrent writers never interleave and the collector never reads half a file
+    '''
+
+    metrics_dir = metrics_dir or getattr(config, 'EDGE_METRICS_DIR', None)
+
+    if not metrics_dir:
+        return None
+
+    path = os.path.join(metrics_dir, 'edge_{}.prom'.format(job))
+
+    # Not ending in .prom, the collector skips it until it is renamed
+
+    descriptor, temporary_path = tempfile.mkstemp(prefix='.edge_{}.'.format(job), suffix='.tmp', dir=metrics_dir)
+
+    try:
+        with os.fdopen(descriptor, 'w') as metrics_file:
+            metrics_file.write(registry.render([('edge_job', job)]).encode('utf-8'))
+
+        os.chmod(temporary_path, 0644)
+        os.rename(temporary_path, path)
+    except:
+        os.unlink(temporary_path)
+
+        raise
+
+    return path
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_response(404)
+            self.end_headers()
+
+            return None
+
+        body = registry.render().encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        self.wfile.write(body)
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host=None, port=None):
+        host = host or getattr(config, 'EDGE_METRICS_HOST', '127.0.0.1')
+        port = getattr(config, 'EDGE_METRICS_PORT', 9108) if port is None else port
+
+        HTTPServer.__init__(self, (host, port), MetricsHandler)
+
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name='edge-metrics')
+        self.thread.daemon = True
+        self.thread.start()
+
+        log.info(u'Serving metrics on {0}:{1}'.format(*self.server_address))
+
+        return self.thread
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
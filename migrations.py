@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+from playhouse.migrate import migrate
+from playhouse.migrate import SchemaMigrator
+
+from steamcommerce_api.api import logger
+from steamcommerce_api.core import models
+
+log = logger.Logger('edge.migrations', 'edge.migrations.log').get_logger()
+
+# Columns filtered on by RelationController.get_relations
+
+RELATION_INDEXES = [
+    (models.ProductUserRequestRelation, ('commitment_level', 'sent')),
+    (models.ProductPaidRequestRelation, ('commitment_level', 'sent')),
+    (models.UserRequest, ('paid', 'visible', 'accepted')),
+    (models.PaidRequest, ('authed', 'visible', 'accepted')),
+]
+
+
+def get_index_columns(model, field_names):
+    return [model._meta.fields[field_name].db_column for field_name in field_names]
+
+
+def has_index(database, table, columns):
+    for index in database.get_indexes(table):
+        if list(index.columns) == list(columns):
+            return True
+
+    return False
+
+
+def add_indexes(indexes):
+    created = 0
+
+    for model, field_names in indexes:
+        database = model._meta.database
+        table = model._meta.db_table
+        columns = get_index_columns(model, field_names)
+
+        if has_index(database, table, columns):
+            log.info(u'Index on {0} ({1}) already exists'.format(table, ', '.join(columns)))
+
+            continue
+
+        log.info(u'Adding index on {0} ({1})'.format(table, ', '.join(columns)))
+
+        migrator = SchemaMigrator.from_database(database)
+        migrate(migrator.add_index(table, columns, False))
+
+        created += 1
+
+    return created
+
+
+def add_relation_indexes():
+    return add_indexes(RELATION_INDEXES)
+
+
+if __name__ == '__main__':
+    add_relation_indexes()
@@ -1,21 +1,48 @@
 #!/usr/bin/env python
 # -*- coding:Utf-8 -*-
 
+import argparse
+
 import config
 import rollbar
+import metrics
+import profiling
 
 from controllers import edge
 
 rollbar.init(config.ROLLBAR_TOKEN, config.ROLLBAR_ENV)
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Poll pending edge tasks')
+
+    parser.add_argument('--profile', action='store_true', help='Log a per-method breakdown of this run')
+    parser.add_argument('--profile-dump', help='Write cProfile stats of this run to this path')
+
+    args = parser.parse_args()
+
+    profiler = None
+
+    if args.profile or args.profile_dump or profiling.is_enabled():
+        profiler = profiling.Profiler(dump_path=args.profile_dump or profiling.get_dump_path())
+        profiler.begin_cycle()
+
     try:
         edge_controller = edge.EdgeController(
             config.OWNER_ID
         )
 
         edge_controller.process_pending_tasks()
+
+        # Let the checkouts started by this run get as far as they can before exiting
+
+        edge_controller.checkout_pipeline.close()
+
+        metrics.registry.add_collector(edge_controller.collect_metrics)
+        metrics.write_textfile('process_tasks')
     except IOError:
         rollbar.report_message('Got an IOError in the main loop', 'warning')
     except:
         rollbar.report_exc_info()
+    finally:
+        if profiler is not None:
+            profiler.end_cycle('process_tasks')
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+'''
+Opt-in profiling of controller cycles, enabled with EDGE_PROFILE (environment
+or config) or the --profile flag of process_tasks.py and push_relations.py.
+
+Every public EdgeController and RelationController method is timed, and the SQL
+queries, cache purges and HTTP calls made while it runs are counted against it.
+The hooks are installed by begin_cycle() and removed again by end_cycle().
+Figures are inclusive: a method's totals contain those of the methods it calls,
+and the wall time left once SQL and HTTP time are taken out is spent in Python.
+Methods that run on worker threads are timed on their own.
+'''
+
+import os
+import time
+import inspect
+import cProfile
+import functools
+import threading
+
+import config
+import edge_http
+import invalidation
+
+from controllers.edge import EdgeController
+from controllers.relations import RelationController
+
+from steamcommerce_api.api import logger
+from steamcommerce_api.core import models
+
+log = logger.Logger('edge.profiling', 'edge.profiling.log').get_logger()
+
+PROFILED_CLASSES = (EdgeController, RelationController)
+
+CYCLE_TOTAL = u'(cycle)'
+
+NOT_SET = object()
+
+
+def is_enabled():
+    value = os.environ.get('EDGE_PROFILE', getattr(config, 'EDGE_PROFILE', ''))
+
+    return str(value).lower() not in ('', '0', 'false', 'no', 'off')
+
+
+def get_dump_path():
+    return os.environ.get('EDGE_PROFILE_DUMP', getattr(config, 'EDGE_PROFILE_DUMP', None))
+
+
+class MethodStats(object):
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.0
+
+        self.queries = 0
+        self.query_seconds = 0.0
+
+        self.http_calls = 0
+        self.http_seconds = 0.0
+
+        self.purges = 0
+
+    @property
+    def python_seconds(self):
+        return max(self.wall - self.query_seconds - self.http_seconds, 0.0)
+
+
+class Profiler(object):
+    '''
+    Methods are timed on a stack per thread, so a call only counts against the
+    methods running on the thread that made it. A method that is already on the
+    stack (recursion) is not timed again.
+    '''
+
+    def __init__(self, dump_path=None):
+        self.dump_path = dump_path
+
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+        self.stats = {}
+        self.started_at = None
+
+        self.profile = None
+        self.originals = None
+
+    def get_stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+
+        return self.local.stack
+
+    def get_stats(self, name):
+        if name not in self.stats:
+            self.stats[name] = MethodStats()
+
+        return self.stats[name]
+
+    def record(self, **counts):
+        names = [CYCLE_TOTAL] + self.get_stack()
+
+        with self.lock:
+            for name in names:
+                method_stats = self.get_stats(name)
+
+                for field, value in counts.items():
+                    setattr(method_stats, field, getattr(method_stats, field) + value)
+
+    '''
+    Hooks
+    '''
+
+    def timed(self, name, func):
+        profiler = self
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            stack = profiler.get_stack()
+
+            if name in stack:
+                return func(*args, **kwargs)
+
+            stack.append(name)
+            started_at = time.time()
+
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stack.pop()
+
+                with profiler.lock:
+                    method_stats = profiler.get_stats(name)
+                    method_stats.calls += 1
+                    method_stats.wall += time.time() - started_at
+
+        wrapper.profiled = True
+
+        return wrapper
+
+    def counted(self, func, calls_field, seconds_field=None):
+        profiler = self
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started_at = time.time()
+
+            try:
+                return func(*args, **kwargs)
+            finally:
+                counts = {calls_field: 1}
+
+                if seconds_field:
+                    counts[seconds_field] = time.time() - started_at
+
+                profiler.record(**counts)
+
+        wrapper.profiled = True
+
+        return wrapper
+
+    def patch(self, owner, attribute, value):
+        '''
+        Sets owner.attribute to value, remembering what uninstall() puts back
+        '''
+
+        self.originals.append((owner, attribute, owner.__dict__.get(attribute, NOT_SET)))
+
+        setattr(owner, attribute, value)
+
+    def install(self):
+        '''
+        Wraps the controller methods, the SQL, purge and HTTP entry points
+        '''
+
+        if self.originals is not None:
+            return None
+
+        self.originals = []
+
+        for cls in PROFILED_CLASSES:
+            for attribute, value in cls.__dict__.items():
+                if attribute.startswith('_') or not inspect.isfunction(value):
+                    continue
+
+                if getattr(value, 'profiled', False):
+                    continue
+
+                self.patch(cls, attribute, self.timed(u'{0}.{1}'.format(cls.__name__, attribute), value))
+
+        self.patch(models.database, 'execute_sql', self.counted(
+            models.database.execute_sql,
+            'queries',
+            seconds_field='query_seconds'
+        ))
+
+        self.patch(edge_http.EdgeHttpClient, 'perform', self.counted(
+            edge_http.EdgeHttpClient.perform.im_func,
+            'http_calls',
+            seconds_field='http_seconds'
+        ))
+
+        # Purges are counted where invalidation sends them, buffered or not
+
+        self.patch(invalidation, 'send_purge', self.counted(invalidation.send_purge, 'purges'))
+
+    def uninstall(self):
+        if self.originals is None:
+            return None
+
+        for owner, attribute, original in reversed(self.originals):
+            if original is NOT_SET:
+                delattr(owner, attribute)
+            else:
+                setattr(owner, attribute, original)
+
+        self.originals = None
+
+    '''
+    Cycles
+    '''
+
+    def begin_cycle(self):
+        self.install()
+
+        with self.lock:
+            self.stats = {}
+
+        self.started_at = time.time()
+
+        if self.dump_path:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    def end_cycle(self, cycle_name):
+        self.uninstall()
+
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile.dump_stats(self.dump_path)
+
+            log.info(u'Wrote cProfile stats of {0} to {1}'.format(cycle_name, self.dump_path))
+
+            self.profile = None
+
+        with self.lock:
+            self.get_stats(CYCLE_TOTAL).calls = 1
+            self.get_stats(CYCLE_TOTAL).wall = time.time() - self.started_at
+
+            stats = dict(self.stats)
+
+        for line in self.get_report(cycle_name, stats):
+            log.info(line)
+
+        return stats
+
+    def get_report(self, cycle_name, stats):
+        lines = [
+            u'Profile of {0}:'.format(cycle_name),
+            u'{0:<56} {1:>6} {2:>9} {3:>7} {4:>9} {5:>6} {6:>9} {7:>7} {8:>9}'.format(
+                u'method', u'calls', u'wall', u'queries', u'sql', u'http', u'http s', u'purges', u'python'
+            )
+        ]
+
+        for name, method_stats in sorted(stats.items(), key=lambda item: item[1].wall, reverse=True):
+            lines.append(
+                u'{0:<56} {1:>6} {2:>9.3f} {3:>7} {4:>9.3f} {5:>6} {6:>9.3f} {7:>7} {8:>9.3f}'.format(
+                    name,
+                    method_stats.calls,
+                    method_stats.wall,
+                    method_stats.queries,
+                    method_stats.query_seconds,
+                    method_stats.http_calls,
+                    method_stats.http_seconds,
+                    method_stats.purges,
+                    method_stats.python_seconds
+                )
+            )
+
+        return lines
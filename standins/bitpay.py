@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+'''
+Local stand-in for the Bitpay invoice API, so bitcoin checkouts can run offline.
+
+    python -m standins.bitpay --port 8081
+
+then set BITPAY_API_URL = 'http://127.0.0.1:8081' in config.
+'''
+
+import json
+import urlparse
+import argparse
+import threading
+
+from BaseHTTPServer import HTTPServer
+from BaseHTTPServer import BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+
+class BitpayStandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, data, status_code=200):
+        body = json.dumps(data)
+
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse.urlparse(self.path).path.rstrip('/')
+
+        if path.startswith('/invoices/'):
+            invoice = self.server.get_invoice(path[len('/invoices/'):])
+
+            if invoice is not None:
+                return self.send_json({'data': invoice})
+
+        self.send_json({'error': 'Object not found'}, status_code=404)
+
+
+class BitpayStandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0):
+        HTTPServer.__init__(self, (host, port), BitpayStandInHandler)
+
+        self.lock = threading.Lock()
+        self.invoices = {}
+
+    @property
+    def url(self):
+        return 'http://{0}:{1}'.format(*self.server_address)
+
+    def add_invoice(self, invoice_id, btc_due, bitcoin_address, price=10.0, currency='USD', status='new'):
+        with self.lock:
+            self.invoices[invoice_id] = {
+                'id': invoice_id,
+                'url': 'https://bitpay.com/i/{}'.format(invoice_id),
+                'status': status,
+                'btcDue': str(btc_due),
+                'price': price,
+                'currency': currency,
+                'bitcoinAddress': bitcoin_address
+            }
+
+        return self.invoices[invoice_id]
+
+    def set_invoice_status(self, invoice_id, status):
+        with self.lock:
+            self.invoices[invoice_id]['status'] = status
+
+    def get_invoice(self, invoice_id):
+        with self.lock:
+            return self.invoices.get(invoice_id)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        return thread
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in Bitpay invoice API')
+
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--invoices', help='JSON file mapping invoice_id to {btcDue, bitcoinAddress}')
+
+    args = parser.parse_args()
+
+    server = BitpayStandInServer(port=args.port)
+
+    if args.invoices:
+        with open(args.invoices) as invoices_file:
+            for invoice_id, invoice in json.load(invoices_file).items():
+                server.add_invoice(invoice_id, invoice['btcDue'], invoice['bitcoinAddress'])
+
+    server.serve_forever()
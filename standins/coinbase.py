@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+'''
+In-process stand-in for coinbase.wallet.client.Client, to be handed to
+wallet.CoinbaseWallet(client=CoinbaseStandInClient('1.5')) for offline checkouts.
+'''
+
+import uuid
+import decimal
+import threading
+
+
+class CoinbaseStandInError(Exception):
+    pass
+
+
+class CoinbaseStandInAccount(dict):
+    def __init__(self, client):
+        dict.__init__(self, id='primary', primary=True)
+
+        self.client = client
+
+    def get(self, key, default=None):
+        if key == 'balance':
+            return {'amount': str(self.client.balance), 'currency': 'BTC'}
+
+        return dict.get(self, key, default)
+
+    def send_money(self, to, amount, currency, idem=None):
+        return self.client.send_money(to, amount, currency, idem)
+
+
+class CoinbaseStandInClient(object):
+    '''
+    Keeps a BTC balance and the transactions sent from it. Sends sharing an idem
+    key return the first transaction instead of spending twice, like Coinbase does.
+    '''
+
+    def __init__(self, balance='1.0', btc_price='10000'):
+        self.balance = decimal.Decimal(balance)
+        self.btc_price = decimal.Decimal(btc_price)
+
+        self.lock = threading.Lock()
+
+        self.transactions = []
+        self.transactions_by_idem = {}
+
+        self.primary_account_reads = 0
+
+    def get_primary_account(self):
+        with self.lock:
+            self.primary_account_reads += 1
+
+        return CoinbaseStandInAccount(self)
+
+    def send_money(self, to, amount, currency, idem=None):
+        amount = decimal.Decimal(str(amount))
+
+        with self.lock:
+            if idem is not None and idem in self.transactions_by_idem:
+                return self.transactions_by_idem[idem]
+
+            if amount > self.balance:
+                raise CoinbaseStandInError('Insufficient funds')
+
+            self.balance -= amount
+
+            transaction = {
+                'id': str(uuid.uuid4()),
+                'to': to,
+                'amount': {'amount': str(amount), 'currency': currency},
+                'native_amount': {'amount': str(amount * self.btc_price), 'currency': 'USD'}
+            }
+
+            self.transactions.append(transaction)
+
+            if idem is not None:
+                self.transactions_by_idem[idem] = transaction
+
+        return transaction
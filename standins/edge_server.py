@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+'''
+Local stand-in for an edge server, so the controller can be exercised without real servers.
+
+    python -m standins.edge_server --port 8080 [--no-batch] [--callback-url URL --callback-secret SECRET]
+
+then point an EdgeServer row's ip_address at 127.0.0.1:8080. Setting batch_result to an
+EdgeResult value makes the batch endpoint reject every request with it.
+'''
+
+import hmac
+import json
+import time
+import hashlib
+import requests
+import urlparse
+import argparse
+import threading
+
+from BaseHTTPServer import HTTPServer
+from BaseHTTPServer import BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+import enums
+
+
+class EdgeStandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, data, status_code=200):
+        body = json.dumps(data)
+
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        self.wfile.write(body)
+
+    def read_form(self):
+        length = int(self.headers.getheader('Content-Length') or 0)
+        form = urlparse.parse_qs(self.rfile.read(length))
+
+        return dict((key, values[0]) for key, values in form.items())
+
+    def send_text(self, body, status_code=200):
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.record_request(self.path, self.client_address)
+
+        path = urlparse.urlparse(self.path).path
+
+        if path == '/edge/healthcheck':
+            if not self.server.healthy:
+                return self.send_text('Unavailable', status_code=503)
+
+            requested_at = float(self.headers.getheader('X-Requested-At') or time.time())
+
+            return self.send_text(str(max(time.time() - requested_at, 0)))
+
+        self.send_json({'success': False}, status_code=404)
+
+    def do_POST(self):
+        self.server.record_request(self.path, self.client_address)
+
+        form = self.read_form()
+
+        if self.path == '/edge/task/state/':
+            return self.send_json(self.server.get_task_state(form.get('task_id')))
+
+        if self.path == '/edge/task/state/batch/' and self.server.batch:
+            if self.server.batch_result is not None:
+                return self.send_json({'success': False, 'result': self.server.batch_result})
+
+            try:
+                tasks = json.loads(form.get('tasks'))
+            except (TypeError, ValueError):
+                return self.send_json({
+                    'success': False,
+                    'result': enums.EdgeResult.ParamNotSerializable.value
+                })
+
+            return self.send_json({
+                'success': True,
+                'tasks': dict(
+                    (task.get('task_id'), self.server.get_task_state(task.get('task_id'))) for task in tasks
+                )
+            })
+
+        self.send_json({'success': False}, status_code=404)
+
+
+class EdgeStandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        task_states=None,
+        batch=True,
+        host='127.0.0.1',
+        port=0,
+        callback_url=None,
+        callback_secret=None
+    ):
+        HTTPServer.__init__(self, (host, port), EdgeStandInHandler)
+
+        self.batch = batch
+        self.batch_result = None
+        self.callback_url = callback_url
+        self.callback_secret = callback_secret
+        self.healthy = True
+        self.task_states = task_states or {}
+
+        self.lock = threading.Lock()
+        self.requests = []
+        self.connections = set()
+
+    @property
+    def address(self):
+        return '{0}:{1}'.format(*self.server_address)
+
+    def record_request(self, path, client_address):
+        with self.lock:
+            self.requests.append(path)
+            self.connections.add(client_address)
+
+    def set_task_state(self, task_id, task_status, task_result=None):
+        self.task_states[task_id] = {
+            'task_status': task_status,
+            'task_result': task_result
+        }
+
+        if self.callback_url and task_status not in ('PENDING', 'RUNNING'):
+            return self.push_task_state(task_id)
+
+    def push_task_state(self, task_id):
+        body = json.dumps(self.get_task_state(task_id))
+        signature = hmac.new(str(self.callback_secret), body, hashlib.sha256).hexdigest()
+
+        return requests.post(
+            self.callback_url,
+            data=body,
+            headers={'Content-Type': 'application/json', 'X-Edge-Signature': signature}
+        )
+
+    def get_task_state(self, task_id):
+        if task_id not in self.task_states:
+            return {'success': False, 'result': enums.EdgeResult.TaskNotFound.value}
+
+        task_state = {'success': True, 'task_id': task_id}
+        task_state.update(self.task_states[task_id])
+
+        return task_state
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        return thread
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in edge server')
+
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--no-batch', action='store_true', help='Answer the batch endpoint with 404')
+    parser.add_argument('--states', help='JSON file mapping task_id to {task_status, task_result}')
+    parser.add_argument('--callback-url', help='Push finished task states to this URL')
+    parser.add_argument('--callback-secret', help='EDGE_CALLBACK_SECRET used to sign pushed task states')
+
+    args = parser.parse_args()
+
+    task_states = None
+
+    if args.states:
+        with open(args.states) as states_file:
+            task_states = json.load(states_file)
+
+    server = EdgeStandInServer(
+        task_states=task_states,
+        batch=not args.no_batch,
+        port=args.port,
+        callback_url=args.callback_url,
+        callback_secret=args.callback_secret
+    )
+    server.serve_forever()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+import os
+import json
+import errno
+import fcntl
+import tempfile
+import threading
+import contextlib
+
+import config
+
+from steamcommerce_api.api import logger
+
+log = logger.Logger('edge.state', 'edge.state.log').get_logger()
+
+
+def get_state_dir():
+    state_dir = getattr(
+        config,
+        'EDGE_STATE_DIR',
+        os.path.join(os.path.expanduser('~'), '.steamcommerce_edge')
+    )
+
+    try:
+        os.makedirs(state_dir)
+    except OSError, e:
+        if e.errno != errno.EEXIST or not os.path.isdir(state_dir):
+            raise
+
+    return state_dir
+
+
+class JsonStateFile(object):
+    '''
+    Small JSON document kept in EDGE_STATE_DIR so state survives between runs.
+
+    Every process (cron runs, the daemon) shares the file, so reads and writes hold
+    an exclusive lock on <name>.lock, and writes go to a unique temporary file that
+    is renamed into place. update() reads, changes and writes the document under one
+    lock, for callers that merge their changes into what other processes wrote.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+
+    @property
+    def path(self):
+        return os.path.join(get_state_dir(), '{}.json'.format(self.name))
+
+    @property
+    def lock_path(self):
+        return os.path.join(get_state_dir(), '{}.lock'.format(self.name))
+
+    @contextlib.contextmanager
+    def locked(self):
+        with self.lock:
+            with open(self.lock_path, 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def read(self):
+        if not os.path.exists(self.path):
+            return {}
+
+        try:
+            with open(self.path) as state_file:
+                return json.load(state_file)
+        except (IOError, ValueError), e:
+            log.error(u'Unable to read state file {0}, raised {1}'.format(self.path, e))
+
+            return {}
+
+    def write(self, data):
+        descriptor, temporary_path = tempfile.mkstemp(
+            prefix='{}.'.format(self.name),
+            suffix='.tmp',
+            dir=get_state_dir()
+        )
+
+        try:
+            with os.fdopen(descriptor, 'w') as state_file:
+                json.dump(data, state_file)
+
+            os.rename(temporary_path, self.path)
+        except:
+            os.unlink(temporary_path)
+
+            raise
+
+    def load(self):
+        with self.locked():
+            return self.read()
+
+    def save(self, data):
+        with self.locked():
+            self.write(data)
+
+    def update(self, func):
+        '''
+        Calls func with the current document and writes back what it returns
+        '''
+
+        with self.locked():
+            data = func(self.read())
+            self.write(data)
+
+        return data
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+import time
+import threading
+
+import state
+import config
+
+# Seconds before the first poll, growth factor between polls, longest wait
+# between polls and how long a task may stay PENDING before it is expired
+
+DEFAULT_POLL_POLICY = {
+    'base': 15,
+    'factor': 2.0,
+    'max_interval': 600,
+    'deadline': 7200
+}
+
+POLL_POLICIES = {
+    'add_subids_to_cart': {
+        'base': 5,
+        'factor': 2.0,
+        'max_interval': 120,
+        'deadline': 1800
+    },
+    'checkout_cart': {
+        'base': 10,
+        'factor': 2.0,
+        'max_interval': 300,
+        'deadline': 3600
+    },
+    'get_external_link_from_transid': {
+        'base': 10,
+        'factor': 2.0,
+        'max_interval': 300,
+        'deadline': 3600
+    }
+}
+
+
+class EdgeTaskSchedule(object):
+    '''
+    When each PENDING EdgeTask is due for its next poll, with an exponential
+    backoff per task_name read from POLL_POLICIES and EDGE_TASK_POLL_POLICY.
+
+    EdgeTask rows belong to steamcommerce_api, so the schedule is kept by task_id
+    in a state file instead. A task missing from it is due right away and its
+    deadline starts counting from the moment it is first seen.
+
+    Every process shares the file, so save() only writes the entries changed or
+    forgotten here since the last save and takes every other entry from the file.
+    '''
+
+    def __init__(self, policies=None, state_file=None):
+        self.policies = dict(POLL_POLICIES)
+
+        for task_name, policy in (policies or getattr(config, 'EDGE_TASK_POLL_POLICY', {})).items():
+            self.policies[task_name] = dict(self.get_policy(task_name), **policy)
+
+        self.state_file = state_file or state.JsonStateFile('task_schedule')
+
+        self.lock = threading.RLock()
+
+        self.entries = {}
+        self.changed = set()
+        self.forgotten = set()
+
+        self.loaded = False
+
+    def get_policy(self, task_name):
+        return self.policies.get(task_name, DEFAULT_POLL_POLICY)
+
+    def load(self):
+        data = self.state_file.load()
+
+        with self.lock:
+            for task_id, entry in data.items():
+                self.entries.setdefault(task_id, entry)
+
+            self.loaded = True
+
+    def save(self):
+        def merge_entries(data):
+            with self.lock:
+                for task_id in self.forgotten:
+                    data.pop(task_id, None)
+
+                for task_id in self.changed:
+                    if task_id in self.entries.keys():
+                        data[task_id] = self.entries[task_id]
+
+                self.entries = dict((task_id, dict(entry)) for task_id, entry in data.items())
+
+                self.changed = set()
+                self.forgotten = set()
+
+                self.loaded = True
+
+                return data
+
+        self.state_file.update(merge_entries)
+
+    def change(self, task_id):
+        self.changed.add(task_id)
+        self.forgotten.discard(task_id)
+
+        return self.entries[task_id]
+
+    def get_entry(self, edge_task):
+        with self.lock:
+            if not self.loaded:
+                self.load()
+
+            task_id = str(edge_task.task_id)
+
+            if task_id not in self.entries:
+                now = time.time()
+
+                self.entries[task_id] = {
+                    'task_name': edge_task.task_name,
+                    'first_seen': now,
+                    'polls': 0,
+                    'next_poll_at': now
+                }
+
+                self.change(task_id)
+
+            return self.entries[task_id]
+
+    def add(self, edge_task):
+        '''
+        Schedules the first poll of a task that was just created
+        '''
+
+        with self.lock:
+            entry = self.get_entry(edge_task)
+            entry['next_poll_at'] = entry['first_seen'] + self.get_policy(edge_task.task_name)['base']
+
+            self.change(str(edge_task.task_id))
+
+            return entry
+
+    def is_expired(self, edge_task):
+        entry = self.get_entry(edge_task)
+
+        return time.time() - entry['first_seen'] > self.get_policy(edge_task.task_name)['deadline']
+
+    def is_due(self, edge_task):
+        entry = self.get_entry(edge_task)
+
+        return entry['next_poll_at'] <= time.time() or self.is_expired(edge_task)
+
+    def record_poll(self, edge_task):
+        '''
+        Pushes the next poll of a task that is still running further away
+        '''
+
+        policy = self.get_policy(edge_task.task_name)
+
+        with self.lock:
+            entry = self.get_entry(edge_task)
+            entry['polls'] += 1
+
+            interval = min(policy['base'] * policy['factor'] ** entry['polls'], policy['max_interval'])
+            entry['next_poll_at'] = time.time() + interval
+
+            self.change(str(edge_task.task_id))
+
+            return entry
+
+    def mark_processing(self, edge_task):
+        '''
+        Returns since when a task has been PROCESSING, counted from the first time this
+        schedule saw it in that status
+        '''
+
+        with self.lock:
+            entry = self.get_entry(edge_task)
+
+            if entry.get('processing_since') is None:
+                entry['processing_since'] = time.time()
+
+                self.change(str(edge_task.task_id))
+
+            return entry['processing_since']
+
+    def clear_processing(self, task_id):
+        '''
+        Makes a reclaimed task due for a poll right away
+        '''
+
+        with self.lock:
+            entry = self.entries.get(str(task_id))
+
+            if entry:
+                entry.pop('processing_since', None)
+                entry['next_poll_at'] = time.time()
+
+                self.change(str(task_id))
+
+            return entry
+
+    def get_processing_task_ids(self):
+        with self.lock:
+            if not self.loaded:
+                self.load()
+
+            return [
+                task_id for task_id, entry in self.entries.items() if entry.get('processing_since') is not None
+            ]
+
+    def retain(self, task_ids, seen_before):
+        '''
+        Forgets the entries first seen before seen_before whose task is not in task_ids,
+        those tasks were finished by another process
+        '''
+
+        task_ids = set(str(task_id) for task_id in task_ids)
+
+        with self.lock:
+            for task_id, entry in self.entries.items():
+                if task_id not in task_ids and entry['first_seen'] < seen_before:
+                    self.forget(task_id)
+
+    def forget(self, task_id):
+        with self.lock:
+            self.changed.discard(str(task_id))
+            self.forgotten.add(str(task_id))
+
+            return self.entries.pop(str(task_id), None)
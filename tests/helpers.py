@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+import shutil
+import decimal
+import datetime
+import tempfile
+import itertools
+import contextlib
+
+import config
+
+from peewee import SqliteDatabase
+from peewee import ForeignKeyField
+from peewee import BooleanField
+from peewee import DateTimeField
+from peewee import DateField
+from peewee import DecimalField
+from peewee import FloatField
+from peewee import IntegerField
+
+from playhouse.test_utils import test_database
+
+from steamcommerce_api.core import models
+
+MODELS = [
+    models.User,
+    models.Product,
+    models.UserRequest,
+    models.PaidRequest,
+    models.ProductUserRequestRelation,
+    models.ProductPaidRequestRelation,
+    models.EdgeServer,
+    models.EdgeBot,
+    models.EdgeTask,
+]
+
+sequence = itertools.count(1)
+
+
+def enter_context(test_case, context):
+    '''
+    Enters context for the rest of test_case, it is exited even when setUp fails later on
+    '''
+
+    value = context.__enter__()
+    test_case.addCleanup(context.__exit__, None, None, None)
+
+    return value
+
+
+@contextlib.contextmanager
+def sqlite_models():
+    '''
+    Binds the steamcommerce_api models used by the controllers to a fresh in-memory database
+    '''
+
+    with test_database(SqliteDatabase(':memory:'), MODELS, create_tables=True):
+        yield
+
+
+@contextlib.contextmanager
+def temporary_state_dir():
+    '''
+    Points EDGE_STATE_DIR at an empty directory for the duration of a test
+    '''
+
+    state_dir = tempfile.mkdtemp(prefix='steamcommerce_edge_tests.')
+    previous_state_dir = getattr(config, 'EDGE_STATE_DIR', None)
+
+    config.EDGE_STATE_DIR = state_dir
+
+    try:
+        yield state_dir
+    finally:
+        if previous_state_dir is None:
+            del config.EDGE_STATE_DIR
+        else:
+            config.EDGE_STATE_DIR = previous_state_dir
+
+        shutil.rmtree(state_dir)
+
+
+def get_placeholder(field):
+    if isinstance(field, ForeignKeyField):
+        return create(field.rel_model)
+
+    if isinstance(field, BooleanField):
+        return False
+
+    if isinstance(field, DateTimeField):
+        return datetime.datetime.now()
+
+    if isinstance(field, DateField):
+        return datetime.date.today()
+
+    if isinstance(field, DecimalField):
+        return decimal.Decimal(0)
+
+    if isinstance(field, (IntegerField, FloatField)):
+        return next(sequence)
+
+    return u'{0}-{1}'.format(field.name, next(sequence))
+
+
+def create(model, **values):
+    '''
+    Creates a row, filling the NOT NULL columns the test does not care about
+    '''
+
+    for name, field in model._meta.fields.items():
+        if name in values or field.primary_key or field.null or field.default is not None:
+            continue
+
+        values[name] = get_placeholder(field)
+
+    return model.create(**values)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+import datetime
+import unittest
+
+import enums
+import bot_pool
+import task_schedule
+
+from controllers.edge import EdgeController
+
+from steamcommerce_api.core import models
+
+from tests.helpers import create
+from tests.helpers import enter_context
+from tests.helpers import sqlite_models
+from tests.helpers import temporary_state_dir
+
+
+class EdgeBotPoolFlushTestCase(unittest.TestCase):
+    def setUp(self):
+        enter_context(self, sqlite_models())
+
+        self.edge_bots = [
+            create(
+                models.EdgeBot,
+                network_id=network_id,
+                currency_code='USD',
+                bot_type=enums.EEdgeBotType.Purchases.value,
+                status=enums.EEdgeBotStatus.StandingBy.value,
+                last_blocked_at=None
+            )
+            for network_id in ('bot-1', 'bot-2', 'bot-3')
+        ]
+
+        self.edge_bot_pool = bot_pool.EdgeBotPool(
+            models.EdgeBot,
+            models.EdgeTask,
+            models.EdgeServer,
+            datetime.datetime.now() - datetime.timedelta(hours=1)
+        ).load()
+
+    def get_status(self, network_id):
+        return models.EdgeBot.get(network_id=network_id).status
+
+    def test_flush_writes_pooled_statuses(self):
+        self.edge_bot_pool.set_status('bot-1', enums.EEdgeBotStatus.PushingItemsToCart)
+        self.edge_bot_pool.set_status('bot-2', enums.EEdgeBotStatus.PushingItemsToCart)
+
+        self.edge_bot_pool.flush()
+
+        self.assertEqual(self.get_status('bot-1'), enums.EEdgeBotStatus.PushingItemsToCart.value)
+        self.assertEqual(self.get_status('bot-2'), enums.EEdgeBotStatus.PushingItemsToCart.value)
+        self.assertEqual(self.get_status('bot-3'), enums.EEdgeBotStatus.StandingBy.value)
+
+    def test_flush_keeps_statuses_changed_since_load(self):
+        self.edge_bot_pool.set_status('bot-1', enums.EEdgeBotStatus.PurchasingCart)
+        self.edge_bot_pool.set_status('bot-2', enums.EEdgeBotStatus.PurchasingCart)
+
+        # A checkout finishing on another thread writes straight to the row
+
+        models.EdgeBot.update(
+            status=enums.EEdgeBotStatus.WaitingForSufficientFunds.value
+        ).where(
+            models.EdgeBot.network_id == 'bot-2'
+        ).execute()
+
+        self.edge_bot_pool.flush()
+
+        self.assertEqual(self.get_status('bot-1'), enums.EEdgeBotStatus.PurchasingCart.value)
+        self.assertEqual(self.get_status('bot-2'), enums.EEdgeBotStatus.WaitingForSufficientFunds.value)
+
+    def test_flush_skips_statuses_back_to_where_they_were_loaded(self):
+        self.edge_bot_pool.set_status('bot-1', enums.EEdgeBotStatus.PushingItemsToCart)
+        self.edge_bot_pool.set_status('bot-1', enums.EEdgeBotStatus.StandingBy)
+
+        models.EdgeBot.update(
+            status=enums.EEdgeBotStatus.PurchasingCart.value
+        ).where(
+            models.EdgeBot.network_id == 'bot-1'
+        ).execute()
+
+        self.edge_bot_pool.flush()
+
+        self.assertEqual(self.get_status('bot-1'), enums.EEdgeBotStatus.PurchasingCart.value)
+
+    def test_flush_writes_each_bot_its_own_block_time(self):
+        first_block = datetime.datetime(2016, 1, 1, 10, 0, 0)
+        second_block = datetime.datetime(2016, 1, 1, 11, 0, 0)
+
+        self.edge_bot_pool.set_block_time('bot-1', first_block)
+        self.edge_bot_pool.set_block_time('bot-2', second_block)
+
+        self.edge_bot_pool.flush()
+
+        self.assertEqual(models.EdgeBot.get(network_id='bot-1').last_blocked_at, first_block)
+        self.assertEqual(models.EdgeBot.get(network_id='bot-2').last_blocked_at, second_block)
+        self.assertIsNone(models.EdgeBot.get(network_id='bot-3').last_blocked_at)
+
+
+class InvitationRoutingTestCase(unittest.TestCase):
+    def setUp(self):
+        enter_context(self, temporary_state_dir())
+
+        enter_context(self, sqlite_models())
+
+        self.edge_server = create(models.EdgeServer, currency_code='USD', status=enums.EEdgeServerStatus.Enabled.value)
+
+        for network_id in ('bot-1', 'bot-2', 'bot-3'):
+            create(
+                models.EdgeBot,
+                network_id=network_id,
+                currency_code='USD',
+                bot_type=enums.EEdgeBotType.Purchases.value,
+                status=enums.EEdgeBotStatus.StandingBy.value,
+                last_blocked_at=None
+            )
+
+        self.edge_controller = EdgeController(1, edge_task_schedule=task_schedule.EdgeTaskSchedule())
+        self.edge_controller.get_edge_server_for_bot = lambda edge_bot: self.edge_server
+
+        self.edge_controller.edge_bot_pool = bot_pool.EdgeBotPool(
+            models.EdgeBot,
+            models.EdgeTask,
+            models.EdgeServer,
+            self.edge_controller.get_block_threshold()
+        ).load()
+
+    def route(self, steam_id):
+        user = create(models.User, steam=steam_id)
+
+        edge_bot, edge_server, invitation_planned = self.edge_controller.route_invitation(
+            user,
+            'USD',
+            enums.EEdgeBotType.Purchases,
+            2
+        )
+
+        return edge_bot.network_id if edge_bot else None, invitation_planned
+
+    def test_invitations_are_spread_before_any_is_sent(self):
+        routes = [self.route(76561198000000000 + offset)[0] for offset in range(7)]
+
+        self.assertEqual(sorted(routes[:6]), ['bot-1', 'bot-1', 'bot-2', 'bot-2', 'bot-3', 'bot-3'])
+        self.assertEqual(len(set(routes[:3])), 3)
+
+        # Every bot has its invitation_limit planned
+
+        self.assertIsNone(routes[6])
+
+    def test_known_users_do_not_count_as_invitations(self):
+        self.edge_controller.friends_list_cache.set_friends('bot-2', [76561198000000000])
+
+        self.assertEqual(self.route(76561198000000000), ('bot-2', False))
+        self.assertEqual(self.edge_controller.edge_bot_pool.invitations.get('bot-2', 0), 0)
+
+
+    def test_users_a_bot_could_not_invite_go_to_another_bot(self):
+        user = create(models.User, steam='76561198000000000')
+
+        relation = create(
+            models.ProductUserRequestRelation,
+            request=create(models.UserRequest, user=user, paid=True, visible=True, accepted=False, assigned=None),
+            product=create(models.Product, sub_id=1000, price_currency='USD', has_anticheat=False),
+            commitment_level=enums.ERelationCommitment.Uncommited.value,
+            sent=False
+        )
+
+        # bot-1 already knows the user from a stale snapshot but cannot invite anyone anymore
+
+        self.edge_controller.friends_list_cache.set_friends('bot-1', [76561198000000000])
+
+        invitations = []
+
+        self.edge_controller.get_cached_friends_list = lambda edge_bot, edge_server: set()
+        self.edge_controller.get_cached_sent_invitations = lambda edge_bot, edge_server: set()
+        self.edge_controller.send_invitation = lambda edge_bot, edge_server, steam_id: invitations.append(
+            edge_bot.network_id
+        ) or edge_bot.network_id != 'bot-1'
+
+        self.edge_controller.send_invitations()
+
+        relation = models.ProductUserRequestRelation.get(id=relation.id)
+
+        self.assertEqual(invitations, ['bot-1', 'bot-2'])
+        self.assertEqual(relation.commited_on_bot, 'bot-2')
+        self.assertEqual(relation.commitment_level, enums.ERelationCommitment.WaitingForInviteAccept.value)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+import time
+import unittest
+
+import enums
+import wallet
+import checkout
+import edge_http
+import task_schedule
+
+from controllers.edge import EdgeController
+
+from standins.bitpay import BitpayStandInServer
+from standins.coinbase import CoinbaseStandInClient
+
+from steamcommerce_api.core import models
+
+from tests.helpers import create
+from tests.helpers import enter_context
+from tests.helpers import sqlite_models
+from tests.helpers import temporary_state_dir
+
+
+class CheckoutTestCase(unittest.TestCase):
+    def setUp(self):
+        enter_context(self, temporary_state_dir())
+
+        enter_context(self, sqlite_models())
+
+        self.bitpay_server = BitpayStandInServer()
+        self.bitpay_server.start()
+        self.addCleanup(self.bitpay_server.server_close)
+        self.addCleanup(self.bitpay_server.shutdown)
+
+        self.bitpay_server.add_invoice('invoice1', '0.5', 'address')
+
+        self.coinbase_client = CoinbaseStandInClient('1.0')
+
+        self.edge_server = create(models.EdgeServer, currency_code='USD', status=enums.EEdgeServerStatus.Enabled.value)
+
+        self.edge_bot = create(
+            models.EdgeBot,
+            network_id='bot-1',
+            currency_code='USD',
+            bot_type=enums.EEdgeBotType.Purchases.value,
+            status=enums.EEdgeBotStatus.PurchasingCart.value,
+            last_blocked_at=None
+        )
+
+        self.relation = create(
+            models.ProductUserRequestRelation,
+            commited_on_bot='bot-1',
+            shopping_cart_gid='cart-1',
+            commitment_level=enums.ERelationCommitment.AddedToCart.value,
+            sent=False
+        )
+
+        self.edge_controller = EdgeController(
+            1,
+            edge_task_schedule=task_schedule.EdgeTaskSchedule(),
+            coinbase_wallet=wallet.CoinbaseWallet(client=self.coinbase_client)
+        )
+
+        self.addCleanup(self.edge_controller.http_client.close)
+
+        # The edge server calls are recorded, stages are advanced here rather than on the pool
+
+        self.link_requests = []
+        self.reset_carts = []
+
+        self.edge_controller.get_transaction_link = self.request_transaction_link
+        self.edge_controller.reset_shopping_cart = lambda edge_bot, edge_server: self.reset_carts.append(
+            edge_bot.network_id
+        ) or True
+
+        self.pipeline = self.edge_controller.checkout_pipeline
+        self.pipeline.bitpay_api_url = self.bitpay_server.url
+        self.pipeline.submit = lambda shopping_cart_gid: None
+
+        self.pipeline.create_checkout(
+            'cart-1',
+            self.edge_bot.id,
+            self.edge_server.id,
+            enums.ECheckoutStage.RequestingTransactionLink,
+            transid='transid-1'
+        )
+
+    def request_transaction_link(self, edge_bot, edge_server, transid):
+        edge_task = create(
+            models.EdgeTask,
+            task_id='link-{}'.format(len(self.link_requests)),
+            task_name='get_external_link_from_transid',
+            task_status='PENDING',
+            edge_bot=edge_bot,
+            edge_server=edge_server
+        )
+
+        self.link_requests.append(edge_task)
+
+        return edge_task.id
+
+    def get_stage(self):
+        return enums.ECheckoutStage(self.pipeline.get_checkout('cart-1')['stage'])
+
+    def get_bot_status(self):
+        return models.EdgeBot.get(id=self.edge_bot.id).status
+
+
+class CheckoutPipelineTestCase(CheckoutTestCase):
+    def test_checkout_goes_through_every_stage(self):
+        self.assertEqual(self.pipeline.advance('cart-1'), enums.ECheckoutStage.WaitingForTransactionLink)
+        self.assertEqual(len(self.link_requests), 1)
+
+        self.pipeline.receive_transaction_link(self.link_requests[0], 'cart-1', 'https://bitpay.com/i/invoice1')
+
+        self.assertEqual(self.pipeline.advance('cart-1'), enums.ECheckoutStage.Completed)
+
+        relation = models.ProductUserRequestRelation.get(id=self.relation.id)
+
+        self.assertEqual(len(self.coinbase_client.transactions), 1)
+        self.assertEqual(self.coinbase_client.transactions[0]['to'], 'address')
+        self.assertEqual(relation.commitment_level, enums.ERelationCommitment.Purchased.value)
+        self.assertEqual(self.reset_carts, ['bot-1'])
+        self.assertEqual(self.get_bot_status(), enums.EEdgeBotStatus.StandingBy.value)
+
+    def test_failed_links_are_requested_again(self):
+        for attempt in range(self.pipeline.max_attempts - 1):
+            self.pipeline.advance('cart-1')
+
+            self.edge_controller.process_external_transaction(self.link_requests[-1], 2)
+
+            self.assertEqual(self.get_stage(), enums.ECheckoutStage.RequestingTransactionLink)
+
+            # The link is requested again once retry_at has come
+
+            self.pipeline.update_checkout('cart-1', retry_at=None)
+
+        self.pipeline.advance('cart-1')
+
+        self.edge_controller.process_external_transaction(self.link_requests[-1], {'shopping_cart_gid': 'cart-1'})
+
+        self.assertEqual(len(self.link_requests), self.pipeline.max_attempts)
+        self.assertEqual(self.get_stage(), enums.ECheckoutStage.Failed)
+        self.assertEqual(self.get_bot_status(), enums.EEdgeBotStatus.BlockedForUnknownReason.value)
+
+    def test_expired_link_task_is_requested_again(self):
+        self.pipeline.advance('cart-1')
+
+        self.assertTrue(self.edge_controller.fail_edge_task(self.link_requests[0], 'EXPIRED'))
+        self.assertEqual(self.get_stage(), enums.ECheckoutStage.RequestingTransactionLink)
+
+    def test_missing_link_is_requested_again_after_its_timeout(self):
+        self.pipeline.advance('cart-1')
+
+        checkout = self.pipeline.get_checkout('cart-1')
+
+        self.assertEqual(checkout['retry_at'], checkout['link_requested_at'] + self.pipeline.link_timeout)
+
+        self.pipeline.update_checkout(
+            'cart-1',
+            link_requested_at=time.time() - self.pipeline.link_timeout - 1,
+            retry_at=None
+        )
+
+        self.assertEqual(self.pipeline.advance('cart-1'), enums.ECheckoutStage.WaitingForTransactionLink)
+        self.assertEqual(self.get_stage(), enums.ECheckoutStage.RequestingTransactionLink)
+
+    def test_invoice_errors_count_as_failed_attempts(self):
+        self.pipeline.advance('cart-1')
+
+        self.pipeline.receive_transaction_link(self.link_requests[0], 'cart-1', 'https://bitpay.com/i/missing')
+
+        # Unknown invoice, then a response without data, then an exception
+
+        self.pipeline.advance('cart-1')
+
+        self.edge_controller.http_client.get = lambda url, **kwargs: edge_http.EdgeResponse(
+            enums.EEdgeCallResult.Success
+        )
+        self.pipeline.update_checkout('cart-1', retry_at=None)
+        self.pipeline.advance('cart-1')
+
+        self.edge_controller.http_client.get = lambda url, **kwargs: 1 / 0
+        self.pipeline.update_checkout('cart-1', retry_at=None)
+        self.pipeline.advance('cart-1')
+
+        self.assertEqual(self.pipeline.get_checkout('cart-1')['attempts'], 3)
+        self.assertEqual(self.get_stage(), enums.ECheckoutStage.FetchingInvoice)
+
+
+class SharedCheckoutsTestCase(CheckoutTestCase):
+    def setUp(self):
+        super(SharedCheckoutsTestCase, self).setUp()
+
+        # Another process (the callback server, the daemon) with its own pipeline
+
+        self.other_pipeline = checkout.BitcoinCheckoutPipeline(self.edge_controller)
+        self.other_pipeline.submit = lambda shopping_cart_gid: None
+
+    def test_checkouts_created_by_each_process_are_kept(self):
+        self.other_pipeline.start(self.edge_bot, self.edge_server, 'transid-2', 'cart-2')
+
+        self.pipeline.update_checkout('cart-1', retry_at=None)
+
+        self.assertEqual(sorted(self.pipeline.get_checkouts().keys()), ['cart-1', 'cart-2'])
+        self.assertEqual(sorted(self.other_pipeline.get_checkouts().keys()), ['cart-1', 'cart-2'])
+
+    def test_transitions_made_elsewhere_are_not_undone(self):
+        self.pipeline.advance('cart-1')
+
+        self.other_pipeline.receive_transaction_link(
+            self.link_requests[0],
+            'cart-1',
+            'https://bitpay.com/i/invoice1'
+        )
+
+        # A stale retry of the link no longer applies
+
+        self.assertFalse(self.pipeline.retry_transaction_link(self.pipeline.get_checkout('cart-1')))
+
+        self.assertEqual(self.get_stage(), enums.ECheckoutStage.FetchingInvoice)
+        self.assertEqual(self.pipeline.advance('cart-1'), enums.ECheckoutStage.Completed)
+        self.assertEqual(len(self.coinbase_client.transactions), 1)
+
+    def test_already_started_checkouts_are_not_restarted(self):
+        self.pipeline.advance('cart-1')
+
+        self.assertIsNone(self.other_pipeline.start(self.edge_bot, self.edge_server, 'transid-1', 'cart-1'))
+        self.assertEqual(self.get_stage(), enums.ECheckoutStage.WaitingForTransactionLink)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+import json
+import unittest
+import requests
+
+import edge_callbacks
+
+SECRET = 'callback-secret'
+
+
+class RecordingController(object):
+    '''
+    Stands in for EdgeController.process_task_callback, answering from known_tasks
+    '''
+
+    def __init__(self, known_tasks):
+        self.known_tasks = known_tasks
+        self.callbacks = []
+
+    def process_task_callback(self, task_id, response):
+        self.callbacks.append((task_id, response))
+
+        return self.known_tasks.get(task_id)
+
+
+class SignatureTestCase(unittest.TestCase):
+    def test_signed_body_is_accepted(self):
+        body = json.dumps({'task_id': 'abc'})
+
+        self.assertTrue(edge_callbacks.verify_signature(SECRET, body, edge_callbacks.sign_payload(SECRET, body)))
+
+    def test_tampered_body_is_rejected(self):
+        signature = edge_callbacks.sign_payload(SECRET, json.dumps({'task_id': 'abc'}))
+
+        self.assertFalse(edge_callbacks.verify_signature(SECRET, json.dumps({'task_id': 'abd'}), signature))
+
+    def test_other_secret_is_rejected(self):
+        body = json.dumps({'task_id': 'abc'})
+
+        self.assertFalse(edge_callbacks.verify_signature(SECRET, body, edge_callbacks.sign_payload('other', body)))
+
+    def test_missing_signature_is_rejected(self):
+        self.assertFalse(edge_callbacks.verify_signature(SECRET, '{}', None))
+        self.assertFalse(edge_callbacks.verify_signature(SECRET, '{}', ''))
+
+
+class EdgeCallbackServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.edge_controller = RecordingController({'pending': True, 'finished': False})
+
+        self.server = edge_callbacks.EdgeCallbackServer(
+            self.edge_controller,
+            secret=SECRET,
+            host='127.0.0.1',
+            port=0
+        )
+
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def post(self, data, signature=None, path=edge_callbacks.CALLBACK_PATH):
+        body = json.dumps(data)
+
+        if signature is None:
+            signature = edge_callbacks.sign_payload(SECRET, body)
+
+        return requests.post(
+            'http://{0}{1}'.format(self.server.address, path),
+            data=body,
+            headers={'X-Edge-Signature': signature}
+        )
+
+    def test_signed_callback_is_processed(self):
+        response = self.post({'success': True, 'task_id': 'pending', 'task_status': 'SUCCESS'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'success': True})
+        self.assertEqual(self.edge_controller.callbacks[0][0], 'pending')
+
+    def test_bad_signature_is_rejected_before_processing(self):
+        response = self.post({'success': True, 'task_id': 'pending'}, signature='0' * 64)
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.edge_controller.callbacks, [])
+
+    def test_missing_task_id_is_rejected(self):
+        self.assertEqual(self.post({'success': True}).status_code, 400)
+
+    def test_unknown_task_is_not_found(self):
+        self.assertEqual(self.post({'success': True, 'task_id': 'unknown'}).status_code, 404)
+
+    def test_task_no_longer_pending_conflicts(self):
+        self.assertEqual(self.post({'success': True, 'task_id': 'finished'}).status_code, 409)
+
+    def test_other_paths_are_not_found(self):
+        self.assertEqual(self.post({'task_id': 'pending'}, path='/edge/other/').status_code, 404)
+        self.assertEqual(self.edge_controller.callbacks, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
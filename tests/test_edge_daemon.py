@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+import unittest
+
+import config
+import edge_daemon
+
+from tests.helpers import enter_context
+from tests.helpers import temporary_state_dir
+
+
+class StageIntervalTestCase(unittest.TestCase):
+    def setUp(self):
+        enter_context(self, temporary_state_dir())
+
+        self.set_config('EDGE_CALLBACK_SECRET', 'secret')
+        self.set_config('EDGE_CALLBACK_HOST', '127.0.0.1')
+        self.set_config('EDGE_CALLBACK_PORT', 0)
+
+    def set_config(self, name, value):
+        if hasattr(config, name):
+            self.addCleanup(setattr, config, name, getattr(config, name))
+        else:
+            self.addCleanup(delattr, config, name)
+
+        setattr(config, name, value)
+
+    def get_intervals(self, callbacks):
+        daemon = edge_daemon.EdgeDaemon(1, callbacks=callbacks)
+        self.addCleanup(daemon.http_client.close)
+
+        if daemon.callback_server is not None:
+            self.addCleanup(daemon.callback_server.server_close)
+
+        return dict((stage.name, stage.interval) for stage in daemon.stages)
+
+    def test_tasks_are_polled_without_callbacks(self):
+        self.assertEqual(self.get_intervals(False), {'tasks': 30, 'invitations': 60, 'relations': 60})
+
+    def test_tasks_are_only_reconciled_with_callbacks(self):
+        self.assertEqual(self.get_intervals(True), {'tasks': 600, 'invitations': 60, 'relations': 60})
+
+    def test_reconcile_interval_setting(self):
+        self.set_config('EDGE_DAEMON_RECONCILE_INTERVAL', 900)
+
+        self.assertEqual(self.get_intervals(True)['tasks'], 900)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+import time
+import unittest
+
+import enums
+import task_schedule
+
+from controllers.edge import EdgeController
+
+from standins.edge_server import EdgeStandInServer
+
+from steamcommerce_api.core import models
+
+from tests.helpers import create
+from tests.helpers import enter_context
+from tests.helpers import sqlite_models
+from tests.helpers import temporary_state_dir
+
+
+class EdgeTaskTestCase(unittest.TestCase):
+    def setUp(self):
+        enter_context(self, temporary_state_dir())
+
+        enter_context(self, sqlite_models())
+
+        self.edge_server = create(models.EdgeServer, currency_code='USD', status=enums.EEdgeServerStatus.Enabled.value)
+
+        self.edge_bot = create(
+            models.EdgeBot,
+            network_id='bot-1',
+            currency_code='USD',
+            bot_type=enums.EEdgeBotType.Purchases.value,
+            status=enums.EEdgeBotStatus.PurchasingCart.value,
+            last_blocked_at=None
+        )
+
+        self.edge_task_schedule = task_schedule.EdgeTaskSchedule()
+        self.edge_controller = EdgeController(1, edge_task_schedule=self.edge_task_schedule)
+
+    def create_edge_task(self, task_id, task_name='checkout_cart', task_status='PENDING'):
+        return create(
+            models.EdgeTask,
+            task_id=task_id,
+            task_name=task_name,
+            task_status=task_status,
+            edge_bot=self.edge_bot,
+            edge_server=self.edge_server
+        )
+
+    def get_task_status(self, task_id):
+        return models.EdgeTask.get(task_id=task_id).task_status
+
+
+class ClaimTestCase(EdgeTaskTestCase):
+    def test_losing_the_claim_keeps_the_schedule_entry(self):
+        edge_task = self.create_edge_task('claimed')
+        self.edge_task_schedule.add(edge_task)
+
+        # A callback claimed the task between this poll's read and its claim
+
+        self.assertTrue(self.edge_controller.claim_edge_task(edge_task))
+
+        self.edge_controller.process_task_response(
+            edge_task,
+            {'success': True, 'task_status': 'SUCCESS', 'task_result': 1}
+        )
+
+        self.assertIn('claimed', self.edge_task_schedule.entries)
+        self.assertEqual(self.get_task_status('claimed'), 'PROCESSING')
+
+
+class ReclaimTestCase(EdgeTaskTestCase):
+    def test_recent_processing_tasks_are_left_alone(self):
+        self.create_edge_task('recent', task_status='PROCESSING')
+
+        self.assertEqual(self.edge_controller.reclaim_processing_tasks(), 0)
+        self.assertEqual(self.get_task_status('recent'), 'PROCESSING')
+
+    def test_stale_processing_tasks_go_back_to_pending(self):
+        edge_task = self.create_edge_task('stale', task_status='PROCESSING')
+
+        self.edge_task_schedule.mark_processing(edge_task)
+        self.edge_task_schedule.entries['stale']['processing_since'] = time.time() - 3600
+
+        self.assertEqual(self.edge_controller.reclaim_processing_tasks(), 1)
+        self.assertEqual(self.get_task_status('stale'), 'PENDING')
+        self.assertTrue(self.edge_task_schedule.is_due(edge_task))
+
+    def test_finished_tasks_stop_being_watched(self):
+        edge_task = self.create_edge_task('finished', task_status='PROCESSING')
+
+        self.edge_controller.reclaim_processing_tasks()
+
+        models.EdgeTask.update(task_status='SUCCESS').where(models.EdgeTask.task_id == 'finished').execute()
+
+        self.edge_controller.reclaim_processing_tasks()
+
+        self.assertNotIn('finished', self.edge_task_schedule.get_processing_task_ids())
+        self.assertNotIn(edge_task.task_id, self.edge_task_schedule.entries)
+
+
+class FailCheckoutTestCase(EdgeTaskTestCase):
+    def setUp(self):
+        super(FailCheckoutTestCase, self).setUp()
+
+        self.relation = create(
+            models.ProductUserRequestRelation,
+            commited_on_bot='bot-1',
+            shopping_cart_gid='cart-1',
+            commitment_level=enums.ERelationCommitment.AddedToCart.value,
+            sent=False
+        )
+
+        self.reset_carts = []
+        self.edge_controller.reset_shopping_cart = lambda edge_bot, edge_server: self.reset_carts.append(
+            edge_bot.network_id
+        )
+
+    def get_bot_status(self):
+        return models.EdgeBot.get(network_id='bot-1').status
+
+    def test_failed_checkout_empties_the_cart(self):
+        edge_task = self.create_edge_task('failed')
+        self.edge_task_schedule.add(edge_task)
+
+        self.edge_controller.process_task_response(
+            edge_task,
+            {'success': True, 'task_status': 'FAILURE', 'task_result': None}
+        )
+
+        relation = models.ProductUserRequestRelation.get(id=self.relation.id)
+
+        self.assertEqual(self.get_task_status('failed'), 'FAILURE')
+        self.assertEqual(relation.commitment_level, enums.ERelationCommitment.Uncommited.value)
+        self.assertIsNone(relation.commited_on_bot)
+        self.assertEqual(self.reset_carts, ['bot-1'])
+        self.assertEqual(self.get_bot_status(), enums.EEdgeBotStatus.StandingBy.value)
+
+    def test_failed_lookup_blocks_the_bot(self):
+        edge_task = self.create_edge_task('unknown')
+        self.edge_task_schedule.add(edge_task)
+
+        # The edge server no longer knows the task, the checkout may have gone through
+
+        self.edge_controller.process_task_response(edge_task, {'success': False})
+
+        relation = models.ProductUserRequestRelation.get(id=self.relation.id)
+
+        self.assertEqual(self.get_task_status('unknown'), 'FAILURE')
+        self.assertEqual(relation.commitment_level, enums.ERelationCommitment.AddedToCart.value)
+        self.assertEqual(relation.commited_on_bot, 'bot-1')
+        self.assertEqual(self.reset_carts, [])
+        self.assertEqual(self.get_bot_status(), enums.EEdgeBotStatus.BlockedForUnknownReason.value)
+
+    def test_expired_checkout_blocks_the_bot(self):
+        edge_task = self.create_edge_task('expired')
+
+        self.assertTrue(self.edge_controller.fail_edge_task(edge_task, 'EXPIRED'))
+
+        relation = models.ProductUserRequestRelation.get(id=self.relation.id)
+
+        self.assertEqual(self.get_task_status('expired'), 'EXPIRED')
+        self.assertEqual(relation.commitment_level, enums.ERelationCommitment.AddedToCart.value)
+        self.assertEqual(self.get_bot_status(), enums.EEdgeBotStatus.BlockedForUnknownReason.value)
+
+    def test_unreachable_server_is_polled_again(self):
+        edge_task = self.create_edge_task('unreachable')
+        self.edge_task_schedule.add(edge_task)
+
+        self.edge_controller.process_task_response(edge_task, None)
+
+        self.assertEqual(self.get_task_status('unreachable'), 'PENDING')
+        self.assertEqual(self.edge_task_schedule.entries['unreachable']['polls'], 1)
+        self.assertEqual(self.get_bot_status(), enums.EEdgeBotStatus.PurchasingCart.value)
+
+
+class TaskStatusBatchTestCase(EdgeTaskTestCase):
+    def start_edge_server(self, batch):
+        self.stand_in = EdgeStandInServer(batch=batch)
+        self.stand_in.start()
+        self.addCleanup(self.stand_in.server_close)
+        self.addCleanup(self.stand_in.shutdown)
+        self.addCleanup(self.edge_controller.http_client.close)
+
+        models.EdgeServer.update(ip_address=self.stand_in.address).where(
+            models.EdgeServer.id == self.edge_server.id
+        ).execute()
+
+        # Tasks without a callback, so only their status changes
+
+        for task_id, task_status in (('done', 'SUCCESS'), ('failed', 'FAILURE'), ('running', 'RUNNING')):
+            self.stand_in.set_task_state(task_id, task_status, task_result={'result': 1})
+
+        for task_id in ('done', 'failed', 'running', 'unknown'):
+            self.create_edge_task(task_id, task_name='reset_shopping_cart')
+
+    def get_task_polls(self):
+        return len([path for path in self.stand_in.requests if path == '/edge/task/state/'])
+
+    def get_batch_polls(self):
+        return len([path for path in self.stand_in.requests if path == '/edge/task/state/batch/'])
+
+    def assert_final_statuses(self):
+        self.assertEqual(self.get_task_status('done'), 'SUCCESS')
+        self.assertEqual(self.get_task_status('failed'), 'FAILURE')
+        self.assertEqual(self.get_task_status('running'), 'PENDING')
+        self.assertEqual(self.get_task_status('unknown'), 'FAILURE')
+        self.assertEqual(self.edge_task_schedule.entries['running']['polls'], 1)
+
+    def test_batched_lookup(self):
+        self.start_edge_server(batch=True)
+
+        self.edge_controller.process_pending_tasks()
+
+        self.assertEqual(self.get_batch_polls(), 1)
+        self.assertEqual(self.get_task_polls(), 0)
+        self.assert_final_statuses()
+
+    def test_servers_without_batches_are_polled_per_task(self):
+        self.start_edge_server(batch=False)
+
+        self.edge_controller.process_pending_tasks()
+
+        self.assertEqual(self.get_batch_polls(), 1)
+        self.assertEqual(self.get_task_polls(), 4)
+        self.assert_final_statuses()
+
+        # The batch endpoint is not tried again
+
+        self.edge_task_schedule.entries['running']['next_poll_at'] = 0
+
+        self.edge_controller.process_pending_tasks()
+
+        self.assertEqual(self.get_batch_polls(), 1)
+        self.assertEqual(self.get_task_polls(), 5)
+
+    def test_rejected_batch_is_polled_again_later(self):
+        self.start_edge_server(batch=True)
+        self.stand_in.batch_result = enums.EdgeResult.ParamNotSerializable.value
+
+        self.edge_controller.process_pending_tasks()
+
+        self.assertEqual(self.get_batch_polls(), 1)
+        self.assertEqual(self.get_task_polls(), 0)
+
+        for task_id in ('done', 'failed', 'running', 'unknown'):
+            self.assertEqual(self.get_task_status(task_id), 'PENDING')
+            self.assertEqual(self.edge_task_schedule.entries[task_id]['polls'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import metrics
+import edge_http
+import invalidation
+
+from standins.edge_server import EdgeStandInServer
+
+from steamcommerce_api.caching import cache_layer
+
+
+class RenderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.MetricsRegistry()
+
+    def test_counter_and_gauge(self):
+        counter = self.registry.register(metrics.Counter('calls_total', 'Calls', ('server',)))
+        gauge = self.registry.register(metrics.Gauge('delay_seconds', 'Delay'))
+
+        counter.inc(server='a')
+        counter.inc(2, server='a')
+        gauge.set(1.5)
+
+        self.assertEqual(self.registry.render(), u'\n'.join([
+            u'# HELP calls_total Calls',
+            u'# TYPE calls_total counter',
+            u'calls_total{server="a"} 3.0',
+            u'# HELP delay_seconds Delay',
+            u'# TYPE delay_seconds gauge',
+            u'delay_seconds 1.5'
+        ]) + u'\n')
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.registry.register(metrics.Histogram('duration_seconds', 'Duration', buckets=(1.0, 5.0)))
+
+        histogram.observe(0.5)
+        histogram.observe(1.0)
+        histogram.observe(10.0)
+
+        self.assertEqual(self.registry.render([('edge_job', 'tests')]).splitlines()[2:], [
+            u'duration_seconds_bucket{edge_job="tests",le="1.0"} 2.0',
+            u'duration_seconds_bucket{edge_job="tests",le="5.0"} 2.0',
+            u'duration_seconds_bucket{edge_job="tests",le="+Inf"} 3.0',
+            u'duration_seconds_sum{edge_job="tests"} 11.5',
+            u'duration_seconds_count{edge_job="tests"} 3.0'
+        ])
+
+    def test_label_values_are_escaped(self):
+        gauge = self.registry.register(metrics.Gauge('bots', 'Bots', ('status',)))
+
+        gauge.set(1, status=u'a "b"\\c\nd')
+
+        self.assertIn(u'bots{status="a \\"b\\"\\\\c\\nd"} 1.0', self.registry.render().splitlines())
+
+
+class WriteTextfileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.metrics_dir = tempfile.mkdtemp(prefix='steamcommerce_edge_tests.')
+        self.addCleanup(shutil.rmtree, self.metrics_dir)
+
+    def test_each_job_writes_its_own_file(self):
+        self.assertEqual(
+            metrics.write_textfile('process_tasks', self.metrics_dir),
+            os.path.join(self.metrics_dir, 'edge_process_tasks.prom')
+        )
+
+        metrics.write_textfile('push_relations', self.metrics_dir)
+
+        self.assertEqual(
+            sorted(os.listdir(self.metrics_dir)),
+            ['edge_process_tasks.prom', 'edge_push_relations.prom']
+        )
+
+        with open(os.path.join(self.metrics_dir, 'edge_push_relations.prom')) as metrics_file:
+            self.assertNotIn('edge_job="process_tasks"', metrics_file.read())
+
+
+class HttpLabelsTestCase(unittest.TestCase):
+    def test_edge_servers_are_labelled_by_id(self):
+        stand_in = EdgeStandInServer()
+        stand_in.start()
+        self.addCleanup(stand_in.server_close)
+        self.addCleanup(stand_in.shutdown)
+
+        http_client = edge_http.EdgeHttpClient()
+        self.addCleanup(http_client.close)
+
+        class EdgeServer(object):
+            id = 42
+
+        http_client.edge_get(EdgeServer(), 'http://{}/edge/healthcheck'.format(stand_in.address), decode=False)
+        http_client.edge_get(EdgeServer(), 'http://{}/edge/missing'.format(stand_in.address))
+
+        self.assertIn(('42', '/edge/healthcheck'), metrics.edge_http_request_seconds.values)
+        self.assertIn(('42', '/edge/missing', 'BadStatusCode'), metrics.edge_http_errors_total.values)
+
+
+class InvalidationSavingsTestCase(unittest.TestCase):
+    def setUp(self):
+        purge_cache_keys = cache_layer.purge_cache_keys
+        cache_layer.purge_cache_keys = lambda cache_keys: None
+        self.addCleanup(setattr, cache_layer, 'purge_cache_keys', purge_cache_keys)
+
+    def get_value(self, counter):
+        return counter.values.get((), 0)
+
+    def test_buffered_cycles_export_what_they_saved(self):
+        purges_saved = self.get_value(metrics.edge_cache_purges_saved_total)
+        keys_saved = self.get_value(metrics.edge_cache_keys_saved_total)
+
+        invalidation.begin_cycle()
+        invalidation.purge_cache_keys(['relation/*'])
+        invalidation.purge_cache_keys(['relation/1', 'relation/2'])
+        invalidation.purge_cache_keys(['relation/*'])
+        invalidation.end_cycle()
+
+        self.assertEqual(self.get_value(metrics.edge_cache_purges_saved_total) - purges_saved, 2)
+        self.assertEqual(self.get_value(metrics.edge_cache_keys_saved_total) - keys_saved, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
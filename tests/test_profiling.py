@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+import unittest
+
+import edge_http
+import profiling
+import invalidation
+
+from controllers.relations import RelationController
+
+from steamcommerce_api.core import models
+from steamcommerce_api.caching import cache_layer
+
+
+class ProfilerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.purged = []
+
+        purge_cache_keys = cache_layer.purge_cache_keys
+        cache_layer.purge_cache_keys = self.purged.append
+        self.addCleanup(setattr, cache_layer, 'purge_cache_keys', purge_cache_keys)
+
+        self.profiler = profiling.Profiler()
+        self.addCleanup(self.profiler.uninstall)
+
+    def test_end_cycle_restores_the_originals(self):
+        perform = edge_http.EdgeHttpClient.__dict__['perform']
+        send_purge = invalidation.send_purge
+        rollback = RelationController.__dict__['rollback_pushed_relations']
+
+        self.profiler.begin_cycle()
+
+        self.assertTrue(invalidation.send_purge.profiled)
+        self.assertIn('execute_sql', models.database.__dict__)
+
+        self.profiler.end_cycle('tests')
+
+        self.assertIs(edge_http.EdgeHttpClient.__dict__['perform'], perform)
+        self.assertIs(invalidation.send_purge, send_purge)
+        self.assertIs(RelationController.__dict__['rollback_pushed_relations'], rollback)
+        self.assertNotIn('execute_sql', models.database.__dict__)
+
+    def test_buffered_and_direct_purges_are_counted(self):
+        self.profiler.begin_cycle()
+
+        invalidation.purge_cache_keys(['a'])
+
+        invalidation.begin_cycle()
+        invalidation.purge_cache_keys(['b'])
+        invalidation.purge_cache_keys(['c'])
+        invalidation.end_cycle()
+
+        stats = self.profiler.end_cycle('tests')
+
+        self.assertEqual(self.purged, [['a'], ['b', 'c']])
+        self.assertEqual(stats[profiling.CYCLE_TOTAL].purges, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
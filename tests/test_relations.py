@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+import unittest
+import itertools
+
+import enums
+
+from playhouse.test_utils import count_queries
+
+from controllers.relations import RelationController
+
+from steamcommerce_api.core import models
+
+from tests.helpers import create
+from tests.helpers import enter_context
+from tests.helpers import sqlite_models
+
+
+class GetRelationsTestCase(unittest.TestCase):
+    def setUp(self):
+        enter_context(self, sqlite_models())
+
+        self.sub_ids = itertools.count(1000)
+        self.steam_ids = itertools.count(76561197960265728)
+
+        self.owner = create(models.User, steam=str(next(self.steam_ids)))
+
+    def create_product(self, **fields):
+        fields.setdefault('sub_id', next(self.sub_ids))
+        fields.setdefault('price_currency', 'USD')
+        fields.setdefault('has_anticheat', False)
+
+        return create(models.Product, **fields)
+
+    def create_relations(self, count, **product_fields):
+        relations = []
+
+        for _ in range(count):
+            user = create(models.User, steam=str(next(self.steam_ids)))
+
+            userrequest = create(
+                models.UserRequest,
+                user=user,
+                paid=True,
+                visible=True,
+                accepted=False,
+                assigned=None,
+                promotion=False
+            )
+
+            paidrequest = create(
+                models.PaidRequest,
+                user=user,
+                authed=True,
+                visible=True,
+                accepted=False,
+                assigned=None
+            )
+
+            relations.append(create(
+                models.ProductUserRequestRelation,
+                request=userrequest,
+                product=self.create_product(**product_fields),
+                commitment_level=enums.ERelationCommitment.Uncommited.value,
+                sent=False
+            ))
+
+            relations.append(create(
+                models.ProductPaidRequestRelation,
+                request=paidrequest,
+                product=self.create_product(**product_fields),
+                commitment_level=enums.ERelationCommitment.Uncommited.value,
+                sent=False
+            ))
+
+        return relations
+
+    def get_relations(self):
+        return RelationController().get_relations(
+            self.owner.id,
+            enums.ERelationCommitment.Uncommited.value
+        )
+
+    def test_query_count_does_not_grow_with_relations(self):
+        self.create_relations(3)
+
+        with count_queries() as few_relations:
+            self.get_relations()
+
+        self.create_relations(30)
+
+        with count_queries() as many_relations:
+            items = self.get_relations()
+
+        self.assertEqual(few_relations.count, 2)
+        self.assertEqual(many_relations.count, 2)
+
+        self.assertEqual(sum(len(user_items['USD']) for user_items in items.values()), 66)
+
+    def test_items_are_grouped_per_user_and_currency(self):
+        relations = self.create_relations(2)
+
+        items = self.get_relations()
+
+        for relation in relations:
+            user_id = relation.request.user.id
+            relation_type = 'A' if isinstance(relation, models.ProductUserRequestRelation) else 'C'
+
+            self.assertIn(
+                {
+                    'sub_id': relation.product.sub_id,
+                    'user_id': user_id,
+                    'relation_type': relation_type,
+                    'relation_id': relation.id
+                },
+                items[user_id]['USD']
+            )
+
+    def test_products_without_a_sub_id_are_skipped(self):
+        self.create_relations(1, sub_id=0, store_sub_id=None)
+        self.create_relations(1, sub_id=None, store_sub_id=None)
+        self.create_relations(1, sub_id=0, store_sub_id=2000)
+
+        items = self.get_relations()
+
+        self.assertEqual(
+            [item['sub_id'] for user_items in items.values() for item in user_items['USD']],
+            [2000]
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+import os
+import time
+import unittest
+import threading
+
+import state
+import friends_cache
+
+from tests.helpers import enter_context
+from tests.helpers import temporary_state_dir
+
+
+class JsonStateFileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.state_dir_path = enter_context(self, temporary_state_dir())
+
+    def test_missing_file_loads_empty(self):
+        self.assertEqual(state.JsonStateFile('missing').load(), {})
+
+    def test_updates_from_separate_instances_are_all_kept(self):
+        # One JsonStateFile per thread, like one per process, so only the file lock is shared
+
+        def increment(key):
+            for _ in range(25):
+                state.JsonStateFile('counters').update(
+                    lambda data: dict(data, **{key: data.get(key, 0) + 1})
+                )
+
+        threads = [threading.Thread(target=increment, args=(key,)) for key in ('a', 'b', 'c', 'd')]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(state.JsonStateFile('counters').load(), {'a': 25, 'b': 25, 'c': 25, 'd': 25})
+
+    def test_no_temporary_files_are_left_behind(self):
+        state.JsonStateFile('document').save({'key': 'value'})
+
+        self.assertEqual(sorted(os.listdir(self.state_dir_path)), ['document.json', 'document.lock'])
+
+
+class FriendsListCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        enter_context(self, temporary_state_dir())
+
+    def test_save_keeps_snapshots_of_other_processes(self):
+        first_cache = friends_cache.FriendsListCache(ttl=300)
+        second_cache = friends_cache.FriendsListCache(ttl=300)
+
+        first_cache.set_friends('bot-1', [1, 2])
+        second_cache.set_friends('bot-2', [3])
+
+        first_cache.save()
+        second_cache.save()
+
+        cache = friends_cache.FriendsListCache(ttl=300)
+
+        self.assertEqual(cache.get_friends('bot-1'), set([1, 2]))
+        self.assertEqual(cache.get_friends('bot-2'), set([3]))
+
+    def test_save_keeps_the_newest_snapshot(self):
+        stale_cache = friends_cache.FriendsListCache(ttl=300)
+        stale_cache.friends['bot-1'] = (time.time() - 60, set([1]))
+
+        fresh_cache = friends_cache.FriendsListCache(ttl=300)
+        fresh_cache.set_friends('bot-1', [1, 2])
+        fresh_cache.save()
+
+        stale_cache.save()
+
+        self.assertEqual(friends_cache.FriendsListCache(ttl=300).get_friends('bot-1'), set([1, 2]))
+        self.assertEqual(stale_cache.get_friends('bot-1'), set([1, 2]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+import time
+import unittest
+
+import task_schedule
+
+from steamcommerce_api.core import models
+
+from tests.helpers import create
+from tests.helpers import enter_context
+from tests.helpers import sqlite_models
+from tests.helpers import temporary_state_dir
+
+
+class EdgeTaskScheduleMergeTestCase(unittest.TestCase):
+    def setUp(self):
+        enter_context(self, temporary_state_dir())
+
+        enter_context(self, sqlite_models())
+
+        # Two processes sharing the same schedule file
+
+        self.first_schedule = task_schedule.EdgeTaskSchedule()
+        self.second_schedule = task_schedule.EdgeTaskSchedule()
+
+    def create_edge_task(self, task_id):
+        return create(models.EdgeTask, task_id=task_id, task_name='checkout_cart', task_status='PENDING')
+
+    def test_entries_forgotten_elsewhere_stay_forgotten(self):
+        edge_task = self.create_edge_task('forgotten')
+
+        self.first_schedule.add(edge_task)
+        self.first_schedule.save()
+
+        self.second_schedule.load()
+        self.second_schedule.forget('forgotten')
+        self.second_schedule.save()
+
+        self.first_schedule.add(self.create_edge_task('other'))
+        self.first_schedule.save()
+
+        self.assertNotIn('forgotten', self.first_schedule.state_file.load())
+        self.assertIn('other', self.first_schedule.state_file.load())
+
+    def test_newer_polls_are_not_overwritten(self):
+        edge_task = self.create_edge_task('polled')
+
+        self.first_schedule.add(edge_task)
+        self.first_schedule.save()
+
+        self.second_schedule.record_poll(edge_task)
+        self.second_schedule.save()
+
+        next_poll_at = self.second_schedule.entries['polled']['next_poll_at']
+
+        # The first process saves again without touching the entry
+
+        self.first_schedule.add(self.create_edge_task('other'))
+        self.first_schedule.save()
+
+        self.assertEqual(self.first_schedule.state_file.load()['polled']['next_poll_at'], next_poll_at)
+        self.assertEqual(self.first_schedule.entries['polled']['polls'], 1)
+
+    def test_retain_forgets_tasks_finished_elsewhere(self):
+        self.first_schedule.add(self.create_edge_task('finished'))
+        self.first_schedule.add(self.create_edge_task('running'))
+
+        self.first_schedule.retain(['running'], time.time() + 1)
+
+        self.assertEqual(self.first_schedule.entries.keys(), ['running'])
+
+
+if __name__ == '__main__':
+    unittest.main()
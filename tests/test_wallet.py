@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+import decimal
+import unittest
+
+import wallet
+
+from standins.coinbase import CoinbaseStandInClient
+
+from tests.helpers import enter_context
+from tests.helpers import temporary_state_dir
+
+
+class CoinbaseWalletTestCase(unittest.TestCase):
+    def setUp(self):
+        enter_context(self, temporary_state_dir())
+
+        self.client = CoinbaseStandInClient('1.0')
+
+        # Two processes sharing the same Coinbase account and reservations file
+
+        self.first_wallet = wallet.CoinbaseWallet(client=self.client)
+        self.second_wallet = wallet.CoinbaseWallet(client=self.client)
+
+    def test_reserve_and_release(self):
+        self.assertTrue(self.first_wallet.reserve('cart-1', '0.6'))
+        self.assertTrue(self.first_wallet.reserve('cart-1', '0.6'))
+        self.assertFalse(self.first_wallet.reserve('cart-2', '0.6'))
+
+        self.assertEqual(self.first_wallet.get_available_balance(), decimal.Decimal('0.4'))
+
+        self.assertEqual(self.first_wallet.release('cart-1')['amount'], '0.6')
+        self.assertIsNone(self.first_wallet.release('cart-1'))
+
+        self.assertTrue(self.first_wallet.reserve('cart-2', '0.6'))
+
+    def test_reservations_are_shared_between_processes(self):
+        self.assertTrue(self.first_wallet.reserve('cart-1', '0.6'))
+        self.assertFalse(self.second_wallet.reserve('cart-2', '0.6'))
+
+        self.first_wallet.release('cart-1')
+
+        self.assertTrue(self.second_wallet.reserve('cart-2', '0.6'))
+
+    def test_spent_funds_count_against_stale_balances(self):
+        self.assertEqual(self.second_wallet.get_available_balance(), decimal.Decimal('1.0'))
+
+        self.assertTrue(self.first_wallet.reserve('cart-1', '0.6'))
+
+        self.first_wallet.send_money('cart-1', 'address', '0.6')
+        self.first_wallet.commit('cart-1')
+
+        # Both cached balances predate the send, the spent reservation still counts
+
+        self.assertIsNone(self.first_wallet.release('cart-1'))
+        self.assertFalse(self.second_wallet.reserve('cart-2', '0.6'))
+        self.assertEqual(self.second_wallet.get_available_balance(), decimal.Decimal('0.4'))
+
+        # A fresh balance read already reflects the send
+
+        self.second_wallet.get_primary_account(refresh=True)
+
+        self.assertEqual(self.second_wallet.get_available_balance(), decimal.Decimal('0.4'))
+        self.assertEqual(self.client.primary_account_reads, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+import time
+import unittest
+import threading
+
+import workers
+
+
+class KeyConcurrency(object):
+    '''
+    Records the most calls seen running at once per key
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+        self.running = {}
+        self.peaks = {}
+
+    def call(self, item):
+        key = item % 3
+
+        with self.lock:
+            self.running[key] = self.running.get(key, 0) + 1
+            self.peaks[key] = max(self.peaks.get(key, 0), self.running[key])
+
+        time.sleep(0.01)
+
+        with self.lock:
+            self.running[key] -= 1
+
+        return item * 2
+
+
+class MapBoundedTestCase(unittest.TestCase):
+    def test_results_keep_the_order_of_items(self):
+        self.assertEqual(
+            workers.map_bounded(KeyConcurrency().call, range(20), lambda item: item % 3),
+            [item * 2 for item in range(20)]
+        )
+
+    def test_calls_per_key_are_capped(self):
+        key_concurrency = KeyConcurrency()
+
+        workers.map_bounded(key_concurrency.call, range(30), lambda item: item % 3, workers=8, per_key=2)
+
+        self.assertEqual(key_concurrency.peaks, {0: 2, 1: 2, 2: 2})
+
+    def test_hot_key_leaves_threads_for_other_keys(self):
+        started = []
+
+        def call(item):
+            started.append(item)
+
+            if item == 'cold':
+                return item
+
+            time.sleep(0.05)
+
+            return item
+
+        items = ['hot'] * 6 + ['cold']
+
+        workers.map_bounded(call, items, lambda item: item, workers=3, per_key=2)
+
+        self.assertIn('cold', started[:3])
+
+    def test_exceptions_are_raised(self):
+        def call(item):
+            if item == 3:
+                raise ValueError(item)
+
+            return item
+
+        self.assertRaises(ValueError, workers.map_bounded, call, range(6), lambda item: item)
+
+
+class ImapBoundedTestCase(unittest.TestCase):
+    def test_results_are_yielded_on_the_calling_thread(self):
+        calling_thread = threading.current_thread()
+        threads = set()
+
+        for item, result in workers.imap_bounded(KeyConcurrency().call, range(9), lambda item: item % 3):
+            threads.add(threading.current_thread())
+
+            self.assertEqual(result, item * 2)
+
+        self.assertEqual(threads, set([calling_thread]))
+
+    def test_every_item_is_yielded_once(self):
+        results = dict(workers.imap_bounded(KeyConcurrency().call, range(12), lambda item: item % 3))
+
+        self.assertEqual(results, dict((item, item * 2) for item in range(12)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+import time
+import decimal
+import threading
+
+import state
+import config
+
+from coinbase.wallet.client import Client
+
+from steamcommerce_api.api import logger
+
+log = logger.Logger('edge.wallet', 'edge.wallet.log').get_logger()
+
+
+class CoinbaseWallet(object):
+    '''
+    One Coinbase client and primary account per process, with the account balance
+    cached for balance_ttl seconds.
+
+    Funds for an invoice are reserved under a key (the shoppingCartGID) before they
+    are sent, and the available balance is the cached balance minus every open
+    reservation, so concurrent checkouts never spend the same funds twice.
+    Reservations are shared by every process through a locked file in EDGE_STATE_DIR
+    and lapse after reservation_ttl seconds. Spent ones are kept until every cached
+    balance read before the send has expired.
+    '''
+
+    def __init__(
+        self,
+        api_key=None,
+        api_secret=None,
+        balance_ttl=None,
+        reservation_ttl=None,
+        state_file=None,
+        client=None
+    ):
+        self.api_key = api_key or config.COINBASE_API_KEY
+        self.api_secret = api_secret or config.COINBASE_API_SECRET
+
+        self.balance_ttl = balance_ttl or getattr(config, 'EDGE_WALLET_BALANCE_TTL', 300)
+        self.reservation_ttl = reservation_ttl or getattr(config, 'EDGE_WALLET_RESERVATION_TTL', 3600)
+
+        self.state_file = state_file or state.JsonStateFile('wallet_reservations')
+
+        self.lock = threading.RLock()
+
+        self._client = client
+        self.primary_account = None
+
+        self.balance = None
+        self.balance_checked_at = None
+
+    @property
+    def client(self):
+        with self.lock:
+            if self._client is None:
+                self._client = Client(self.api_key, self.api_secret)
+
+            return self._client
+
+    def get_primary_account(self, refresh=False):
+        with self.lock:
+            if self.primary_account is None or refresh:
+                self.primary_account = self.client.get_primary_account()
+
+                self.balance = decimal.Decimal(self.primary_account.get('balance').get('amount'))
+                self.balance_checked_at = time.time()
+
+            return self.primary_account
+
+    def get_balance(self):
+        with self.lock:
+            if self.balance is None or time.time() - self.balance_checked_at > self.balance_ttl:
+                self.get_primary_account(refresh=True)
+
+            return self.balance
+
+    def drop_lapsed(self, reservations):
+        now = time.time()
+
+        for key, reservation in reservations.items():
+            if reservation.get('spent_at') is not None:
+                # Every balance read before the send is stale by now
+
+                if now - reservation['spent_at'] > self.balance_ttl:
+                    del reservations[key]
+            elif now - reservation['reserved_at'] > self.reservation_ttl:
+                log.info(u'Reservation of {0} BTC for {1} lapsed'.format(reservation['amount'], key))
+
+                del reservations[key]
+
+        return reservations
+
+    def get_reservations(self):
+        return self.drop_lapsed(self.state_file.load())
+
+    def get_reserved(self, reservations):
+        '''
+        Funds set aside by every process, plus the funds spent since the cached balance was read
+        '''
+
+        return sum(
+            (
+                decimal.Decimal(reservation['amount']) for reservation in reservations.values()
+                if reservation.get('spent_at') is None or reservation['spent_at'] >= self.balance_checked_at
+            ),
+            decimal.Decimal(0)
+        )
+
+    def get_available_balance(self):
+        with self.lock:
+            balance = self.get_balance()
+
+            return balance - self.get_reserved(self.get_reservations())
+
+    def reserve(self, key, amount):
+        '''
+        Sets amount aside for key, returns False when the available balance is short.
+        Reserving the same key again is a no-op.
+
+        The reservations are re-read and checked under the state file lock, so two
+        processes never reserve the same funds.
+        '''
+
+        key = str(key)
+        amount = decimal.Decimal(str(amount))
+
+        reserved = []
+
+        def add_reservation(reservations):
+            reservations = self.drop_lapsed(reservations)
+
+            if key in reservations:
+                reserved.append(True)
+            elif balance - self.get_reserved(reservations) >= amount:
+                reservations[key] = {'amount': str(amount), 'reserved_at': time.time()}
+
+                reserved.append(True)
+
+            return reservations
+
+        with self.lock:
+            balance = self.get_balance()
+
+            self.state_file.update(add_reservation)
+
+        return bool(reserved)
+
+    def release(self, key):
+        '''
+        Gives back the funds of a reservation whose send did not go through
+        '''
+
+        key = str(key)
+
+        released = []
+
+        def remove_reservation(reservations):
+            reservations = self.drop_lapsed(reservations)
+
+            if key in reservations and reservations[key].get('spent_at') is None:
+                released.append(reservations.pop(key))
+
+            return reservations
+
+        with self.lock:
+            self.state_file.update(remove_reservation)
+
+        return released[0] if released else None
+
+    def commit(self, key):
+        '''
+        Marks the reservation for key as spent once its send went through, without a
+        balance read. Every process keeps counting it against the balances it read
+        before the send, until those are refreshed.
+        '''
+
+        key = str(key)
+
+        committed = []
+
+        def spend_reservation(reservations):
+            reservations = self.drop_lapsed(reservations)
+
+            if key in reservations:
+                reservations[key].setdefault('spent_at', time.time())
+
+                committed.append(reservations[key])
+
+            return reservations
+
+        with self.lock:
+            self.state_file.update(spend_reservation)
+
+        return committed[0] if committed else None
+
+    def send_money(self, key, to_address, amount):
+        return self.get_primary_account().send_money(
+            to=to_address,
+            amount=amount,
+            currency='BTC',
+            idem=str(key)
+        )
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+import sys
+import Queue
+import threading
+import collections
+
+from multiprocessing.pool import ThreadPool
+
+
+class KeyedQueues(object):
+    '''
+    Items grouped per key (i.e. an edge server), each group drained in order by
+    at most limit workers so an over-limit item waits in its queue instead of
+    holding a pool thread.
+    '''
+
+    def __init__(self, limit):
+        self.limit = limit
+
+        self.lock = threading.Lock()
+        self.queues = collections.OrderedDict()
+
+    def add(self, key, entry):
+        if key not in self.queues:
+            self.queues[key] = collections.deque()
+
+        self.queues[key].append(entry)
+
+    def get_drainers(self):
+        '''
+        Keys to start a drainer for, interleaved across keys so every key gets
+        its first worker before any key gets a second one
+        '''
+
+        drainers = []
+
+        for round_number in range(self.limit):
+            for key, queue in self.queues.items():
+                if round_number < len(queue):
+                    drainers.append(key)
+
+        return drainers
+
+    def pop(self, key):
+        with self.lock:
+            queue = self.queues[key]
+
+            if not len(queue):
+                return None
+
+            return queue.popleft()
+
+
+def run_bounded(func, items, key_func, workers, per_key):
+    '''
+    Yields (position, item, result) on the calling thread as each call returns. An
+    exception raised by func is raised here, once the calls already running are done.
+    '''
+
+    keyed_queues = KeyedQueues(per_key)
+
+    for position, item in enumerate(items):
+        keyed_queues.add(key_func(item), (position, item))
+
+    results = Queue.Queue()
+
+    def drain(key):
+        while True:
+            entry = keyed_queues.pop(key)
+
+            if entry is None:
+                return None
+
+            position, item = entry
+
+            try:
+                results.put((position, item, func(item), None))
+            except Exception:
+                results.put((position, item, None, sys.exc_info()))
+
+    drainers = keyed_queues.get_drainers()
+
+    pool = ThreadPool(min(workers, len(drainers)))
+    pool.map_async(drain, drainers, chunksize=1)
+    pool.close()
+
+    try:
+        for _ in range(len(items)):
+            position, item, result, exc_info = results.get()
+
+            if exc_info is not None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+
+            yield position, item, result
+    finally:
+        pool.join()
+
+
+def map_bounded(func, items, key_func, workers=8, per_key=2):
+    '''
+    Calls func on every item from a bounded thread pool, never running more than
+    per_key calls for the same key_func(item) at once.
+
+    Results are returned in the same order as items.
+    '''
+
+    items = list(items)
+
+    if not len(items):
+        return []
+
+    if workers <= 1 or len(items) == 1:
+        return [func(item) for item in items]
+
+    results = [None] * len(items)
+
+    for position, item, result in run_bounded(func, items, key_func, workers, per_key):
+        results[position] = result
+
+    return results
+
+
+def imap_bounded(func, items, key_func, workers=8, per_key=2):
+    '''
+    Like map_bounded, but yields (item, result) on the calling thread as soon as each
+    call returns, so results can be applied while the other calls are still running.
+    '''
+
+    items = list(items)
+
+    if workers <= 1 or len(items) <= 1:
+        for item in items:
+            yield item, func(item)
+
+        return
+
+    for position, item, result in run_bounded(func, items, key_func, workers, per_key):
+        yield item, result